@@ -0,0 +1,84 @@
+"""
+Warm Claude Session Pool Benchmark
+
+Runs the same prompt on cold `claude` processes and on pooled warm sessions and reports the per-call latency.
+--gap is the pause between calls (excluded from the timings) so the pool can start the replacement session,
+as it does between real triage calls.
+
+Usage: python -m benchmarks.claude_pool_benchmark [--calls 10] [--gap 3] [--fake]
+       --fake uses benchmarks/fake_bin/claude (FAKE_CLAUDE_BOOT_SECONDS / FAKE_CLAUDE_WORK_SECONDS) instead of the real CLI
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from src.utils.claude_pool_utils import ClaudeSessionPool
+from src.utils.cmd_utils import AsyncProcessRunner
+
+FAKE_BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_bin")
+ARGS = ['-p', '--output-format', 'json']
+PROMPT = "請用一句話回答：1 + 1 等於多少？"
+
+
+def summarize(name: str, timings: list, extra: str = ""):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(
+        f"{name:<8} calls={len(timings):<4} p50={statistics.median(timings):>6.2f}s "
+        f"p95={p95:>6.2f}s mean={statistics.mean(timings):>6.2f}s {extra}"
+    )
+    return statistics.median(timings)
+
+
+async def measure_cold(calls: int, gap: float) -> list:
+    runner = AsyncProcessRunner("benchmark", 1)
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        result = await runner.run(['claude', *ARGS], input_text=PROMPT, timeout=300)
+        timings.append(time.perf_counter() - start)
+        assert result.returncode == 0, result.stderr
+        await asyncio.sleep(gap)
+    return timings
+
+
+async def measure_pool(calls: int, gap: float, size: int, max_uses: int) -> tuple:
+    pool = ClaudeSessionPool(AsyncProcessRunner("benchmark", 1), enabled=True, size=size, max_uses=max_uses)
+    pool.prewarm(ARGS)
+    # 第一個 session 的啟動時間不計入（服務啟動時就會預熱）
+    await asyncio.sleep(gap)
+    timings = []
+    try:
+        for _ in range(calls):
+            start = time.perf_counter()
+            result = await pool.run(ARGS, PROMPT, timeout=300)
+            timings.append(time.perf_counter() - start)
+            assert result.returncode == 0, result.stderr
+            await asyncio.sleep(gap)
+    finally:
+        stats = pool.stats()
+        await pool.close()
+    return timings, stats
+
+
+async def run(calls: int, gap: float, size: int, max_uses: int):
+    cold = await measure_cold(calls, gap)
+    pooled, stats = await measure_pool(calls, gap, size, max_uses)
+    cold_p50 = summarize("cold", cold)
+    pool_p50 = summarize("pooled", pooled, f"warm={stats['warm_hits']} cold={stats['cold_starts']}")
+    print(f"saved per call (p50): {cold_p50 - pool_p50:.2f}s ({1 - pool_p50 / cold_p50:.0%})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=10)
+    parser.add_argument("--gap", type=float, default=3, help="seconds between calls")
+    parser.add_argument("--size", type=int, default=1, help="warm sessions kept per argument set")
+    parser.add_argument("--max-uses", type=int, default=1, help="prompts per session before it is recycled")
+    parser.add_argument("--fake", action="store_true", help="use benchmarks/fake_bin/claude")
+    options = parser.parse_args()
+    if options.fake:
+        os.environ["PATH"] = FAKE_BIN_DIR + os.pathsep + os.environ.get("PATH", "")
+    asyncio.run(run(options.calls, options.gap, options.size, options.max_uses))
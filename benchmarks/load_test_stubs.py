@@ -0,0 +1,199 @@
+"""
+Stubs for the triage load test: a synthetic repository (with a prod tag and a local bare mirror), a seeded
+error corpus whose stack traces point into that repository, and a local HTTP server standing in for the
+Slack Web API and the GCP Error Reporting API.
+"""
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, Request
+
+MODULES = ["orders", "payments", "accounts", "reports", "search", "notifications", "inventory", "sessions"]
+COMPONENTS = ["OrderList", "PaymentForm", "AccountMenu", "ReportChart", "SearchBox", "Inbox"]
+AUTHORS = [("Alice Chen", "alice@example.com"), ("Bob Lin", "bob@example.com"), ("Carol Wu", "carol@example.com")]
+FUNCTIONS_PER_FILE = 6
+PLAIN_MESSAGES = [
+    "客戶回報 {module} 頁面一直轉圈圈，重新整理後仍然無法載入",
+    "{module} 匯出的 CSV 少了最後一天的資料",
+    "用戶反映 {module} 的通知重複寄送兩次",
+]
+
+
+def python_source(module: str) -> str:
+    lines = ["import logging", "", "logger = logging.getLogger(__name__)", ""]
+    for index in range(FUNCTIONS_PER_FILE):
+        lines.extend([
+            "",
+            f"def handle_{module}_{index}(payload):",
+            f'    """Handle step {index} of the {module} flow"""',
+            "    items = payload.get('items') or []",
+            "    total = 0",
+            "    for item in items:",
+            "        total += item['amount'] * item.get('quantity', 1)",
+            f"    logger.info('{module} step {index}: %s', total)",
+            "    return {'total': total, 'count': len(items)}",
+        ])
+    return "\n".join(lines) + "\n"
+
+
+def component_source(component: str) -> str:
+    lines = ["import React from 'react';", ""]
+    for index in range(FUNCTIONS_PER_FILE):
+        lines.extend([
+            f"export function render{component}{index}(props) {{",
+            "  const rows = props.data.rows.map((row) => row.id);",
+            "  return rows.length ? rows.join(',') : null;",
+            "}",
+            "",
+        ])
+    return "\n".join(lines)
+
+
+def function_line(index: int, python: bool) -> int:
+    """Line of the statement that fails inside function `index` of a generated file"""
+    return 5 + index * 9 + 6 if python else 3 + index * 5 + 1
+
+
+def git(args: List[str], cwd: str, author: Optional[tuple] = None):
+    env = dict(os.environ)
+    if author:
+        env.update({
+            "GIT_AUTHOR_NAME": author[0], "GIT_AUTHOR_EMAIL": author[1],
+            "GIT_COMMITTER_NAME": author[0], "GIT_COMMITTER_EMAIL": author[1],
+        })
+    subprocess.run(['git', *args], cwd=cwd, env=env, check=True, capture_output=True)
+
+
+def create_repository(root: str) -> str:
+    """Create the synthetic source repository with a prod tag and its bare mirror; returns the mirror path"""
+    source_dir = os.path.join(root, "source")
+    mirror_dir = os.path.join(root, "mirror.git")
+    os.makedirs(os.path.join(source_dir, "src", "services"), exist_ok=True)
+    os.makedirs(os.path.join(source_dir, "web", "components"), exist_ok=True)
+    git(['init', '-q', '-b', 'master'], source_dir)
+    # 每個作者各提交一部分檔案，讓 blame / ownership 有多位候選人
+    for index, module in enumerate(MODULES):
+        with open(os.path.join(source_dir, "src", "services", f"{module}.py"), "w") as f:
+            f.write(python_source(module))
+        git(['add', '.'], source_dir)
+        git(['commit', '-q', '-m', f"Add {module} service"], source_dir, AUTHORS[index % len(AUTHORS)])
+    for index, component in enumerate(COMPONENTS):
+        with open(os.path.join(source_dir, "web", "components", f"{component}.tsx"), "w") as f:
+            f.write(component_source(component))
+        git(['add', '.'], source_dir)
+        git(['commit', '-q', '-m', f"Add {component}"], source_dir, AUTHORS[(index + 1) % len(AUTHORS)])
+    git(['tag', 'prod-load-test'], source_dir)
+    git(['clone', '-q', '--mirror', source_dir, mirror_dir], root)
+    return mirror_dir
+
+
+class ErrorCorpus:
+    """
+    Seeded synthetic errors: Python and JavaScript traces into the synthetic repository plus plain-text
+    reports. A share of the requests repeats an earlier error (coalescing / cache hits), reads a Slack
+    thread (issue summary stage) or names an Error Reporting group (GCP fetch).
+    """
+
+    def __init__(self, seed: int, duplicate_share: float, thread_share: float, gcp_share: float):
+        self.random = random.Random(seed)
+        self.duplicate_share = duplicate_share
+        self.thread_share = thread_share
+        self.gcp_share = gcp_share
+        self.sent: List[str] = []
+        # group id -> error message served by the GCP stub
+        self.groups: Dict[str, str] = {}
+
+    def python_trace(self) -> str:
+        module = self.random.choice(MODULES)
+        index = self.random.randrange(FUNCTIONS_PER_FILE)
+        request_id = self.random.randrange(10 ** 8)
+        return "\n".join([
+            f"request {request_id} failed",
+            "Traceback (most recent call last):",
+            '  File "/usr/local/lib/python3.11/site-packages/flask/app.py", line 1484, in full_dispatch_request',
+            "    rv = self.dispatch_request()",
+            f'  File "/app/src/services/{module}.py", line {function_line(index, True)}, in handle_{module}_{index}',
+            "    total += item['amount'] * item.get('quantity', 1)",
+            "KeyError: 'amount'",
+        ])
+
+    def javascript_trace(self) -> str:
+        component = self.random.choice(COMPONENTS)
+        index = self.random.randrange(FUNCTIONS_PER_FILE)
+        return "\n".join([
+            "TypeError: Cannot read properties of undefined (reading 'rows')",
+            f"    at render{component}{index} (/app/web/components/{component}.tsx:{function_line(index, False)}:27)",
+            f"    at renderWithHooks (/app/node_modules/react-dom/cjs/react-dom.development.js:{14985 + index}:18)",
+        ])
+
+    def plain_report(self) -> str:
+        return self.random.choice(PLAIN_MESSAGES).format(module=self.random.choice(MODULES))
+
+    def next_message(self) -> str:
+        if self.sent and self.random.random() < self.duplicate_share:
+            return self.random.choice(self.sent)
+        kind = self.random.random()
+        if kind < 0.5:
+            message = self.python_trace()
+        elif kind < 0.85:
+            message = self.javascript_trace()
+        else:
+            message = self.plain_report()
+        self.sent.append(message)
+        return message
+
+    def next_request(self, channel_id: str) -> dict:
+        """Body of the next POST /bug-triage/analyze request"""
+        body = {"slack_channel_id": channel_id}
+        message = self.next_message()
+        if self.random.random() < self.gcp_share:
+            group_id = f"group-{len(self.groups) + 1}"
+            self.groups[group_id] = message
+            body["error_reporting_group_id"] = group_id
+        else:
+            body["error_message"] = message
+        if self.random.random() < self.thread_share:
+            body["slack_thread_id"] = f"1700000000.{self.random.randrange(10 ** 6):06d}"
+            body["use_mcp_for_slack_details"] = True
+        return body
+
+
+def create_stub_app(corpus: ErrorCorpus, slack_latency: float, gcp_latency: float, gcp_events: int = 5) -> FastAPI:
+    """Slack Web API under /slack and Error Reporting API under /gcp"""
+    app = FastAPI()
+    app.state.calls = Counter()
+
+    @app.api_route("/slack/{method}", methods=["GET", "POST"])
+    async def slack_method(method: str):
+        app.state.calls[f"slack:{method}"] += 1
+        await asyncio.sleep(slack_latency)
+        if method == "users.list":
+            return {"ok": True, "members": [], "response_metadata": {"next_cursor": ""}}
+        return {"ok": True, "channel": "C-LOAD-TEST", "ts": f"{time.time():.6f}"}
+
+    @app.get("/gcp/projects/{project_id}/events")
+    async def gcp_events_list(project_id: str, request: Request):
+        app.state.calls["gcp:events"] += 1
+        await asyncio.sleep(gcp_latency)
+        message = corpus.groups.get(request.query_params.get("groupId"))
+        if message is None:
+            return {"errorEvents": []}
+        now = time.strftime("%Y-%m-%dT%H:%M:%S.000000Z", time.gmtime())
+        return {"errorEvents": [
+            {"eventTime": now, "message": message, "serviceContext": {"service": "load-test"}}
+            for _ in range(gcp_events)
+        ]}
+
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
@@ -0,0 +1,82 @@
+"""
+Stack Trace Parser Benchmark
+
+Usage: python -m benchmarks.stack_trace_benchmark [--repeat 20]
+"""
+import argparse
+import statistics
+import time
+
+from src.utils.fingerprint_utils import compute_error_fingerprint
+from src.utils.stack_trace_utils import parse_stack_trace
+
+
+def python_trace(depth: int, noise_lines: int) -> str:
+    lines = [f"2024-01-01T00:00:{i % 60:02d}Z INFO request {i} handled in {i % 97}ms" for i in range(noise_lines)]
+    lines.append("Traceback (most recent call last):")
+    lines.append('  File "/usr/local/lib/python3.11/site-packages/flask/app.py", line 1484, in full_dispatch_request')
+    lines.append("    rv = self.dispatch_request()")
+    for i in range(depth):
+        lines.append(f'  File "/app/src/services/tree.py", line {10 + i % 3}, in walk')
+        lines.append("    return self.walk(node.children[0])")
+    lines.append("RecursionError: maximum recursion depth exceeded")
+    return "\n".join(lines)
+
+
+def javascript_trace(depth: int) -> str:
+    lines = ["TypeError: Cannot read properties of undefined (reading 'id')"]
+    for i in range(depth):
+        lines.append(f"    at render{i % 50} (/app/web/components/List.tsx:{100 + i % 50}:17)")
+        lines.append(f"    at Object.run (/app/node_modules/react-dom/cjs/react-dom.development.js:{4000 + i}:14)")
+    return "\n".join(lines)
+
+
+def java_trace(depth: int) -> str:
+    lines = ["java.lang.IllegalStateException: connection pool exhausted"]
+    for i in range(depth):
+        lines.append(f"\tat com.acme.db.Pool.acquire{i % 20}(Pool.java:{50 + i % 20})")
+        lines.append(f"\tat org.springframework.aop.Proxy.invoke(Proxy.java:{200 + i})")
+    lines.append("Caused by: java.net.SocketTimeoutException: connect timed out")
+    lines.append("\tat com.acme.db.Conn.open(Conn.java:12)")
+    return "\n".join(lines)
+
+
+def go_trace(goroutines: int) -> str:
+    lines = ["panic: runtime error: index out of range [3] with length 3", ""]
+    for i in range(goroutines):
+        lines.append(f"goroutine {i} [running]:")
+        lines.append(f"main.(*Worker).process(0xc000{i:06x})")
+        lines.append(f"\t/app/worker.go:{40 + i % 10} +0x1d")
+        lines.append("created by main.main")
+        lines.append("\t/app/main.go:22 +0x5e")
+    return "\n".join(lines)
+
+
+def run(repeat: int):
+    cases = {
+        "python 1k frames + 20k log lines": python_trace(1000, 20000),
+        "javascript 5k frames": javascript_trace(5000),
+        "java 5k frames": java_trace(5000),
+        "go 2k goroutines": go_trace(2000),
+    }
+    print(f"{'case':<36} {'size':>10} {'parse p50':>10} {'parse max':>10} {'compact':>9} {'saved':>7}")
+    for name, text in cases.items():
+        timings = []
+        parsed_trace = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parsed_trace = parse_stack_trace(text)
+            timings.append(time.perf_counter() - start)
+        compact = parsed_trace.to_compact() if parsed_trace else text
+        saved = 1 - len(compact) / len(text)
+        print(
+            f"{name:<36} {len(text):>10,} {statistics.median(timings) * 1000:>8.1f}ms "
+            f"{max(timings) * 1000:>8.1f}ms {len(compact):>9,} {saved:>6.1%}"
+        )
+        assert compute_error_fingerprint(text) == compute_error_fingerprint(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20)
+    run(parser.parse_args().repeat)
@@ -0,0 +1,344 @@
+"""
+Bug Triage Load Test
+
+Drives POST /bug-triage/analyze with a seeded synthetic error corpus at a fixed arrival rate. The real
+service runs in this process (uvicorn on localhost) with its external dependencies stubbed:
+- Claude: benchmarks/fake_bin/claude, a real subprocess per call (--engine cli), or ANALYSIS_ENGINE=fake
+- git: a synthetic local repository with a prod tag, mirrored the same way as the GitHub mirror
+- GCP Error Reporting / Slack Web API: a local stub server (benchmarks/load_test_stubs.py)
+
+Reports p50/p95/p99 of every pipeline stage, queue wait and end-to-end latency, throughput and the peak
+number of concurrent Claude / git subprocesses. The corpus and arrivals only depend on --seed, so runs
+with the same options are comparable across commits: --output saves the report as JSON and --compare
+prints the current run next to a saved one.
+
+Usage: python -m benchmarks.triage_load_benchmark [--requests 40] [--rate 2] [--workers 2]
+       [--engine cli|fake] [--output report.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import httpx
+import uvicorn
+
+from benchmarks.load_test_stubs import ErrorCorpus, create_repository, create_stub_app, free_port
+
+FAKE_BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_bin")
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def distribution(values: List[float]) -> Optional[dict]:
+    if not values:
+        return None
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 0.50), 3),
+        "p95": round(percentile(values, 0.95), 3),
+        "p99": round(percentile(values, 0.99), 3),
+        "max": round(max(values), 3),
+    }
+
+
+class StageCollector(logging.Handler):
+    """Collects the durations stage_timer logs with each finished stage"""
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+
+    def emit(self, record: logging.LogRecord):
+        metrics = getattr(record, "metrics", None)
+        if metrics and "stage" in metrics and "duration_seconds" in metrics:
+            self.durations[metrics["stage"]].append(metrics["duration_seconds"])
+
+
+def configure_environment(options, root: str, mirror_dir: str, stub_url: str):
+    """Point the service at the stubs; must run before src is imported since Config reads the environment"""
+    os.environ.update({
+        "PROJECT": "DEV",
+        "GITHUB_TOKEN": "load-test",
+        "GITHUB_PROJECT": "load-test/synthetic",
+        "SLACK_BOT_TOKEN": "xoxb-load-test",
+        "SLACK_TEAM_ID": "T-LOAD-TEST",
+        "SLACK_API_BASE_URL": f"{stub_url}/slack",
+        "SLACK_DELIVERY_MODE": "api",
+        "ANTHROPIC_API_KEY": "load-test",
+        "GCP_PROJECT_ID": "load-test",
+        "DATA_DIR": os.path.join(root, "data"),
+        "GIT_MIRROR_DIR": mirror_dir,
+        "GIT_WORKTREE_DIR": os.path.join(root, "worktrees"),
+        "PROMPT_PAYLOAD_DIR": os.path.join(root, "prompt_payloads"),
+        "ERROR_POLLER_ENABLED": "false",
+        "JOB_WORKER_COUNT": str(options.workers),
+        "JOB_QUEUE_MAX_SIZE": str(options.queue_size),
+        "CLAUDE_MAX_CONCURRENCY": str(options.claude_concurrency),
+        "ANALYSIS_CACHE_ENABLED": "false" if options.no_cache else "true",
+        "ANALYSIS_ENGINE": options.engine,
+        "CLAUDE_POOL_ENABLED": "true" if options.pool else "false",
+        "FAKE_CLAUDE_BOOT_SECONDS": str(options.claude_boot),
+        "FAKE_CLAUDE_WORK_SECONDS": str(options.claude_work),
+        "FAKE_CLAUDE_TOOL_CALLS": str(options.tool_calls),
+        "FAKE_ENGINE_LATENCY_SECONDS": str(options.claude_boot + options.claude_work),
+        "FAKE_ENGINE_TOOL_CALLS": str(options.tool_calls),
+        "PATH": FAKE_BIN_DIR + os.pathsep + os.environ.get("PATH", ""),
+    })
+    # --env KEY=VALUE 覆寫任何其他設定（例如比較不同的 worker 數量或 cache 設定）
+    for item in options.env:
+        key, _, value = item.partition("=")
+        os.environ[key] = value
+
+
+def arrival_offsets(count: int, rate: float, poisson: bool, seed: int) -> List[float]:
+    """Send times (seconds from the start) of each request"""
+    if not poisson:
+        return [index / rate for index in range(count)]
+    arrivals = random.Random(seed + 1)
+    offsets, now = [], 0.0
+    for _ in range(count):
+        offsets.append(now)
+        now += arrivals.expovariate(rate)
+    return offsets
+
+
+def current_commit() -> str:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(['git', 'diff', '--quiet', 'HEAD', '--', 'src', 'main.py']).returncode != 0
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def start_server(app, port: int) -> tuple:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_config=None, access_log=False))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def run(options) -> dict:
+    root = tempfile.mkdtemp(prefix="triage-load-")
+    try:
+        mirror_dir = create_repository(root)
+        corpus = ErrorCorpus(options.seed, options.duplicates, options.thread_share, options.gcp_share)
+        bodies = [corpus.next_request("C-LOAD-TEST") for _ in range(options.requests)]
+        offsets = arrival_offsets(options.requests, options.rate, options.arrival == "poisson", options.seed)
+        stub_port, app_port = free_port(), free_port()
+        configure_environment(options, root, mirror_dir, f"http://127.0.0.1:{stub_port}")
+
+        # Config 在 import 時讀取環境變數，所以設定好 stub 之後才載入服務
+        import main
+        from google.oauth2.credentials import Credentials
+        from src.api import bug_triage_routes as routes
+        from src.utils.cmd_utils import claude_runner, git_runner
+
+        root_logger = logging.getLogger()
+        if not options.verbose:
+            for handler in root_logger.handlers[:]:
+                root_logger.removeHandler(handler)
+        collector = StageCollector()
+        root_logger.addHandler(collector)
+
+        # GCP：已取得的 token 直接指向 stub，不經過 service account 交換
+        gcp = routes.gcp_error_service
+        gcp.base_url = f"http://127.0.0.1:{stub_port}/gcp"
+        gcp._credentials = Credentials(token="load-test", expiry=datetime.utcnow() + timedelta(days=1))
+
+        stub_app = create_stub_app(corpus, options.slack_latency, options.gcp_latency)
+        stub_server, stub_task = await start_server(stub_app, stub_port)
+        app_server, app_task = await start_server(main.app, app_port)
+        try:
+            # 等 mirror 更新完成，啟動成本不計入結果
+            await routes.bug_triage_service.resolve_commit()
+            collector.durations.clear()
+            claude_runner.peak_active = claude_runner.active
+            git_runner.peak_active = git_runner.active
+            report = await drive(options, bodies, offsets, f"http://127.0.0.1:{app_port}", routes)
+            report["max_concurrent"].update({"claude": claude_runner.peak_active, "git": git_runner.peak_active})
+            report["stages"] = {stage: distribution(values) for stage, values in sorted(collector.durations.items())}
+            report["stub_calls"] = dict(sorted(stub_app.state.calls.items()))
+        finally:
+            app_server.should_exit = True
+            await app_task
+            stub_server.should_exit = True
+            await stub_task
+        return report
+    finally:
+        if options.keep:
+            print(f"kept load test files in {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+async def drive(options, bodies: List[dict], offsets: List[float], app_url: str, routes) -> dict:
+    """Send the requests on schedule, then wait for every accepted job to finish"""
+    accept_latency: List[float] = []
+    analysis_ids: List[str] = []
+    rejected = 0
+    peaks = {"queue_depth": 0, "jobs_running": 0}
+
+    async def sample():
+        while True:
+            stats = routes.job_queue_service.stats()
+            peaks["queue_depth"] = max(peaks["queue_depth"], stats["queued"])
+            peaks["jobs_running"] = max(peaks["jobs_running"], stats["running_local"])
+            await asyncio.sleep(0.1)
+
+    async def submit(client: httpx.AsyncClient, body: dict):
+        nonlocal rejected
+        start = time.monotonic()
+        response = await client.post("/bug-triage/analyze", json=body)
+        accept_latency.append(time.monotonic() - start)
+        if response.status_code == 200:
+            analysis_ids.append(response.json()["analysis_id"])
+        else:
+            rejected += 1
+
+    sampler = asyncio.create_task(sample())
+    started = time.monotonic()
+    async with httpx.AsyncClient(base_url=app_url, timeout=120) as client:
+        submissions = []
+        for body, offset in zip(bodies, offsets):
+            await asyncio.sleep(max(0.0, started + offset - time.monotonic()))
+            submissions.append(asyncio.create_task(submit(client, body)))
+        await asyncio.gather(*submissions)
+
+    jobs = {}
+    deadline = time.monotonic() + options.drain_timeout
+    while time.monotonic() < deadline:
+        for analysis_id in analysis_ids:
+            if analysis_id not in jobs or jobs[analysis_id].status not in TERMINAL_STATUSES:
+                jobs[analysis_id] = await routes.job_queue_service.get_job(analysis_id)
+        if all(job and job.status in TERMINAL_STATUSES for job in jobs.values()):
+            break
+        await asyncio.sleep(0.25)
+    elapsed = time.monotonic() - started
+    sampler.cancel()
+
+    finished = [job for job in jobs.values() if job and job.status in TERMINAL_STATUSES]
+    completed = [job for job in finished if job.status == "completed"]
+    # 併入其他 job 的重複請求沒有自己的排隊時間
+    queue_wait = [
+        (job.started_at - job.created_at).total_seconds()
+        for job in finished if job.started_at and not job.coalesced_into
+    ]
+    end_to_end = [(job.finished_at - job.created_at).total_seconds() for job in finished if job.finished_at]
+    return {
+        "commit": current_commit(),
+        "options": {key: value for key, value in vars(options).items() if key not in ("output", "compare", "verbose")},
+        "requests": {
+            "sent": len(bodies),
+            "rejected": rejected,
+            "completed": len(completed),
+            "failed": len(finished) - len(completed),
+            "coalesced": len([job for job in jobs.values() if job and job.coalesced_into]),
+            "unfinished": len(analysis_ids) - len(finished),
+        },
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_per_minute": round(len(completed) / elapsed * 60, 2) if elapsed else 0,
+        "accept_latency": distribution(accept_latency),
+        "queue_wait": distribution(queue_wait),
+        "end_to_end": distribution(end_to_end),
+        "max_concurrent": dict(peaks),
+    }
+
+
+def latency_rows(report: dict) -> Dict[str, Optional[dict]]:
+    rows = {
+        "accept_latency": report.get("accept_latency"),
+        "queue_wait": report.get("queue_wait"),
+        "end_to_end": report.get("end_to_end"),
+    }
+    rows.update({f"stage:{stage}": values for stage, values in (report.get("stages") or {}).items()})
+    return rows
+
+
+def print_report(report: dict, baseline: Optional[dict] = None):
+    requests = report["requests"]
+    print(f"commit {report['commit']}  elapsed {report['elapsed_seconds']}s  "
+          f"throughput {report['throughput_per_minute']} jobs/min")
+    print("requests " + "  ".join(f"{key}={value}" for key, value in requests.items()))
+    print("max concurrent " + "  ".join(f"{key}={value}" for key, value in report["max_concurrent"].items()))
+    print("stub calls " + "  ".join(f"{key}={value}" for key, value in report["stub_calls"].items()))
+    print()
+    header = f"{'seconds':<28}{'count':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    if baseline:
+        header += f"   baseline {baseline['commit']} p50 / p95"
+    print(header)
+    baseline_rows = latency_rows(baseline) if baseline else {}
+    for name, values in latency_rows(report).items():
+        if not values:
+            continue
+        line = (
+            f"{name:<28}{values['count']:>6}{values['p50']:>9.2f}{values['p95']:>9.2f}"
+            f"{values['p99']:>9.2f}{values['max']:>9.2f}"
+        )
+        previous = baseline_rows.get(name)
+        if previous:
+            line += f"   {previous['p50']:>7.2f} / {previous['p95']:<7.2f}"
+        print(line)
+    if baseline:
+        print(f"\nbaseline throughput {baseline['throughput_per_minute']} jobs/min, "
+              f"max concurrent {baseline['max_concurrent']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=40, help="number of analyze requests")
+    parser.add_argument("--rate", type=float, default=2, help="requests per second")
+    parser.add_argument("--arrival", choices=("constant", "poisson"), default="constant")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the corpus and the poisson arrivals")
+    parser.add_argument("--duplicates", type=float, default=0.2, help="share of requests repeating an earlier error")
+    parser.add_argument("--thread-share", type=float, default=0.1, help="share of requests reading a Slack thread")
+    parser.add_argument("--gcp-share", type=float, default=0.2, help="share of requests by Error Reporting group id")
+    parser.add_argument("--engine", choices=("cli", "fake"), default="cli", help="cli runs the fake claude executable")
+    parser.add_argument("--pool", action="store_true", help="enable the warm Claude session pool")
+    parser.add_argument("--claude-boot", type=float, default=0.5, help="fake claude boot seconds")
+    parser.add_argument("--claude-work", type=float, default=1.0, help="fake claude seconds per prompt")
+    parser.add_argument("--tool-calls", type=int, default=3, help="fake tool calls per analysis")
+    parser.add_argument("--slack-latency", type=float, default=0.05, help="Slack stub latency in seconds")
+    parser.add_argument("--gcp-latency", type=float, default=0.1, help="GCP stub latency in seconds")
+    parser.add_argument("--workers", type=int, default=2, help="JOB_WORKER_COUNT")
+    parser.add_argument("--claude-concurrency", type=int, default=4, help="CLAUDE_MAX_CONCURRENCY")
+    parser.add_argument("--queue-size", type=int, default=200, help="JOB_QUEUE_MAX_SIZE")
+    parser.add_argument("--no-cache", action="store_true", help="disable the analysis cache")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra service setting")
+    parser.add_argument("--drain-timeout", type=float, default=600, help="seconds to wait for queued jobs")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--compare", help="JSON report of an earlier run to print next to this one")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary repository and data")
+    parser.add_argument("--verbose", action="store_true", help="keep the service logs on stdout")
+    options = parser.parse_args()
+
+    report = asyncio.run(run(options))
+    baseline = None
+    if options.compare:
+        with open(options.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -8,10 +8,12 @@ import json
 import logging
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from src.core.config import Config
 from src.api.bug_triage_routes import router as bug_triage_router
+from src.utils.metrics_utils import current_analysis_id, current_stage, metrics_registry
 
 # Initialize configuration
 config = Config()
@@ -28,6 +30,16 @@ class GKEFormatter(logging.Formatter):
             "function": record.funcName,
             "line": record.lineno
         }
+        # 分析中的 log 帶上 analysis_id / stage，stage 結束時另帶耗時與 token 等數值
+        analysis_id = current_analysis_id.get()
+        if analysis_id:
+            log_entry["analysis_id"] = analysis_id
+        stage = current_stage.get()
+        if stage:
+            log_entry["stage"] = stage
+        metrics = getattr(record, "metrics", None)
+        if metrics:
+            log_entry.update(metrics)
         if config.PROJECT == "DEV":
             log_entry = f"{self.formatTime(record)} - {record.getMessage()}"
             return log_entry
@@ -89,6 +101,12 @@ async def health():
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: stage durations, queue depth, retries, Claude tokens / cost"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     port = config.PORT
     host = config.HOST
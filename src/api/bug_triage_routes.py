@@ -4,14 +4,33 @@ Bug Triage API Routes
 
 import asyncio
 import logging
+import os
 import uuid
 from datetime import datetime
 from typing import Optional
 
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException
 from src.services.bug_triage_service import BugTriageService
-from src.services.gcp_error_service import GCPErrorService
-from src.core.models import SlackPayload, BugTriageRequest, BugTriageResponse
+from src.services.job_queue_service import JobQueueService
+from src.services.error_poller_service import ErrorPollerService
+from src.core.exceptions import JobQueueFullError
+from src.utils.error_event_utils import format_digest_context
+from src.utils.fingerprint_utils import compute_error_fingerprint
+from src.utils.cmd_utils import claude_runner, git_runner
+from src.utils.claude_pool_utils import claude_session_pool
+from src.utils.metrics_utils import metrics_registry
+from src.utils.prompt_utils import prompt_metrics
+from src.utils.retry_utils import claude_retry_policy, gcp_retry_policy
+from src.core.models import (
+    SlackPayload,
+    BugTriageRequest,
+    BugTriageResponse,
+    BugTriageBatchRequest,
+    BugTriageBatchItem,
+    BugTriageBatchResponse,
+    TriageJob,
+    JobStatusResponse,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -20,31 +39,161 @@ router = APIRouter(prefix="/bug-triage", tags=["bug-triage"])
 
 # Initialize services
 bug_triage_service = BugTriageService()
-gcp_error_service = GCPErrorService()
+# Share the pooled HTTP client and cached GCP token with the triage service
+gcp_error_service = bug_triage_service.gcp_error_service
 
 
-def run_process_bug_analysis(
-    error_message: str,
+async def run_triage_job(job: TriageJob) -> Optional[str]:
+    """Job queue handler that runs the full bug analysis workflow; returns the analysis stored with the job"""
+    return await bug_triage_service.process_bug_analysis(
+        job.error_message,
+        job.slack_payload,
+        job.analysis_id,
+        job.custom_prompt,
+        job.additional_slack_payloads,
+        job.error_time,
+        job.error_context,
+        await job_queue_service.load_checkpoints(job.analysis_id)
+    )
+
+
+job_queue_service = JobQueueService(run_triage_job)
+
+
+def generate_analysis_id() -> str:
+    """Generate unique analysis ID"""
+    return f"triage-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{str(uuid.uuid4())[:8]}"
+
+
+async def submit_group_digest(
+    digest: dict,
     slack_payload: SlackPayload,
-    analysis_id: str,
-    custom_prompt: Optional[str] = None
-):
-    """Synchronized wrapper function, internally uses asyncio.run to execute async function"""
-    asyncio.run(
-        bug_triage_service.process_bug_analysis(
-            error_message,
-            slack_payload,
-            analysis_id,
-            custom_prompt
-        )
+    custom_prompt: Optional[str] = None,
+    priority: str = "normal",
+    analysis_id: Optional[str] = None
+) -> TriageJob:
+    """Queue the representative trace of an Error Reporting group digest; raises JobQueueFullError"""
+    job = TriageJob(
+        analysis_id=analysis_id or generate_analysis_id(),
+        error_message=digest["representative_message"],
+        slack_payload=slack_payload,
+        custom_prompt=custom_prompt,
+        error_time=digest["representative_time"],
+        error_context=format_digest_context(digest),
+        priority=priority,
+        fingerprint=compute_error_fingerprint(digest["representative_message"]),
+        created_at=datetime.now()
     )
+    return await job_queue_service.submit(job)
+
+
+async def submit_polled_group(digest: dict) -> Optional[str]:
+    """Error poller handler: queue a polled group and post the result to the poller channel"""
+    try:
+        job = await submit_group_digest(
+            digest,
+            SlackPayload(channel_id=bug_triage_service.config.ERROR_POLLER_SLACK_CHANNEL_ID),
+            priority="low"
+        )
+    except JobQueueFullError as e:
+        logger.warning(f"Skipping polled group {digest['group_id']}: {e}")
+        return None
+    return job.analysis_id
+
+
+def collect_service_metrics() -> list:
+    """Gauges and counters read from service state at scrape time (GET /metrics)"""
+    queue_stats = job_queue_service.stats()
+    families = [
+        ("bug_triage_queue_depth", "gauge", "Jobs waiting in the queue", [("bug_triage_queue_depth", {}, queue_stats["queued"])]),
+        ("bug_triage_jobs_running", "gauge", "Jobs being analyzed", [("bug_triage_jobs_running", {}, queue_stats["running"])]),
+        ("bug_triage_subprocesses_active", "gauge", "Running claude / git subprocesses", [
+            ("bug_triage_subprocesses_active", {"runner": runner.name}, runner.active) for runner in (claude_runner, git_runner)
+        ]),
+    ]
+
+    retries, failures, circuit_open = [], [], []
+    for upstream, policy in (("claude", claude_retry_policy), ("gcp", gcp_retry_policy)):
+        policy_stats = policy.stats()
+        retries.append(("bug_triage_retries_total", {"upstream": upstream}, policy_stats["retries"]))
+        failures.extend(
+            ("bug_triage_upstream_failures_total", {"upstream": upstream, "failure": failure}, count)
+            for failure, count in policy_stats["failures"].items()
+        )
+        circuit_open.append(("bug_triage_circuit_open", {"upstream": upstream}, int(policy_stats["circuit"]["state"] == "open")))
+    families.extend([
+        ("bug_triage_retries_total", "counter", "Retries made by the shared retry policies", retries),
+        ("bug_triage_upstream_failures_total", "counter", "Failed upstream calls by classification", failures),
+        ("bug_triage_circuit_open", "gauge", "Whether the circuit breaker rejects calls", circuit_open),
+    ])
+
+    pool_stats = claude_session_pool.stats()
+    if pool_stats["enabled"]:
+        families.extend([
+            ("bug_triage_claude_pool_idle", "gauge", "Warm Claude sessions waiting for a prompt", [
+                ("bug_triage_claude_pool_idle", {}, pool_stats["idle"]),
+            ]),
+            ("bug_triage_claude_pool_starting", "gauge", "Warm Claude sessions being started in the background", [
+                ("bug_triage_claude_pool_starting", {}, pool_stats["starting"]),
+            ]),
+            ("bug_triage_claude_pool_borrows_total", "counter", "Pooled Claude calls by session state", [
+                ("bug_triage_claude_pool_borrows_total", {"session": "warm"}, pool_stats["warm_hits"]),
+                ("bug_triage_claude_pool_borrows_total", {"session": "cold"}, pool_stats["cold_starts"]),
+            ]),
+            ("bug_triage_claude_pool_retired_total", "counter", "Claude sessions retired by reason", [
+                ("bug_triage_claude_pool_retired_total", {"reason": reason}, count)
+                for reason, count in pool_stats["retired"].items()
+            ]),
+        ])
+
+    prompt_stats = prompt_metrics.stats()
+    families.append(("bug_triage_prompt_bytes_total", "counter", "Prompt bytes before and after compaction", [
+        ("bug_triage_prompt_bytes_total", {"kind": "raw"}, prompt_stats["raw_bytes"]),
+        ("bug_triage_prompt_bytes_total", {"kind": "final"}, prompt_stats["final_bytes"]),
+    ]))
+
+    if bug_triage_service.analysis_cache:
+        cache_stats = bug_triage_service.analysis_cache.stats()
+        families.append(("bug_triage_analysis_cache_requests_total", "counter", "Analysis cache lookups", [
+            ("bug_triage_analysis_cache_requests_total", {"result": "hit"}, cache_stats["hits"]),
+            ("bug_triage_analysis_cache_requests_total", {"result": "miss"}, cache_stats["misses"]),
+        ]))
+    return families
+
+
+metrics_registry.add_collector(collect_service_metrics)
+
+
+error_poller_service = ErrorPollerService(
+    gcp_error_service,
+    submit_polled_group,
+    os.path.join(bug_triage_service.config.DATA_DIR, "error_poller_state.json")
+)
+
+
+@router.on_event("startup")
+async def start_background_services():
+    bug_triage_service.slack_service.start_mcp_status_check()
+    bug_triage_service.claude_utils.prewarm_sessions()
+    await bug_triage_service.repository_refresher.start()
+    await job_queue_service.start()
+    if bug_triage_service.config.ERROR_POLLER_ENABLED:
+        await error_poller_service.start()
+
+
+@router.on_event("shutdown")
+async def stop_background_services():
+    await error_poller_service.stop()
+    await job_queue_service.stop()
+    await bug_triage_service.claude_utils.engine.close()
+    await claude_session_pool.close()
+    await bug_triage_service.repository_refresher.stop()
+    await bug_triage_service.slack_service.close()
+    await gcp_error_service.close()
 
 
 @router.post("/analyze", response_model=BugTriageResponse)
-async def analyze_bug(
-    request: BugTriageRequest,
-    background_tasks: BackgroundTasks
-):
+async def analyze_bug(request: BugTriageRequest):
     """
     input payload:
     - error_reporting_group_id: string (optional)
@@ -54,16 +203,25 @@ async def analyze_bug(
     - use_mcp_for_slack_details: boolean (optional)
     - dry_run: boolean (optional)
     - custom_prompt: string (optional) - 自訂的 prompt，會附加到預設的分析 prompt 中
+    - priority: "high" | "normal" | "low" (optional) - 佇列優先順序，預設 normal
+    - error_time: datetime (optional) - 錯誤發生時間，會分析當時已部署的 prod release（group_id 預設使用事件時間）
     """
     try:
         # Generate unique analysis ID
-        analysis_id = f"triage-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{str(uuid.uuid4())[:8]}"
+        analysis_id = generate_analysis_id()
         logger.info(f"Received bug analysis request: {analysis_id}")
         logger.info(f"Request payload: {request.dict()}")
 
         # Determine error message source
+        error_time = request.error_time
+        error_context = None
         if request.error_reporting_group_id:
-            error_message = gcp_error_service.get_gcp_error_events_message(request.error_reporting_group_id)
+            # 分析 group 內最完整的 stack trace，並附上事件數量 / 影響服務等概況
+            digest = await gcp_error_service.get_error_group_digest(request.error_reporting_group_id)
+            error_message = digest["representative_message"] if digest else None
+            if digest:
+                error_time = error_time or digest["representative_time"]
+                error_context = format_digest_context(digest)
             if not error_message:
                 logger.error(f"無法取得 group_id {request.error_reporting_group_id} 的錯誤訊息")
                 raise HTTPException(status_code=400, detail="無法取得指定 group_id 的錯誤訊息")
@@ -92,14 +250,32 @@ async def analyze_bug(
             read_slack_thread_details=request.use_mcp_for_slack_details
         )
 
-        # Add background task
-        background_tasks.add_task(
-            run_process_bug_analysis,
-            error_message,
-            slack_payload,
-            analysis_id,
-            request.custom_prompt
+        # Enqueue job for the worker pool
+        job = TriageJob(
+            analysis_id=analysis_id,
+            error_message=error_message,
+            slack_payload=slack_payload,
+            custom_prompt=request.custom_prompt,
+            error_time=error_time,
+            error_context=error_context,
+            priority=request.priority or "normal",
+            fingerprint=compute_error_fingerprint(error_message),
+            created_at=datetime.now()
         )
+        try:
+            job = await job_queue_service.submit(job)
+        except JobQueueFullError as e:
+            logger.warning(f"Rejecting {analysis_id}: {e}")
+            raise HTTPException(status_code=429, detail="分析佇列已滿，請稍後再試")
+
+        if job.coalesced_into:
+            return BugTriageResponse(
+                status="accepted",
+                message=f"相同錯誤正在分析中 ({job.coalesced_into})，結果將一併回覆至 Slack",
+                detail=detail,
+                analysis_id=analysis_id,
+                estimated_completion="5-10 minutes"
+            )
 
         return BugTriageResponse(
             status="accepted",
@@ -114,3 +290,161 @@ async def analyze_bug(
     except Exception as e:
         logger.error(f"Failed to process bug analysis request: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@router.post("/analyze/batch", response_model=BugTriageBatchResponse)
+async def analyze_bug_batch(request: BugTriageBatchRequest):
+    """
+    Analyze several Error Reporting groups in one call.
+    Events of every group are fetched concurrently and aggregated; each group is queued
+    with its richest stack trace, and results are posted to the same Slack channel / thread.
+    """
+    try:
+        logger.info(f"Received batch analysis request: {request.dict()}")
+        digests = await gcp_error_service.get_error_group_digests(request.error_reporting_group_ids)
+
+        results = []
+        for group_id, digest in digests.items():
+            if not digest or not digest["representative_message"]:
+                logger.error(f"無法取得 group_id {group_id} 的錯誤訊息")
+                results.append(BugTriageBatchItem(
+                    error_reporting_group_id=group_id,
+                    status="failed",
+                    detail="無法取得指定 group_id 的錯誤訊息"
+                ))
+                continue
+
+            item = BugTriageBatchItem(
+                error_reporting_group_id=group_id,
+                status="accepted",
+                analysis_id=generate_analysis_id(),
+                event_count=digest["event_count"],
+                distinct_traces=digest["distinct_traces"],
+                services=digest["services"],
+                first_seen=digest["first_seen"],
+                last_seen=digest["last_seen"]
+            )
+            results.append(item)
+            if request.dry_run:
+                continue
+
+            try:
+                job = await submit_group_digest(
+                    digest,
+                    SlackPayload(channel_id=request.slack_channel_id, thread_id=request.slack_thread_id),
+                    request.custom_prompt,
+                    request.priority or "normal",
+                    item.analysis_id
+                )
+                item.coalesced_into = job.coalesced_into
+            except JobQueueFullError as e:
+                logger.warning(f"Rejecting {item.analysis_id} (group {group_id}): {e}")
+                item.status = "rejected"
+                item.detail = "分析佇列已滿，請稍後再試"
+
+        accepted = sum(1 for item in results if item.status == "accepted")
+        if not accepted:
+            if any(item.status == "rejected" for item in results):
+                raise HTTPException(status_code=429, detail="分析佇列已滿，請稍後再試")
+            raise HTTPException(status_code=400, detail="無法取得指定 group_id 的錯誤訊息")
+        return BugTriageBatchResponse(
+            status="accepted",
+            message=f"{accepted} / {len(results)} 個錯誤分析中，結果將自動回覆至 Slack" + (" (dry run)" if request.dry_run else ""),
+            results=results
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to process batch analysis request: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@router.get("/jobs/{analysis_id}", response_model=JobStatusResponse)
+async def get_job_status(analysis_id: str):
+    """Get status of a queued or running analysis job"""
+    job = await job_queue_service.get_job(analysis_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"找不到 analysis_id: {analysis_id}")
+
+    return JobStatusResponse(
+        analysis_id=job.analysis_id,
+        status=job.status,
+        priority=job.priority,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        queue_position=await job_queue_service.get_queue_position(job.coalesced_into or analysis_id),
+        fingerprint=job.fingerprint,
+        coalesced_into=job.coalesced_into,
+        stage=job.stage,
+        attempts=job.attempts,
+        error=job.error,
+        result=job.result
+    )
+
+
+@router.post("/jobs/{analysis_id}/resume", response_model=BugTriageResponse)
+async def resume_job(analysis_id: str):
+    """Run a failed job again from its first incomplete stage (issue summary, analysis or Slack delivery)"""
+    job = await job_queue_service.get_job(analysis_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"找不到 analysis_id: {analysis_id}")
+    if job.coalesced_into:
+        raise HTTPException(status_code=400, detail=f"此分析已併入 {job.coalesced_into}，請改為重新執行該分析")
+    if job.status != "failed":
+        raise HTTPException(status_code=409, detail=f"只有失敗的分析可以重新執行（目前狀態：{job.status}）")
+
+    checkpoints = await job_queue_service.load_checkpoints(analysis_id)
+    stage = bug_triage_service.first_incomplete_stage(job.slack_payload, checkpoints)
+    if not await job_queue_service.resume(analysis_id):
+        raise HTTPException(status_code=409, detail="分析狀態已改變，請重新查詢")
+
+    return BugTriageResponse(
+        status="accepted",
+        message=f"已重新排入佇列，將從 {stage} 階段繼續",
+        analysis_id=analysis_id,
+        estimated_completion="1 minute" if stage == "slack_post" else "5-10 minutes"
+    )
+
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """Get analysis result cache hit/miss counters"""
+    if not bug_triage_service.analysis_cache:
+        return {"enabled": False}
+    return {"enabled": True, **await asyncio.to_thread(bug_triage_service.analysis_cache.stats)}
+
+
+@router.get("/prompt/stats")
+async def get_prompt_stats():
+    """Get prompt size counters (bytes before / after compaction)"""
+    return prompt_metrics.stats()
+
+
+@router.get("/retry/status")
+async def get_retry_status():
+    """Get retry budget and circuit breaker state of the Claude and GCP retry policies"""
+    return {"claude": claude_retry_policy.stats(), "gcp": gcp_retry_policy.stats()}
+
+
+@router.get("/repository/status")
+async def get_repository_status():
+    """Get background repository refresher state"""
+    return bug_triage_service.repository_refresher.status()
+
+
+@router.get("/poller/status")
+async def get_poller_status():
+    """Get Error Reporting poller state"""
+    return error_poller_service.status()
+
+
+@router.post("/poller/run")
+async def run_poller():
+    """Run one Error Reporting poll now"""
+    # 未啟用時 ERROR_POLLER_SLACK_CHANNEL_ID 可能沒有設定，分析結果會無處可送
+    if not bug_triage_service.config.ERROR_POLLER_ENABLED:
+        raise HTTPException(status_code=409, detail="Error poller 未啟用（ERROR_POLLER_ENABLED=false）")
+    analysis_ids = await error_poller_service.poll()
+    return {"analysis_ids": analysis_ids, **error_poller_service.status()}
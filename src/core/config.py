@@ -3,6 +3,7 @@ Configuration Management
 """
 
 import os
+import socket
 from typing import Optional, List
 from pathlib import Path
 from dotenv import load_dotenv
@@ -21,6 +22,17 @@ class Config:
     # Logging Configuration
     PROJECT: str = os.getenv("PROJECT", "DEV")
     CODEBASE_DIR: str = str(Path(__file__).parent.parent.parent / "external_codebase")
+    GIT_MIRROR_DIR: str = os.getenv("GIT_MIRROR_DIR", os.path.join(CODEBASE_DIR, "mirror.git"))
+    GIT_WORKTREE_DIR: str = os.getenv("GIT_WORKTREE_DIR", os.path.join(CODEBASE_DIR, "worktrees"))
+    GIT_WORKTREE_IDLE_SECONDS: int = int(os.getenv("GIT_WORKTREE_IDLE_SECONDS", 3600))
+    GIT_WORKTREE_MAX_IDLE: int = int(os.getenv("GIT_WORKTREE_MAX_IDLE", 3))
+    GIT_MAX_CONCURRENCY: int = int(os.getenv("GIT_MAX_CONCURRENCY", 4))
+    GIT_TIMEOUT_SECONDS: int = int(os.getenv("GIT_TIMEOUT_SECONDS", 600))
+    GIT_REFRESH_INTERVAL_SECONDS: int = int(os.getenv("GIT_REFRESH_INTERVAL_SECONDS", 300))
+    # Partial clone filter, e.g. "blob:none"; empty for a full clone
+    GIT_CLONE_FILTER: str = os.getenv("GIT_CLONE_FILTER", "")
+    GIT_FETCH_DEPTH: int = int(os.getenv("GIT_FETCH_DEPTH", 0))
+    DATA_DIR: str = os.getenv("DATA_DIR", str(Path(__file__).parent.parent.parent / "data"))
     FEEDBACK_URL: str = os.getenv("FEEDBACK_URL", "")
 
     # GitHub Configuration
@@ -31,14 +43,110 @@ class Config:
     # Slack Configuration
     SLACK_BOT_TOKEN: str = os.getenv("SLACK_BOT_TOKEN", "")
     SLACK_TEAM_ID: str = os.getenv("SLACK_TEAM_ID", "")
+    # "api": post with the Slack Web API directly, "mcp": ask Claude to post through the Slack MCP server
+    SLACK_DELIVERY_MODE: str = os.getenv("SLACK_DELIVERY_MODE", "api").lower()
+    SLACK_API_BASE_URL: str = os.getenv("SLACK_API_BASE_URL", "https://slack.com/api")
+    SLACK_TIMEOUT_SECONDS: float = float(os.getenv("SLACK_TIMEOUT_SECONDS", 10))
+    SLACK_MAX_RETRIES: int = int(os.getenv("SLACK_MAX_RETRIES", 3))
+    # 分析進行中在 thread 內更新同一則進度訊息（chat.update），僅 api 模式
+    SLACK_PROGRESS_ENABLED: bool = os.getenv("SLACK_PROGRESS_ENABLED", "true").lower() == "true"
+    SLACK_PROGRESS_INTERVAL_SECONDS: float = float(os.getenv("SLACK_PROGRESS_INTERVAL_SECONDS", 10))
+    SLACK_PROGRESS_MAX_STEPS: int = int(os.getenv("SLACK_PROGRESS_MAX_STEPS", 8))
 
     # GCP Configuration
     GCP_PROJECT_ID: str = os.getenv("GCP_PROJECT_ID", "")
     GCP_SERVICE_ACCOUNT_EMAIL: str = os.getenv("GCP_SERVICE_ACCOUNT_EMAIL", "")
     GCP_SERVICE_ACCOUNT_PRIVATE_KEY: str = os.getenv("GCP_SERVICE_ACCOUNT_PRIVATE_KEY", "")
+    GCP_TIMEOUT_SECONDS: float = float(os.getenv("GCP_TIMEOUT_SECONDS", 10))
+    GCP_MAX_RETRIES: int = int(os.getenv("GCP_MAX_RETRIES", 3))
+    GCP_MAX_CONCURRENCY: int = int(os.getenv("GCP_MAX_CONCURRENCY", 4))
+    GCP_EVENTS_PAGE_SIZE: int = int(os.getenv("GCP_EVENTS_PAGE_SIZE", 100))
+    GCP_EVENTS_MAX_PAGES: int = int(os.getenv("GCP_EVENTS_MAX_PAGES", 5))
+    # Error Reporting timeRange.period, e.g. PERIOD_1_HOUR / PERIOD_1_DAY / PERIOD_1_WEEK
+    GCP_EVENTS_TIME_RANGE: str = os.getenv("GCP_EVENTS_TIME_RANGE", "PERIOD_1_WEEK")
     
     # Claude Configuration
     ANTHROPIC_API_KEY: str = os.getenv("ANTHROPIC_API_KEY", "")
+    CLAUDE_MAX_CONCURRENCY: int = int(os.getenv("CLAUDE_MAX_CONCURRENCY", 4))
+    CLAUDE_TIMEOUT_SECONDS: int = int(os.getenv("CLAUDE_TIMEOUT_SECONDS", 900))
+    # Warm session pool: pre-started `claude` processes (stream-json input) so calls skip the CLI boot.
+    # CLAUDE_MAX_CONCURRENCY limits prompts being processed; idle pooled sessions are extra processes
+    # (up to CLAUDE_POOL_SIZE * CLAUDE_POOL_MAX_KEYS)
+    CLAUDE_POOL_ENABLED: bool = os.getenv("CLAUDE_POOL_ENABLED", "false").lower() == "true"
+    CLAUDE_POOL_SIZE: int = int(os.getenv("CLAUDE_POOL_SIZE", 1))
+    CLAUDE_POOL_MAX_USES: int = int(os.getenv("CLAUDE_POOL_MAX_USES", 1))
+    CLAUDE_POOL_MAX_AGE_SECONDS: float = float(os.getenv("CLAUDE_POOL_MAX_AGE_SECONDS", 900))
+    CLAUDE_POOL_IDLE_SECONDS: float = float(os.getenv("CLAUDE_POOL_IDLE_SECONDS", 300))
+    CLAUDE_POOL_MAX_KEYS: int = int(os.getenv("CLAUDE_POOL_MAX_KEYS", 4))
+    # Analysis engine: cli (claude CLI with tools / MCP), api (Messages API, prompt only) or fake (offline load tests)
+    ANALYSIS_ENGINE: str = os.getenv("ANALYSIS_ENGINE", "cli").lower()
+    ANTHROPIC_MODEL: str = os.getenv("ANTHROPIC_MODEL", "claude-sonnet-4-5")
+    ANTHROPIC_BASE_URL: str = os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com")
+    ANTHROPIC_MAX_TOKENS: int = int(os.getenv("ANTHROPIC_MAX_TOKENS", 4096))
+    ANTHROPIC_PROMPT_CACHE: bool = os.getenv("ANTHROPIC_PROMPT_CACHE", "true").lower() == "true"
+    FAKE_ENGINE_LATENCY_SECONDS: float = float(os.getenv("FAKE_ENGINE_LATENCY_SECONDS", 0.5))
+    FAKE_ENGINE_TOOL_CALLS: int = int(os.getenv("FAKE_ENGINE_TOOL_CALLS", 3))
+
+    # Retry Policy Configuration (shared by Claude and GCP calls)
+    CLAUDE_MAX_RETRIES: int = int(os.getenv("CLAUDE_MAX_RETRIES", 2))
+    CLAUDE_RETRY_BUDGET_PER_HOUR: int = int(os.getenv("CLAUDE_RETRY_BUDGET_PER_HOUR", 30))
+    GCP_RETRY_BUDGET_PER_HOUR: int = int(os.getenv("GCP_RETRY_BUDGET_PER_HOUR", 120))
+    RETRY_BASE_DELAY_SECONDS: float = float(os.getenv("RETRY_BASE_DELAY_SECONDS", 2))
+    RETRY_MAX_DELAY_SECONDS: float = float(os.getenv("RETRY_MAX_DELAY_SECONDS", 60))
+    # Consecutive upstream failures before calls are rejected, and for how long
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD: int = int(os.getenv("CIRCUIT_BREAKER_FAILURE_THRESHOLD", 5))
+    CIRCUIT_BREAKER_RESET_SECONDS: int = int(os.getenv("CIRCUIT_BREAKER_RESET_SECONDS", 120))
+
+    # Prompt Size Budget Configuration (estimated tokens)
+    PROMPT_MAX_ERROR_TOKENS: int = int(os.getenv("PROMPT_MAX_ERROR_TOKENS", 8000))
+    PROMPT_MAX_CONTEXT_TOKENS: int = int(os.getenv("PROMPT_MAX_CONTEXT_TOKENS", 4000))
+    # Full text of truncated payloads is written here for Claude to read when needed
+    PROMPT_PAYLOAD_DIR: str = os.getenv("PROMPT_PAYLOAD_DIR", "data/prompt_payloads")
+
+    # Job Queue Configuration
+    JOB_WORKER_COUNT: int = int(os.getenv("JOB_WORKER_COUNT", 2))
+    JOB_QUEUE_MAX_SIZE: int = int(os.getenv("JOB_QUEUE_MAX_SIZE", 200))
+    JOB_HISTORY_SIZE: int = int(os.getenv("JOB_HISTORY_SIZE", 1000))
+    JOB_COALESCE_ENABLED: bool = os.getenv("JOB_COALESCE_ENABLED", "true").lower() == "true"
+    # Durable job store shared by every instance: "sqlite" (local file) or "redis" (Redis-compatible server)
+    JOB_STORE_BACKEND: str = os.getenv("JOB_STORE_BACKEND", "sqlite").lower()
+    JOB_STORE_PATH: str = os.getenv("JOB_STORE_PATH", "")
+    JOB_STORE_REDIS_URL: str = os.getenv("JOB_STORE_REDIS_URL", "")
+    JOB_STORE_REDIS_PREFIX: str = os.getenv("JOB_STORE_REDIS_PREFIX", "bug-triage")
+    JOB_LEASE_SECONDS: float = float(os.getenv("JOB_LEASE_SECONDS", 120))
+    JOB_POLL_INTERVAL_SECONDS: float = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", 2))
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+    JOB_INSTANCE_ID: str = os.getenv("JOB_INSTANCE_ID", f"{socket.gethostname()}-{os.getpid()}")
+
+    # Code Index Configuration
+    CODE_INDEX_ENABLED: bool = os.getenv("CODE_INDEX_ENABLED", "true").lower() == "true"
+    CODE_INDEX_MAX_COMMITS: int = int(os.getenv("CODE_INDEX_MAX_COMMITS", 5))
+    CODE_INDEX_MAX_SNIPPETS: int = int(os.getenv("CODE_INDEX_MAX_SNIPPETS", 5))
+    CODE_INDEX_CONTEXT_LINES: int = int(os.getenv("CODE_INDEX_CONTEXT_LINES", 15))
+
+    # Git Blame / Ownership Cache Configuration (requires the code index)
+    OWNERSHIP_CACHE_ENABLED: bool = os.getenv("OWNERSHIP_CACHE_ENABLED", "true").lower() == "true"
+    # Only blamed commits newer than this are suggested as suspect commits
+    OWNERSHIP_SUSPECT_DAYS: int = int(os.getenv("OWNERSHIP_SUSPECT_DAYS", 30))
+
+    # Error Reporting Poller Configuration
+    ERROR_POLLER_ENABLED: bool = os.getenv("ERROR_POLLER_ENABLED", "false").lower() == "true"
+    ERROR_POLLER_INTERVAL_SECONDS: int = int(os.getenv("ERROR_POLLER_INTERVAL_SECONDS", 600))
+    # Error Reporting timeRange.period used for groupStats
+    ERROR_POLLER_TIME_RANGE: str = os.getenv("ERROR_POLLER_TIME_RANGE", "PERIOD_1_HOUR")
+    ERROR_POLLER_TOP_N: int = int(os.getenv("ERROR_POLLER_TOP_N", 3))
+    ERROR_POLLER_MAX_PER_HOUR: int = int(os.getenv("ERROR_POLLER_MAX_PER_HOUR", 10))
+    ERROR_POLLER_MIN_EVENTS: int = int(os.getenv("ERROR_POLLER_MIN_EVENTS", 1))
+    # A group already triaged is only picked again after this many seconds, and only when its event
+    # count in the time range reached REGRESSION_FACTOR times the count at its last triage
+    ERROR_POLLER_RETRIAGE_SECONDS: int = int(os.getenv("ERROR_POLLER_RETRIAGE_SECONDS", 24 * 3600))
+    ERROR_POLLER_REGRESSION_FACTOR: float = float(os.getenv("ERROR_POLLER_REGRESSION_FACTOR", 2.0))
+    ERROR_POLLER_SLACK_CHANNEL_ID: str = os.getenv("ERROR_POLLER_SLACK_CHANNEL_ID", "")
+
+    # Analysis Result Cache Configuration
+    ANALYSIS_CACHE_ENABLED: bool = os.getenv("ANALYSIS_CACHE_ENABLED", "true").lower() == "true"
+    ANALYSIS_CACHE_TTL_SECONDS: int = int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+    ANALYSIS_CACHE_MAX_ENTRIES: int = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", 500))
     
     @classmethod
     def validate_required_vars(cls) -> List[str]:
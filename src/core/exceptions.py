@@ -26,3 +26,13 @@ class SlackNotificationError(BugTriageException):
 class ClaudeAnalysisError(BugTriageException):
     """Claude analysis related errors"""
     pass
+
+
+class JobQueueFullError(BugTriageException):
+    """Job queue is full and cannot accept new analysis jobs"""
+    pass
+
+
+class CircuitOpenError(BugTriageException):
+    """Upstream (Claude / GCP) keeps failing and calls are rejected until the circuit breaker resets"""
+    pass
@@ -2,8 +2,13 @@
 Data Models for Bug Triage Service
 """
 
-from typing import Optional
-from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Optional, Literal
+from pydantic import BaseModel, Field, field_validator
+
+
+JobPriority = Literal["high", "normal", "low"]
+JobStatus = Literal["queued", "running", "completed", "failed"]
 
 
 class SlackPayload(BaseModel):
@@ -22,6 +27,40 @@ class BugTriageRequest(BaseModel):
     use_mcp_for_slack_details: Optional[bool] = False
     dry_run: Optional[bool] = False
     custom_prompt: Optional[str] = None
+    priority: Optional[JobPriority] = "normal"
+    # 錯誤發生時間，用來找出當時已部署的 prod release
+    error_time: Optional[datetime] = None
+
+
+class BugTriageBatchRequest(BaseModel):
+    """Batch analysis request for several Error Reporting groups"""
+    error_reporting_group_ids: List[str] = Field(min_length=1)
+    slack_channel_id: Optional[str] = None
+    slack_thread_id: Optional[str] = None
+    dry_run: Optional[bool] = False
+    custom_prompt: Optional[str] = None
+    priority: Optional[JobPriority] = "normal"
+
+
+class BugTriageBatchItem(BaseModel):
+    """Per-group result of a batch analysis request"""
+    error_reporting_group_id: str
+    status: str
+    analysis_id: Optional[str] = None
+    coalesced_into: Optional[str] = None
+    event_count: Optional[int] = None
+    distinct_traces: Optional[int] = None
+    services: List[str] = Field(default_factory=list)
+    first_seen: Optional[datetime] = None
+    last_seen: Optional[datetime] = None
+    detail: Optional[str] = None
+
+
+class BugTriageBatchResponse(BaseModel):
+    """Batch analysis response"""
+    status: str
+    message: str
+    results: List[BugTriageBatchItem]
 
 
 class BugTriageResponse(BaseModel):
@@ -31,3 +70,74 @@ class BugTriageResponse(BaseModel):
     analysis_id: str
     estimated_completion: str
     detail: Optional[str] = None
+
+
+class TriageJob(BaseModel):
+    """Queued bug triage job"""
+    analysis_id: str
+    error_message: str
+    slack_payload: SlackPayload
+    custom_prompt: Optional[str] = None
+    error_time: Optional[datetime] = None
+    # Error Reporting group summary (event counts, affected services) added to the prompt
+    error_context: Optional[str] = None
+    priority: JobPriority = "normal"
+    fingerprint: Optional[str] = None
+    # single-flight key duplicates are coalesced under while the job is queued / running
+    flight_key: Optional[str] = None
+    # Slack threads of duplicate requests coalesced into this job
+    additional_slack_payloads: List[SlackPayload] = Field(default_factory=list)
+    attached_job_ids: List[str] = Field(default_factory=list)
+    coalesced_into: Optional[str] = None
+    status: JobStatus = "queued"
+    # Last pipeline stage reached, claims so far (a crashed instance's claim counts) and the analysis JSON
+    stage: Optional[str] = None
+    attempts: int = 0
+    result: Optional[str] = None
+    # worker holding the lease while the job runs ("<instance id>/<worker id>")
+    lease_owner: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+
+class JobStatusResponse(BaseModel):
+    """Bug Triage Job Status Response Model"""
+    analysis_id: str
+    status: JobStatus
+    priority: JobPriority
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    queue_position: Optional[int] = None
+    fingerprint: Optional[str] = None
+    coalesced_into: Optional[str] = None
+    stage: Optional[str] = None
+    attempts: int = 0
+    error: Optional[str] = None
+    result: Optional[str] = None
+
+
+class AnalysisResult(BaseModel):
+    """Claude analysis output (src/prompt/analysis_prompt.md)"""
+    root_cause_analysis: str
+    root_cause_file_codebase: str
+    database_status: Optional[str] = "None"
+    suspect_commit: str
+    suspect_commit_author: str
+    recommended_person: str
+    recommended_reason: str
+    suggestion: str
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def stringify(cls, value):
+        """Claude occasionally returns lists / objects / null for text fields"""
+        if value is None:
+            return "None"
+        if isinstance(value, list):
+            return "\n".join(str(item) if str(item).startswith("-") else f"- {item}" for item in value)
+        if isinstance(value, dict):
+            return "\n".join(f"- {key}: {item}" for key, item in value.items())
+        return str(value)
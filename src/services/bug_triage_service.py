@@ -3,17 +3,30 @@ Bug Triage Service
 Handles bug analysis using Claude Code
 """
 
+import asyncio
+import itertools
 import logging
 import os
-from typing import Optional
+from datetime import datetime
+from typing import List, Optional
 
 from src.core.config import Config
 from src.core.models import SlackPayload
 from src.core.exceptions import ConfigurationError, GitOperationError, ClaudeAnalysisError, SlackNotificationError
-from src.utils.git_utils import GitUtils
+from src.utils.git_utils import GitUtils, WorktreeManager
+from src.utils.tag_index_utils import ProdTagIndex
 from src.utils.claude_utils import ClaudeUtils
+from src.utils.cache_utils import AnalysisCache
+from src.utils.code_index_utils import CodeIndex
+from src.utils.ownership_utils import OwnershipCache, format_ownership_context
+from src.utils.fingerprint_utils import compute_error_fingerprint
+from src.utils.stack_trace_utils import ParsedTrace, StackFrame, parse_stack_trace
+from src.utils.metrics_utils import stage_timer
+from src.utils.job_store_utils import JobCheckpoints
 from .slack_service import SlackService
+from .slack_progress_service import SlackProgressPublisher
 from .gcp_error_service import GCPErrorService
+from .repository_refresher_service import RepositoryRefresherService
 
 logger = logging.getLogger(__name__)
 
@@ -23,10 +36,41 @@ class BugTriageService:
     
     def __init__(self):
         self.config = Config()
-        self.git_utils = GitUtils(self.config.CODEBASE_DIR)
+        self.git_utils = GitUtils(self.config.GIT_MIRROR_DIR)
+        self.worktree_manager = WorktreeManager(
+            self.config.GIT_MIRROR_DIR,
+            self.config.GIT_WORKTREE_DIR,
+            idle_seconds=self.config.GIT_WORKTREE_IDLE_SECONDS,
+            max_idle=self.config.GIT_WORKTREE_MAX_IDLE
+        )
         self.claude_utils = ClaudeUtils(self.config.CODEBASE_DIR)
         self.slack_service = SlackService()
         self.gcp_error_service = GCPErrorService()
+        self.analysis_cache = None
+        if self.config.ANALYSIS_CACHE_ENABLED:
+            self.analysis_cache = AnalysisCache(
+                os.path.join(self.config.DATA_DIR, "analysis_cache.sqlite3"),
+                ttl_seconds=self.config.ANALYSIS_CACHE_TTL_SECONDS,
+                max_entries=self.config.ANALYSIS_CACHE_MAX_ENTRIES
+            )
+        self.code_index = None
+        if self.config.CODE_INDEX_ENABLED:
+            self.code_index = CodeIndex(
+                self.git_utils,
+                os.path.join(self.config.DATA_DIR, "code_index.sqlite3"),
+                max_commits=self.config.CODE_INDEX_MAX_COMMITS
+            )
+        self.ownership_cache = None
+        if self.code_index and self.config.OWNERSHIP_CACHE_ENABLED:
+            self.ownership_cache = OwnershipCache(
+                self.git_utils,
+                os.path.join(self.config.DATA_DIR, "ownership_cache.sqlite3"),
+                max_commits=self.config.CODE_INDEX_MAX_COMMITS
+            )
+        self.tag_index = ProdTagIndex(self.git_utils, os.path.join(self.config.DATA_DIR, "prod_tag_index.json"))
+        self.repository_refresher = RepositoryRefresherService(
+            self.git_utils, self.tag_index, on_commit_change=self.on_deployed_commit_change
+        )
         self._init_environment()
     
     def _init_environment(self):
@@ -35,6 +79,9 @@ class BugTriageService:
             missing_vars = self.config.validate_required_vars()
             if missing_vars:
                 raise ConfigurationError(f"Missing required environment variables: {missing_vars}")
+            # 輪詢的分析結果沒有其他可回覆的地方
+            if self.config.ERROR_POLLER_ENABLED and not self.config.ERROR_POLLER_SLACK_CHANNEL_ID:
+                raise ConfigurationError("ERROR_POLLER_SLACK_CHANNEL_ID is required when ERROR_POLLER_ENABLED=true")
             
             logger.info("Environment variables validated successfully")
             
@@ -42,42 +89,198 @@ class BugTriageService:
             logger.error(f"Failed to initialize environment: {e}")
             raise
     
-    def clone_or_update_repository(self) -> bool:
-        """Clone or update GitHub repository and checkout to deployed commit"""
+    async def resolve_commit(self, error_time: Optional[datetime] = None) -> str:
+        """Get the commit deployed when the error occurred (or the latest one) from the background refresher"""
         try:
-            # Step 1: Clone/update repository
-            clone_success = self.git_utils.clone_or_update_repository(
-                self.config.GITHUB_TOKEN, 
-                self.config.GITHUB_PROJECT
-            )
-            if not clone_success:
-                return False
-            
-            # Step 2: Checkout to latest deployed commit to exclude undeployed commits
-            checkout_success = self.git_utils.checkout_to_deployed_commit()
-            if not checkout_success:
-                logger.warning("Failed to checkout to deployed commit, proceeding with master HEAD")
-            
-            return True
+            return await self.repository_refresher.get_commit(error_time)
         except Exception as e:
             logger.error(f"Repository operation failed: {e}")
             raise GitOperationError(f"Failed to clone/update repository: {e}")
-    
-    async def analyze_bug(self, error_message: str, analysis_id: str, slack_payload: SlackPayload, custom_prompt: Optional[str] = None) -> str:
-        """Analyze bug using Claude Code"""
+
+    async def acquire_worktree(self, commit_hash: str) -> str:
+        """Get a worktree checked out at the commit, shared with other jobs on the same commit"""
+        try:
+            return await self.worktree_manager.acquire(commit_hash)
+        except Exception as e:
+            logger.error(f"Failed to create worktree for {commit_hash}: {e} {getattr(e, 'stderr', '')}")
+            raise GitOperationError(f"Failed to create worktree: {e}")
+
+    async def release_worktree(self, commit_hash: str):
+        """Release a worktree reference and collect idle worktrees"""
+        self.worktree_manager.release(commit_hash)
         try:
+            await self.worktree_manager.gc()
+        except Exception as e:
+            logger.warning(f"Worktree garbage collection failed: {e}")
+
+    async def analyze_bug(
+        self,
+        error_message: str,
+        analysis_id: str,
+        slack_payload: SlackPayload,
+        custom_prompt: Optional[str] = None,
+        commit_hash: Optional[str] = None,
+        codebase_dir: Optional[str] = None,
+        error_context: Optional[str] = None,
+        progress: Optional[SlackProgressPublisher] = None,
+        checkpoints: Optional[JobCheckpoints] = None
+    ) -> str:
+        """
+        Analyze bug using Claude Code, serving cached results for the same error and deployed commit.
+        The progress message is only posted on a cache miss, when the analysis will take a while.
+        """
+        try:
+            # Thread details change the analysis input, so only plain error messages are cached
+            fingerprint = None
+            if self.analysis_cache and commit_hash and not slack_payload.read_slack_thread_details:
+                fingerprint = compute_error_fingerprint(error_message)
+            if fingerprint:
+                with stage_timer("cache_lookup") as stage:
+                    cached_result = await asyncio.to_thread(
+                        self.analysis_cache.get, fingerprint, commit_hash, custom_prompt
+                    )
+                    stage["hit"] = bool(cached_result)
+                if cached_result:
+                    logger.info(f"Serving cached analysis for analysis_id: {analysis_id} (fingerprint: {fingerprint})")
+                    return cached_result
+
             logger.info(f"Starting Claude Code analysis for analysis_id: {analysis_id}")
+            if codebase_dir:
+                # 建立程式碼 context 期間先啟動這個 worktree 的 Claude session（CLAUDE_POOL_ENABLED 時）
+                self.claude_utils.prewarm_sessions(codebase_dir)
+            if progress:
+                await progress.start()
+
+            # Parse the stack trace once: the compact form replaces the raw trace in the prompt,
+            # the raw message goes to a payload file the prompt points to (message lines, IDs, library frames)
+            with stage_timer("code_context") as stage:
+                parsed_trace = await self.parse_error(error_message, commit_hash, codebase_dir)
+                prompt_error = error_message
+                if parsed_trace:
+                    prompt_error = parsed_trace.to_compact()
+                    logger.info(
+                        f"Parsed {parsed_trace.language} trace with {len(parsed_trace.frames)} frames, "
+                        f"prompt error {len(error_message)} -> {len(prompt_error)} chars"
+                    )
 
-            result = self.claude_utils.analyze_bug(error_message, slack_payload, custom_prompt)
+                code_context = await self.build_code_context(parsed_trace, commit_hash, codebase_dir)
+                stage["frames"] = len(parsed_trace.frames) if parsed_trace else 0
+                stage["code_context_chars"] = len(code_context or "")
+            issue_summary = await self.get_issue_summary(error_message, slack_payload, checkpoints)
+            if progress:
+                progress.set_stage("Claude 分析中")
+            result = await self.claude_utils.analyze_bug(
+                prompt_error, slack_payload, custom_prompt, codebase_dir, error_context, code_context,
+                on_progress=progress.add_step if progress else None,
+                issue_summary=issue_summary,
+                raw_error=error_message if prompt_error != error_message else None
+            )
             if not result:
                 raise ClaudeAnalysisError("Claude analysis returned no result")
+
+            if fingerprint:
+                await asyncio.to_thread(self.analysis_cache.set, fingerprint, commit_hash, result, custom_prompt)
             
             return result
                 
         except Exception as e:
             logger.error(f"Analysis failed for {analysis_id}: {e}")
             raise ClaudeAnalysisError(f"Bug analysis failed: {e}")
+
+    async def get_issue_summary(
+        self, error_message: str, slack_payload: SlackPayload, checkpoints: Optional[JobCheckpoints] = None
+    ) -> Optional[str]:
+        """Summarize the Slack thread when requested, reusing the summary checkpointed by an earlier run"""
+        if not (slack_payload.read_slack_thread_details and slack_payload.channel_id and slack_payload.thread_id):
+            return None
+        if checkpoints and checkpoints.get("issue_summary"):
+            logger.info("Using checkpointed issue summary")
+            return checkpoints.get("issue_summary")
+
+        issue_summary = await self.claude_utils.generate_issue_summary(error_message, slack_payload)
+        if not issue_summary:
+            raise ClaudeAnalysisError("Issue summary generation failed")
+        if checkpoints:
+            await checkpoints.save("issue_summary", issue_summary)
+        return issue_summary
+
+    @staticmethod
+    def first_incomplete_stage(slack_payload: SlackPayload, checkpoints: JobCheckpoints) -> str:
+        """Stage a resumed job starts from"""
+        if checkpoints.get("analysis"):
+            return "slack_post"
+        if slack_payload.read_slack_thread_details and not checkpoints.get("issue_summary"):
+            return "issue_summary"
+        return "analysis"
+
+    async def parse_error(
+        self,
+        error_message: str,
+        commit_hash: Optional[str],
+        codebase_dir: Optional[str]
+    ) -> Optional[ParsedTrace]:
+        """Parse the stack trace and map its frames to repository paths at the deployed commit"""
+        parsed_trace = parse_stack_trace(error_message)
+        if not parsed_trace or not self.code_index or not commit_hash or not codebase_dir:
+            return parsed_trace
+        try:
+            await self.code_index.ensure_indexed(commit_hash, codebase_dir)
+            await asyncio.to_thread(self.code_index.map_frames, commit_hash, parsed_trace.frames)
+        except Exception as e:
+            # 索引只是加速用，對應失敗時仍使用原始路徑
+            logger.warning(f"Failed to map stack frames to repository paths: {e}")
+        return parsed_trace
     
+    async def build_code_context(
+        self,
+        parsed_trace: Optional[ParsedTrace],
+        commit_hash: Optional[str],
+        codebase_dir: Optional[str]
+    ) -> Optional[str]:
+        """Snippets around the mapped stack frames plus blame candidates for the prompt"""
+        if not parsed_trace or not self.code_index or not commit_hash or not codebase_dir:
+            return None
+        frames = [frame for frame in parsed_trace.app_frames if frame.repo_path]
+        if not frames:
+            return None
+        try:
+            code_context = await asyncio.to_thread(
+                self.code_index.build_code_context,
+                codebase_dir,
+                frames,
+                self.config.CODE_INDEX_MAX_SNIPPETS,
+                self.config.CODE_INDEX_CONTEXT_LINES
+            )
+            if code_context:
+                logger.info(f"Injecting {code_context.count('```') // 2} code snippets into the prompt")
+
+            ownership_context = await self.build_ownership_context(frames, commit_hash)
+            if ownership_context:
+                code_context = f"{code_context}\n\n{ownership_context}" if code_context else ownership_context
+            return code_context
+        except Exception as e:
+            # 索引只是加速用，失敗時仍讓 Claude 自行搜尋
+            logger.warning(f"Failed to build code context: {e}")
+            return None
+
+    async def build_ownership_context(self, frames: List[StackFrame], commit_hash: str) -> Optional[str]:
+        """Pre-fill suspect commit / owner candidates from the blame cache for the frames in the trace"""
+        if not self.ownership_cache:
+            return None
+        ownership = await self.ownership_cache.lookup(
+            commit_hash,
+            [(frame.repo_path, frame.repo_line) for frame in frames[:self.config.CODE_INDEX_MAX_SNIPPETS]],
+            recent_days=self.config.OWNERSHIP_SUSPECT_DAYS
+        )
+        return format_ownership_context(ownership)
+
+    async def on_deployed_commit_change(self, previous_commit: str, commit_hash: str):
+        """Carry the blame cache over to a newly deployed commit and drop cached results of older deploys"""
+        if self.analysis_cache:
+            await asyncio.to_thread(self.analysis_cache.invalidate_except, commit_hash)
+        if self.ownership_cache:
+            await self.ownership_cache.advance(previous_commit, commit_hash)
+
     async def send_to_slack(self, analysis_id: str, analysis_result: str, slack_payload: SlackPayload):
         """Send analysis result to Slack"""
         try:
@@ -96,32 +299,100 @@ class BugTriageService:
             logger.error(f"Slack notification failed: {e}")
             raise SlackNotificationError(f"Failed to send to Slack: {e}")
     
+    async def deliver_result(
+        self,
+        analysis_id: str,
+        analysis_result: str,
+        slack_payload: SlackPayload,
+        checkpoints: Optional[JobCheckpoints] = None
+    ):
+        """Send the result to one Slack thread unless an earlier run of the job already did"""
+        stage = f"slack:{slack_payload.channel_id}:{slack_payload.thread_id or ''}"
+        if checkpoints and checkpoints.get(stage):
+            logger.info(f"Result of {analysis_id} was already delivered to {slack_payload.channel_id}, skipping")
+            return
+        await self.send_to_slack(analysis_id, analysis_result, slack_payload)
+        if checkpoints:
+            await checkpoints.save(stage, datetime.now().isoformat())
+
     async def process_bug_analysis(
         self, 
         error_message: str, 
         slack_payload: SlackPayload,
         analysis_id: str,
-        custom_prompt: Optional[str] = None
-    ):
-        """Main process for bug analysis workflow"""
+        custom_prompt: Optional[str] = None,
+        additional_slack_payloads: Optional[List[SlackPayload]] = None,
+        error_time: Optional[datetime] = None,
+        error_context: Optional[str] = None,
+        checkpoints: Optional[JobCheckpoints] = None
+    ) -> str:
+        """
+        Main process for bug analysis workflow; returns the analysis result.
+        additional_slack_payloads may keep growing while the analysis runs (coalesced duplicates),
+        every payload in it receives the same result.
+        Stage outputs (issue summary, analysis JSON, delivered threads) are saved to checkpoints,
+        so a retried job skips what an earlier run already finished.
+        """
+        progress = SlackProgressPublisher.create(self.slack_service, slack_payload)
+        succeeded = False
         try:
             logger.info(f"Starting bug analysis workflow for analysis_id: {analysis_id}")
             
-            # Step 1: Clone or update repository
-            if not self.clone_or_update_repository():
-                raise GitOperationError("Failed to prepare codebase")
-            
-            # Step 2: Analyze bug
-            analysis_result = await self.analyze_bug(error_message, analysis_id, slack_payload, custom_prompt)
+            analysis_result = checkpoints.get("analysis") if checkpoints else None
+            if analysis_result:
+                logger.info(f"Resuming {analysis_id} from checkpoint, skipping git prep and analysis")
+            else:
+                # Step 1: Get a worktree at the deployed commit (the mirror is refreshed in the background)
+                with stage_timer("git_prep") as stage:
+                    commit_hash = await self.resolve_commit(error_time)
+                    codebase_dir = await self.acquire_worktree(commit_hash)
+                    stage["commit"] = commit_hash
+                try:
+                    # Step 2: Analyze bug
+                    analysis_result = await self.analyze_bug(
+                        error_message, analysis_id, slack_payload, custom_prompt, commit_hash, codebase_dir,
+                        error_context, progress, checkpoints
+                    )
+                finally:
+                    await self.release_worktree(commit_hash)
+
+                if not analysis_result:
+                    raise ClaudeAnalysisError("Claude analysis returned no result")
+                if checkpoints:
+                    await checkpoints.save("analysis", analysis_result)
             
             # Step 3: Send to Slack
-            if not analysis_result:
-                raise ClaudeAnalysisError("Claude analysis returned no result")
+            with stage_timer("slack_post") as stage:
+                # 主要 payload 沒有 channel 或某個 thread 發送失敗時，其他 thread 仍要先收到結果；
+                # 迭代即時的 list，發送期間才合併進來的 thread 也會收到
+                delivered = 0
+                failed = 0
+                extra_payloads = additional_slack_payloads if additional_slack_payloads is not None else []
+                for payload in itertools.chain([slack_payload], extra_payloads):
+                    if not payload.channel_id:
+                        continue
+                    try:
+                        await self.deliver_result(analysis_id, analysis_result, payload, checkpoints)
+                        delivered += 1
+                    except SlackNotificationError as e:
+                        failed += 1
+                        logger.error(f"Failed to deliver result of {analysis_id} to {payload.channel_id}/{payload.thread_id}: {e}")
+                stage["threads"] = delivered
+                stage["failed_threads"] = failed
+                # 任一 thread 失敗都讓 job 失敗，才能用 /jobs/{id}/resume 補送；
+                # 已送達的 thread 有 checkpoint，resume 時不會重複發送
+                if failed or not delivered:
+                    raise SlackNotificationError(
+                        f"Result of {analysis_id} was not delivered to {failed} of {failed + delivered} Slack threads"
+                    )
 
-            await self.send_to_slack(analysis_id, analysis_result, slack_payload)
-            
+            succeeded = True
             logger.info(f"Bug analysis workflow completed for analysis_id: {analysis_id}")
+            return analysis_result
             
         except Exception as e:
             logger.error(f"Bug analysis workflow failed: {e}")
             raise
+        finally:
+            if progress:
+                await progress.finish(succeeded, "" if succeeded else f"analysis_id: {analysis_id}")
@@ -0,0 +1,229 @@
+"""
+Error Reporting Poller Service
+Periodically pulls new or regressed error groups from GCP Error Reporting and queues the worst ones
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from src.core.config import Config
+from src.services.gcp_error_service import GCPErrorService
+from src.utils.error_event_utils import parse_event_time
+
+logger = logging.getLogger(__name__)
+
+PERIOD_SECONDS = {
+    "PERIOD_1_HOUR": 3600,
+    "PERIOD_6_HOURS": 6 * 3600,
+    "PERIOD_1_DAY": 24 * 3600,
+    "PERIOD_1_WEEK": 7 * 24 * 3600,
+    "PERIOD_30_DAYS": 30 * 24 * 3600,
+}
+
+# 已分析 group 的紀錄保留時間，期間內事件數量上升才視為 regression
+TRIAGE_HISTORY_SECONDS = 30 * 24 * 3600
+
+
+class ErrorPollerService:
+    """
+    Polls Error Reporting groupStats on an interval and ranks new groups (first seen within the time range
+    or since the last poll) and regressed groups (event count rose since their last triage) by event rate,
+    handing the top-N (within an hourly budget) to the submit handler. Chronic groups that keep firing at
+    the same level are not picked again.
+    The watermark and triage history are persisted so restarts do not re-triage the same groups.
+    """
+
+    def __init__(
+        self,
+        gcp_error_service: GCPErrorService,
+        handler: Callable[[dict], Awaitable[Optional[str]]],
+        state_path: str
+    ):
+        self.config = Config()
+        self.gcp_error_service = gcp_error_service
+        # handler(digest) queues an analysis and returns its analysis_id, or None when it was not queued
+        self.handler = handler
+        self.state_path = state_path
+        self.interval_seconds = max(30, self.config.ERROR_POLLER_INTERVAL_SECONDS)
+        self.period = self.config.ERROR_POLLER_TIME_RANGE
+        self.period_seconds = PERIOD_SECONDS.get(self.period, 3600)
+        self.watermark: Optional[float] = None
+        # group_id -> {"at": unix time it was last queued, "count": event count in the time range at that time}
+        self.triaged: Dict[str, dict] = {}
+        # unix times of queued analyses within the last hour, for the hourly budget
+        self.enqueued_at: List[float] = []
+        self.last_polled_at: Optional[datetime] = None
+        self.last_candidates = 0
+        self.last_enqueued: List[str] = []
+        self.last_error: Optional[str] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._load()
+
+    async def start(self):
+        """Start the polling loop"""
+        if self._task:
+            return
+        self._task = asyncio.create_task(self._poll_loop(), name="error-poller")
+        logger.info(f"Error poller started (interval: {self.interval_seconds}s, range: {self.period})")
+
+    async def stop(self):
+        """Stop the polling loop"""
+        if not self._task:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        logger.info("Error poller stopped")
+
+    async def poll(self) -> List[str]:
+        """Run one poll; returns the analysis ids that were queued"""
+        async with self._lock:
+            now = time.time()
+            try:
+                enqueued = await self._poll(now)
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Error poll failed, keeping watermark {self.watermark}: {e}")
+                # 已排入的 group 仍要記錄，避免下次重複分析
+                self._save()
+                return []
+
+            self.watermark = now
+            self.last_polled_at = datetime.now()
+            self.last_enqueued = enqueued
+            self.last_error = None
+            self._save()
+            return enqueued
+
+    async def _poll(self, now: float) -> List[str]:
+        """List group stats, pick candidates and queue the top ranked ones"""
+        watermark = self.watermark or now - self.period_seconds
+        # 停機超過一個時間範圍時，期間第一次出現的 group 仍算新的；預算不足沒排入的新 group 下次仍是候選
+        new_since = min(watermark, now - self.period_seconds)
+        group_stats = await self.gcp_error_service.list_group_stats(self.period)
+
+        candidates = []
+        for stat in group_stats:
+            group = stat.get("group") or {}
+            group_id = group.get("groupId")
+            if not group_id or group.get("resolutionStatus") == "MUTED":
+                continue
+            count = int(stat.get("count") or 0)
+            if count < self.config.ERROR_POLLER_MIN_EVENTS:
+                continue
+            last_seen = parse_event_time(stat.get("lastSeenTime"))
+            if not last_seen or last_seen.timestamp() <= watermark:
+                continue
+            last_triaged = self.triaged.get(group_id)
+            if last_triaged:
+                # 已分析過的 group 要超過 RETRIAGE 時間、且事件數量比上次分析時明顯上升才重新分析（regression）；
+                # 持續以相同頻率發生的慢性錯誤不再重複分析
+                if now - last_triaged["at"] < self.config.ERROR_POLLER_RETRIAGE_SECONDS:
+                    continue
+                if count < last_triaged["count"] * self.config.ERROR_POLLER_REGRESSION_FACTOR:
+                    continue
+            else:
+                first_seen = parse_event_time(stat.get("firstSeenTime"))
+                if not first_seen or first_seen.timestamp() <= new_since:
+                    continue
+            candidates.append((self._event_rate(stat, count, now), group_id, count))
+
+        candidates.sort(reverse=True)
+        self.last_candidates = len(candidates)
+        self._prune(now)
+        budget = max(0, self.config.ERROR_POLLER_MAX_PER_HOUR - len(self.enqueued_at))
+        selected = candidates[:min(self.config.ERROR_POLLER_TOP_N, budget)]
+        if candidates:
+            logger.info(
+                f"Error poll: {len(candidates)} new/regressed groups, queueing {len(selected)} "
+                f"(hourly budget left: {budget})"
+            )
+
+        enqueued = []
+        for rate, group_id, count in selected:
+            digest = await self.gcp_error_service.get_error_group_digest(group_id)
+            if not digest or not digest.get("representative_message"):
+                continue
+            analysis_id = await self.handler(digest)
+            if not analysis_id:
+                continue
+            logger.info(f"Queued {analysis_id} for group {group_id} ({count} events, {rate * 3600:.1f}/h)")
+            self.triaged[group_id] = {"at": now, "count": count}
+            self.enqueued_at.append(now)
+            enqueued.append(analysis_id)
+        return enqueued
+
+    def _event_rate(self, stat: dict, count: int, now: float) -> float:
+        """Events per second over the part of the time range the group was active"""
+        first_seen = parse_event_time(stat.get("firstSeenTime"))
+        active_seconds = self.period_seconds
+        if first_seen:
+            active_seconds = min(active_seconds, now - first_seen.timestamp())
+        return count / max(60.0, active_seconds)
+
+    def _prune(self, now: float):
+        """Drop budget entries older than an hour and triage history past TRIAGE_HISTORY_SECONDS"""
+        self.enqueued_at = [t for t in self.enqueued_at if now - t < 3600]
+        self.triaged = {
+            group_id: triaged for group_id, triaged in self.triaged.items()
+            if now - triaged["at"] < max(TRIAGE_HISTORY_SECONDS, self.config.ERROR_POLLER_RETRIAGE_SECONDS)
+        }
+
+    async def _poll_loop(self):
+        """Poll immediately, then every interval_seconds"""
+        while True:
+            await self.poll()
+            await asyncio.sleep(self.interval_seconds)
+
+    def _load(self):
+        """Load the persisted watermark and triage history"""
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.watermark = data.get("watermark")
+            # 舊格式（只有排入時間）沒有事件數量，無法判斷 regression，直接略過
+            self.triaged = {
+                group_id: triaged for group_id, triaged in data.get("triaged", {}).items() if isinstance(triaged, dict)
+            }
+            self.enqueued_at = data.get("enqueued_at", [])
+            logger.info(f"[ErrorPoller] loaded watermark {self.watermark} from {self.state_path}")
+        except Exception as e:
+            logger.warning(f"[ErrorPoller] failed to load {self.state_path}: {e}")
+
+    def _save(self):
+        """Persist the state atomically"""
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            tmp_path = f"{self.state_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "watermark": self.watermark,
+                    "triaged": self.triaged,
+                    "enqueued_at": self.enqueued_at,
+                }, f)
+            os.replace(tmp_path, self.state_path)
+        except Exception as e:
+            logger.warning(f"[ErrorPoller] failed to save {self.state_path}: {e}")
+
+    def status(self) -> dict:
+        """Poller state for health/diagnostics"""
+        return {
+            "enabled": self._task is not None,
+            "time_range": self.period,
+            "interval_seconds": self.interval_seconds,
+            "watermark": datetime.fromtimestamp(self.watermark, timezone.utc).isoformat() if self.watermark else None,
+            "last_polled_at": self.last_polled_at.isoformat() if self.last_polled_at else None,
+            "last_candidates": self.last_candidates,
+            "last_enqueued": self.last_enqueued,
+            "queued_last_hour": len([t for t in self.enqueued_at if time.time() - t < 3600]),
+            "max_per_hour": self.config.ERROR_POLLER_MAX_PER_HOUR,
+            "last_error": self.last_error,
+        }
@@ -2,14 +2,23 @@
 GCP Error Reporting Service
 """
 
-import json
-import requests
-import os
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import httpx
 from src.core.config import Config
+from src.core.exceptions import ConfigurationError
+from src.utils.error_event_utils import aggregate_error_events, parse_event_time
+from src.utils.metrics_utils import stage_timer
+from src.utils.retry_utils import classify_http_failure, gcp_retry_policy, parse_retry_after
 
 from google.oauth2 import service_account
 from google.auth.transport.requests import Request
 
+logger = logging.getLogger(__name__)
 
 
 class GCPErrorService:
@@ -21,6 +30,12 @@ class GCPErrorService:
         self.client_email = self.config.GCP_SERVICE_ACCOUNT_EMAIL
         self.private_key = self.config.GCP_SERVICE_ACCOUNT_PRIVATE_KEY
         self.base_url = "https://clouderrorreporting.googleapis.com/v1beta1"
+        self.timeout = self.config.GCP_TIMEOUT_SECONDS
+        self.retry_policy = gcp_retry_policy
+        self._credentials = None
+        self._token_lock = threading.Lock()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._group_semaphore = asyncio.Semaphore(max(1, self.config.GCP_MAX_CONCURRENCY))
         # 啟動時自動產生帶 token 的 database_prompt runtime 檔
         try:
             token = self.get_access_token()
@@ -38,11 +53,39 @@ class GCPErrorService:
         with open(prompt_file, 'w', encoding='utf-8') as f:
             f.write(replaced_content)
             
+    # 距離過期不到這個時間就提前換新 token
+    TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
     def get_access_token(self) -> str:
-        """Get access token for GCP API"""
-        scopes = ['https://www.googleapis.com/auth/cloud-platform']
-        
-        if self.private_key and self.client_email:
+        """Get access token for GCP API; the cached token is only refreshed when it is about to expire"""
+        with self._token_lock:
+            credentials = self._get_credentials()
+            if not credentials.token or not credentials.expiry \
+                    or credentials.expiry - datetime.utcnow() < self.TOKEN_REFRESH_MARGIN:
+                credentials.refresh(Request())
+                logger.info(f"Refreshed GCP access token (expires at {credentials.expiry} UTC)")
+            return credentials.token
+
+    async def get_access_token_async(self) -> str:
+        """Get access token without blocking the event loop when a refresh is needed"""
+        credentials = self._credentials
+        if credentials is not None and credentials.token and credentials.expiry \
+                and credentials.expiry - datetime.utcnow() >= self.TOKEN_REFRESH_MARGIN:
+            return credentials.token
+        return await asyncio.to_thread(self.get_access_token)
+
+    def invalidate_access_token(self):
+        """Force the next call to fetch a new token (e.g. after a 401)"""
+        with self._token_lock:
+            if self._credentials is not None:
+                self._credentials.token = None
+
+    def _get_credentials(self):
+        """Build the service account credentials once"""
+        if self._credentials is None:
+            if not (self.private_key and self.client_email):
+                raise ConfigurationError("GCP_SERVICE_ACCOUNT_EMAIL and GCP_SERVICE_ACCOUNT_PRIVATE_KEY are required")
+            scopes = ['https://www.googleapis.com/auth/cloud-platform']
             credentials_info = {
                 "type": "service_account",
                 "project_id": self.project_id,
@@ -50,33 +93,169 @@ class GCPErrorService:
                 "client_email": self.client_email,
                 "token_uri": "https://oauth2.googleapis.com/token"
             }
-            credentials = service_account.Credentials.from_service_account_info(
+            self._credentials = service_account.Credentials.from_service_account_info(
                 credentials_info, scopes=scopes)
-        
-        credentials.refresh(Request())
-        return credentials.token
+        return self._credentials
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Shared HTTP client so connections to the Error Reporting API are pooled"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            )
+        return self._client
+
+    async def close(self):
+        """Close pooled HTTP connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(self, path: str, params: Optional[dict] = None) -> dict:
+        """
+        GET an Error Reporting API path under the shared GCP retry policy: 429 / 5xx / network errors
+        are retried with jittered backoff (Retry-After wins), and calls are rejected with
+        CircuitOpenError while the API keeps failing. A 401 invalidates the cached token and retries
+        once with a new one.
+        """
+        client = self._get_client()
+        token_refreshed = False
+        attempt = 1
+        while True:
+            trial_id = self.retry_policy.check()
+            try:
+                access_token = await self.get_access_token_async()
+                response = await client.get(path, params=params, headers={"Authorization": f"Bearer {access_token}"})
+            except httpx.HTTPError as e:
+                failure = classify_http_failure(exception=e)
+                self.retry_policy.record_failure(failure)
+                if not self.retry_policy.should_retry(failure, attempt):
+                    raise
+                logger.warning(f"GCP request {path} failed ({e})")
+                await self.retry_policy.backoff(attempt)
+                attempt += 1
+                continue
+            except BaseException:
+                # token 取得失敗（或呼叫被取消）時沒有結果可記錄，釋放 half-open 的試探名額，避免 breaker 卡住
+                self.retry_policy.release(trial_id)
+                raise
+
+            if response.status_code == 401 and not token_refreshed:
+                logger.warning("GCP access token rejected, refreshing")
+                self.invalidate_access_token()
+                self.retry_policy.release(trial_id)
+                token_refreshed = True
+                continue
+            if response.is_success:
+                self.retry_policy.record_success()
+                return response.json()
+
+            failure = classify_http_failure(status_code=response.status_code)
+            self.retry_policy.record_failure(failure)
+            if not self.retry_policy.should_retry(failure, attempt):
+                response.raise_for_status()
+            logger.warning(f"GCP request {path} returned HTTP {response.status_code}")
+            await self.retry_policy.backoff(attempt, parse_retry_after(response.headers.get("Retry-After")))
+            attempt += 1
 
     def get_first_error_message(self, data: dict) -> str:
         """Extract first error message from error events data"""
+        error_event = self.get_first_error_event(data)
+        if not error_event:
+            return None
+        return error_event.get('message', '')
+
+    def get_first_error_event(self, data: dict) -> Optional[dict]:
+        """Extract first error event from error events data"""
         error_events = data.get('errorEvents', [])
         if not error_events:
             return None
-        return error_events[0].get('message', '')
+        return error_events[0]
+
+    def get_event_time(self, error_event: dict) -> Optional[datetime]:
+        """Parse eventTime (RFC3339, e.g. 2024-01-01T00:00:00.123456Z) of an error event"""
+        return parse_event_time(error_event.get('eventTime')) if error_event else None
 
-    def get_gcp_error_events_message(self, group_id: str) -> str:
+    async def get_gcp_error_events_message(self, group_id: str) -> str:
         """Get error message from GCP Error Reporting for given group ID"""
+        error_event = await self.get_gcp_error_event(group_id)
+        if not error_event:
+            return None
+        return error_event.get('message', '')
+
+    async def get_gcp_error_event(self, group_id: str) -> Optional[dict]:
+        """Get the first error event from GCP Error Reporting for given group ID"""
         try:
-            access_token = self.get_access_token()
-            url = f"{self.base_url}/projects/{self.project_id}/events?groupId={group_id}"
-            headers = {
-                "Authorization": f"Bearer {access_token}"
-            }
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            
-            data = response.json()
-            return self.get_first_error_message(data)
+            data = await self.request(f"/projects/{self.project_id}/events", params={"groupId": group_id})
+            return self.get_first_error_event(data)
             
         except Exception as e:
-            print(f"Error fetching GCP error events: {e}")
+            logger.error(f"Error fetching GCP error events: {e}")
             return None
+
+    async def list_error_events(self, group_id: str) -> Tuple[List[dict], bool]:
+        """
+        List events of a group following nextPageToken, up to GCP_EVENTS_MAX_PAGES pages.
+        Returns (events, truncated) where truncated means more pages were left unread.
+        """
+        events = []
+        page_token = None
+        for _ in range(max(1, self.config.GCP_EVENTS_MAX_PAGES)):
+            params = {
+                "groupId": group_id,
+                "pageSize": self.config.GCP_EVENTS_PAGE_SIZE,
+                "timeRange.period": self.config.GCP_EVENTS_TIME_RANGE,
+            }
+            if page_token:
+                params["pageToken"] = page_token
+            data = await self.request(f"/projects/{self.project_id}/events", params=params)
+            events.extend(data.get('errorEvents', []))
+            page_token = data.get('nextPageToken')
+            if not page_token:
+                return events, False
+        return events, True
+
+    async def get_error_group_digest(self, group_id: str) -> Optional[dict]:
+        """Aggregate the recent events of a group; the digest carries the richest trace to analyze"""
+        try:
+            with stage_timer("gcp_fetch", group_id=group_id) as stage:
+                async with self._group_semaphore:
+                    events, truncated = await self.list_error_events(group_id)
+                stage["events"] = len(events)
+            digest = aggregate_error_events(group_id, events, truncated)
+            if digest:
+                logger.info(
+                    f"Group {group_id}: {digest['event_count']} events, "
+                    f"{digest['distinct_traces']} distinct traces, services: {digest['services']}"
+                )
+            return digest
+        except Exception as e:
+            logger.error(f"Error fetching GCP error events for group {group_id}: {e}")
+            return None
+
+    async def get_error_group_digests(self, group_ids: List[str]) -> Dict[str, Optional[dict]]:
+        """Fetch digests of several groups concurrently (bounded by GCP_MAX_CONCURRENCY)"""
+        unique_group_ids = list(dict.fromkeys(group_ids))
+        digests = await asyncio.gather(*(self.get_error_group_digest(group_id) for group_id in unique_group_ids))
+        return dict(zip(unique_group_ids, digests))
+
+    async def list_group_stats(self, period: str, max_pages: int = 1) -> List[dict]:
+        """List error group stats for a time range, most frequent first, following nextPageToken"""
+        group_stats = []
+        page_token = None
+        for _ in range(max(1, max_pages)):
+            params = {
+                "timeRange.period": period,
+                "order": "COUNT_DESC",
+                "pageSize": self.config.GCP_EVENTS_PAGE_SIZE,
+            }
+            if page_token:
+                params["pageToken"] = page_token
+            data = await self.request(f"/projects/{self.project_id}/groupStats", params=params)
+            group_stats.extend(data.get('errorGroupStats', []))
+            page_token = data.get('nextPageToken')
+            if not page_token:
+                break
+        return group_stats
@@ -0,0 +1,280 @@
+"""
+Job Queue Service
+Priority queue of bug triage jobs kept in a durable job store and run by a fixed worker pool.
+Several instances can share the store; each job is leased by one worker at a time.
+"""
+
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from src.core.config import Config
+from src.core.exceptions import JobQueueFullError
+from src.core.models import TriageJob
+from src.utils.job_store_utils import JobCheckpoints, JobStore, create_job_store, merge_slack_payloads
+from src.utils.metrics_utils import add_stage_listener, current_analysis_id, job_queue_wait, jobs_total, stage_timer
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_RANKS = {"high": 0, "normal": 1, "low": 2}
+
+
+class JobQueueService:
+    """Service that runs triage jobs from the job store on a bounded worker pool"""
+
+    def __init__(self, handler: Callable[[TriageJob], Awaitable[Optional[str]]], store: Optional[JobStore] = None):
+        self.config = Config()
+        self.handler = handler
+        self.store = store or create_job_store(self.config)
+        self.worker_count = max(1, self.config.JOB_WORKER_COUNT)
+        self.max_size = max(1, self.config.JOB_QUEUE_MAX_SIZE)
+        self.history_size = max(1, self.config.JOB_HISTORY_SIZE)
+        self.coalesce_enabled = self.config.JOB_COALESCE_ENABLED
+        self.instance_id = self.config.JOB_INSTANCE_ID
+        self.lease_seconds = self.config.JOB_LEASE_SECONDS
+        self.poll_interval = self.config.JOB_POLL_INTERVAL_SECONDS
+        self.max_attempts = max(1, self.config.JOB_MAX_ATTEMPTS)
+        # jobs running on this instance (analysis_id -> job)
+        self._running: Dict[str, TriageJob] = {}
+        self._counts = {"queued": 0, "running": 0}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+        self._maintenance: Optional[asyncio.Task] = None
+        add_stage_listener(self._on_stage)
+
+    async def start(self):
+        """Start worker tasks on the running event loop"""
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        # 先收回已過期的 lease（例如上一個 instance 被強制終止）
+        await self._maintain()
+        self._workers = [
+            asyncio.create_task(self._worker(worker_id), name=f"triage-worker-{worker_id}")
+            for worker_id in range(self.worker_count)
+        ]
+        self._maintenance = asyncio.create_task(self._maintenance_loop(), name="triage-queue-maintenance")
+        logger.info(
+            f"Job queue started with {self.worker_count} workers "
+            f"(store: {self.store.backend}, instance: {self.instance_id}, max queue size: {self.max_size})"
+        )
+
+    async def stop(self):
+        """Cancel worker tasks; running jobs are put back in the queue for the next instance"""
+        tasks = self._workers + ([self._maintenance] if self._maintenance else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._maintenance = None
+        await self.store.close()
+        logger.info("Job queue stopped")
+
+    async def submit(self, job: TriageJob) -> TriageJob:
+        """
+        Enqueue a job, raising JobQueueFullError when the queue is at capacity.
+        Duplicates of an in-flight job are attached to it instead of being queued.
+        """
+        if self._wakeup is None:
+            raise RuntimeError("Job queue is not started")
+
+        job.flight_key = self._single_flight_key(job)
+        if job.flight_key:
+            primary = await self.store.find_inflight(job.flight_key)
+            if primary:
+                attached = await self._attach(primary, job)
+                if attached:
+                    return attached
+
+        counts = await self.store.counts()
+        if counts["queued"] >= self.max_size:
+            logger.warning(f"Job queue is full ({self.max_size}), rejecting {job.analysis_id}")
+            raise JobQueueFullError(f"Job queue is full ({self.max_size} pending jobs)")
+
+        await self.store.add(job, PRIORITY_RANKS[job.priority])
+        self._counts["queued"] = counts["queued"] + 1
+        self._wakeup.set()
+        logger.info(f"Job {job.analysis_id} queued (priority: {job.priority}, depth: {self._counts['queued']})")
+        return job
+
+    def _single_flight_key(self, job: TriageJob) -> Optional[str]:
+        """Key for coalescing duplicates; thread-specific analyses are never coalesced"""
+        if not self.coalesce_enabled or not job.fingerprint:
+            return None
+        if job.slack_payload.read_slack_thread_details:
+            return None
+        prompt_hash = hashlib.sha1((job.custom_prompt or "").encode('utf-8')).hexdigest()[:8]
+        return f"{job.fingerprint}:{prompt_hash}"
+
+    async def _attach(self, primary: TriageJob, job: TriageJob) -> Optional[TriageJob]:
+        """Attach a duplicate job to the in-flight primary job; None if the primary just finished"""
+        attached = await self.store.attach(primary.analysis_id, job)
+        if attached is None:
+            return None
+        # primary 在這個 instance 執行中：直接加入 live list，其他 instance 在續約 lease 時同步
+        local_primary = self._running.get(primary.analysis_id)
+        if local_primary and job.slack_payload.channel_id:
+            merge_slack_payloads(local_primary.additional_slack_payloads, [job.slack_payload])
+        logger.info(
+            f"Job {job.analysis_id} coalesced into in-flight job {primary.analysis_id} "
+            f"(fingerprint: {job.fingerprint})"
+        )
+        return attached
+
+    async def get_job(self, analysis_id: str) -> Optional[TriageJob]:
+        """Get job by analysis ID; coalesced duplicates report the state of their primary job"""
+        job = await self.store.get(analysis_id)
+        if job and job.coalesced_into:
+            primary = await self.store.get(job.coalesced_into)
+            if primary:
+                job.status = primary.status
+                job.stage = primary.stage
+                job.started_at = primary.started_at
+                job.finished_at = primary.finished_at
+                job.error = primary.error
+                job.result = primary.result
+        return job
+
+    async def load_checkpoints(self, analysis_id: str) -> JobCheckpoints:
+        """Stage outputs saved by earlier runs of the job"""
+        return JobCheckpoints(self.store, analysis_id, await self.store.get_checkpoints(analysis_id))
+
+    async def resume(self, analysis_id: str) -> Optional[TriageJob]:
+        """Queue a failed job again; it restarts from its first incomplete stage. None if it is not failed"""
+        job = await self.store.get(analysis_id)
+        if job is None:
+            return None
+        job = await self.store.requeue_failed(analysis_id, PRIORITY_RANKS[job.priority])
+        if job is None:
+            return None
+        self._counts["queued"] += 1
+        self._wakeup.set()
+        logger.info(f"Job {analysis_id} queued again for resume (attempts so far: {job.attempts})")
+        return job
+
+    async def get_queue_position(self, analysis_id: str) -> Optional[int]:
+        """Get 1-based position of a queued job, or None if it is not waiting"""
+        return await self.store.queue_position(analysis_id)
+
+    @property
+    def depth(self) -> int:
+        """Number of jobs waiting in the queue (as of the last store poll)"""
+        return self._counts["queued"]
+
+    def stats(self) -> dict:
+        """Queue depth across instances and jobs running here"""
+        return {
+            "queued": self._counts["queued"],
+            "running": self._counts["running"],
+            "running_local": len(self._running),
+            "workers": self.worker_count,
+            "max_size": self.max_size,
+            "store": self.store.backend,
+            "instance_id": self.instance_id,
+        }
+
+    def _on_stage(self, analysis_id: str, stage: str):
+        """Stage listener: remember the stage of a local job, persisted on the next lease renewal"""
+        job = self._running.get(analysis_id)
+        if job is not None and stage != "job":
+            job.stage = stage
+
+    async def _maintain(self):
+        """Requeue jobs with expired leases, drop old history and refresh the queue counts"""
+        for job in await self.store.requeue_expired(self.max_attempts):
+            if job.status == "queued":
+                logger.warning(f"Lease of job {job.analysis_id} expired (attempt {job.attempts}), queued again")
+            else:
+                jobs_total.inc(status=job.status)
+                logger.error(f"Job {job.analysis_id} failed: {job.error}")
+        await self.store.prune(self.history_size)
+        self._counts = await self.store.counts()
+        if self._counts["queued"] and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _maintenance_loop(self):
+        while True:
+            await asyncio.sleep(max(self.poll_interval, self.lease_seconds / 4))
+            try:
+                await self._maintain()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Job store maintenance failed: {e}")
+
+    async def _next_job(self, owner: str) -> TriageJob:
+        """Claim the next job, waiting for local submits or polling the store for other instances'"""
+        while True:
+            try:
+                job = await self.store.claim(owner, self.lease_seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"[{owner}] Failed to claim a job: {e}")
+                job = None
+            if job is not None:
+                # 在下一次 maintenance 重新讀取前，先調整本地的計數
+                self._counts["queued"] = max(0, self._counts["queued"] - 1)
+                self._counts["running"] += 1
+                return job
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                self._wakeup.clear()
+            except asyncio.TimeoutError:
+                pass
+
+    async def _keep_lease(self, job: TriageJob, owner: str):
+        """Renew the lease while the job runs, persisting its stage and picking up remote duplicates"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                stored = await self.store.renew(job, owner, self.lease_seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Failed to renew lease of job {job.analysis_id}: {e}")
+                continue
+            if stored is None:
+                logger.warning(f"Lost the lease of job {job.analysis_id}, another instance may run it again")
+                return
+            merge_slack_payloads(job.additional_slack_payloads, stored.additional_slack_payloads)
+
+    async def _worker(self, worker_id: int):
+        """Claim jobs from the store and run them one at a time"""
+        owner = f"{self.instance_id}/{worker_id}"
+        while True:
+            job = await self._next_job(owner)
+            analysis_id = job.analysis_id
+            self._running[analysis_id] = job
+            # 讓這個 job 內的所有 log 都帶有 analysis_id
+            context_token = current_analysis_id.set(analysis_id)
+            lease_task = asyncio.create_task(self._keep_lease(job, owner))
+            try:
+                if job.attempts == 1:
+                    job_queue_wait.observe((job.started_at - job.created_at).total_seconds())
+                logger.info(f"[worker-{worker_id}] Job {analysis_id} started (attempt {job.attempts})")
+                with stage_timer("job", priority=job.priority):
+                    job.result = await self.handler(job)
+                job.status = "completed"
+                logger.info(f"[worker-{worker_id}] Job {analysis_id} completed")
+            except asyncio.CancelledError:
+                # 服務關閉：把 job 放回佇列，由下一個 instance 接手
+                if await self.store.release(job, owner):
+                    logger.info(f"[worker-{worker_id}] Job {analysis_id} released back to the queue")
+                raise
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                logger.error(f"[worker-{worker_id}] Job {analysis_id} failed: {e}")
+            finally:
+                lease_task.cancel()
+                current_analysis_id.reset(context_token)
+                self._running.pop(analysis_id, None)
+                if job.status != "running":
+                    self._counts["running"] = max(0, self._counts["running"] - 1)
+                    jobs_total.inc(status=job.status)
+                    job.finished_at = datetime.now()
+                    if not await self.store.finish(job, owner):
+                        logger.warning(f"[worker-{worker_id}] Job {analysis_id} finished after its lease was lost")
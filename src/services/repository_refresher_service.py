@@ -0,0 +1,140 @@
+"""
+Repository Refresher Service
+Keeps the repository mirror and the latest deployed commit fresh in the background
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Optional, Tuple
+
+from src.core.config import Config
+from src.core.exceptions import GitOperationError
+from src.utils.git_utils import GitUtils
+from src.utils.tag_index_utils import ProdTagIndex
+
+logger = logging.getLogger(__name__)
+
+
+class RepositoryRefresherService:
+    """Periodically fetches the mirror and caches the resolved deployed commit in memory"""
+
+    def __init__(
+        self,
+        git_utils: GitUtils,
+        tag_index: ProdTagIndex,
+        on_commit_change: Optional[Callable[[str, str], Awaitable[None]]] = None
+    ):
+        self.config = Config()
+        self.git_utils = git_utils
+        self.tag_index = tag_index
+        # on_commit_change(previous_commit, new_commit) runs when a new deploy is detected
+        self.on_commit_change = on_commit_change
+        self.interval_seconds = max(10, self.config.GIT_REFRESH_INTERVAL_SECONDS)
+        self.latest_commit: Optional[str] = None
+        self.latest_tag: Optional[str] = None
+        self.last_refreshed_at: Optional[datetime] = None
+        self.last_refresh_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start the periodic refresh loop"""
+        if self._task:
+            return
+        self._task = asyncio.create_task(self._refresh_loop(), name="repository-refresher")
+        logger.info(f"Repository refresher started (interval: {self.interval_seconds}s)")
+
+    async def stop(self):
+        """Stop the periodic refresh loop"""
+        if not self._task:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        logger.info("Repository refresher stopped")
+
+    async def get_commit(self, at: Optional[datetime] = None) -> str:
+        """
+        Get the commit to analyze from memory: the prod release live at `at`, or the latest one.
+        Only waits on the network when no refresh has succeeded yet (e.g. right after startup).
+        """
+        if at:
+            live_tag = self.tag_index.live_at(at)
+            if live_tag:
+                logger.info(f"Using {live_tag['tag']} ({live_tag['commit']}) live at {at.isoformat()}")
+                return live_tag["commit"]
+            logger.warning(f"No prod tag live at {at.isoformat()}, using latest deployed commit")
+        if self.latest_commit:
+            return self.latest_commit
+        commit_hash = await self.refresh()
+        if not commit_hash:
+            raise GitOperationError(f"Repository is not ready: {self.last_error}")
+        return commit_hash
+
+    async def refresh(self) -> Optional[str]:
+        """Fetch the mirror and re-resolve the deployed commit; keeps the previous commit on failure"""
+        async with self._lock:
+            start = time.time()
+            try:
+                commit_hash, tag = await self._refresh_repository()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Repository refresh failed, keeping commit {self.latest_commit}: {e}")
+                return self.latest_commit
+
+            self.last_refresh_duration = time.time() - start
+            self.last_refreshed_at = datetime.now()
+            self.last_error = None
+            previous_commit = self.latest_commit
+            self.latest_commit = commit_hash
+            self.latest_tag = tag
+            if commit_hash != previous_commit:
+                logger.info(f"Deployed commit changed: {previous_commit} -> {commit_hash}")
+                if previous_commit and self.on_commit_change:
+                    try:
+                        await self.on_commit_change(previous_commit, commit_hash)
+                    except Exception as e:
+                        logger.warning(f"Commit change hook failed: {e}")
+            return commit_hash
+
+    async def _refresh_repository(self) -> Tuple[str, Optional[str]]:
+        """Fetch the mirror, sync the tag index and resolve the latest deployed commit"""
+        updated = await self.git_utils.clone_or_update_repository(
+            self.config.GITHUB_TOKEN,
+            self.config.GITHUB_PROJECT,
+            clone_filter=self.config.GIT_CLONE_FILTER or None,
+            depth=self.config.GIT_FETCH_DEPTH
+        )
+        if not updated:
+            raise GitOperationError("Failed to clone/update repository mirror")
+        await self.tag_index.update()
+        latest_tag = self.tag_index.latest()
+        if latest_tag:
+            return latest_tag["commit"], latest_tag["tag"]
+
+        logger.warning("No prod- tags found, using master HEAD (may include undeployed commits)")
+        commit_hash = await self.git_utils.get_branch_head_commit("master")
+        if not commit_hash:
+            raise GitOperationError("Failed to resolve commit to analyze")
+        return commit_hash, None
+
+    async def _refresh_loop(self):
+        """Refresh immediately, then every interval_seconds"""
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval_seconds)
+
+    def status(self) -> dict:
+        """Refresher state for health/diagnostics"""
+        return {
+            "latest_commit": self.latest_commit,
+            "latest_tag": self.latest_tag,
+            "indexed_tags": len(self.tag_index.tags),
+            "last_refreshed_at": self.last_refreshed_at.isoformat() if self.last_refreshed_at else None,
+            "last_refresh_duration": self.last_refresh_duration,
+            "last_error": self.last_error,
+            "interval_seconds": self.interval_seconds,
+        }
@@ -0,0 +1,132 @@
+"""
+Slack Progress Service
+Shows what the analysis is doing in a single Slack message while Claude runs
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Optional
+
+from src.core.config import Config
+from src.core.exceptions import SlackNotificationError
+from src.utils.slack_message_utils import render_progress_done_message, render_progress_message
+
+logger = logging.getLogger(__name__)
+
+
+class SlackProgressPublisher:
+    """
+    Coalesce tool-use events from the Claude stream into one progress message.
+    add_step() is called synchronously from the stream callback and only records the step;
+    a background task edits the message at most once per interval, so a burst of
+    Grep/Read calls costs a single chat.update.
+    """
+
+    # 連續更新失敗幾次後停止更新（例如訊息被刪除、權限不足）
+    MAX_CONSECUTIVE_FAILURES = 3
+    # 沒有新步驟時，每隔幾個 interval 仍更新一次經過時間，讓卡住的分析看得出來
+    HEARTBEAT_INTERVALS = 6
+
+    def __init__(
+        self,
+        slack_service,
+        channel_id: str,
+        thread_ts: Optional[str] = None,
+        interval_seconds: Optional[float] = None,
+        max_steps: Optional[int] = None
+    ):
+        config = Config()
+        self.slack_service = slack_service
+        self.channel_id = channel_id
+        self.thread_ts = thread_ts
+        self.interval_seconds = interval_seconds if interval_seconds is not None else config.SLACK_PROGRESS_INTERVAL_SECONDS
+        self.steps = deque(maxlen=max_steps or config.SLACK_PROGRESS_MAX_STEPS)
+        self.stage = "準備程式碼中"
+        self.tool_use_count = 0
+        self.message_ts: Optional[str] = None
+        self.started_at = time.monotonic()
+        self.last_step_at = self.started_at
+        self._last_flush_at = 0.0
+        self._dirty = False
+        self._failures = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def create(cls, slack_service, slack_payload) -> Optional["SlackProgressPublisher"]:
+        """Publisher for the payload's thread, or None when progress updates do not apply"""
+        config = Config()
+        if not config.SLACK_PROGRESS_ENABLED or slack_service.delivery_mode != "api" or not slack_payload.channel_id:
+            return None
+        return cls(slack_service, slack_payload.channel_id, slack_payload.thread_id)
+
+    @property
+    def active(self) -> bool:
+        return self.message_ts is not None and self._failures < self.MAX_CONSECUTIVE_FAILURES
+
+    async def start(self):
+        """Post the initial progress message and start the throttled updater"""
+        message = render_progress_message(self.stage, [], 0, 0, 0)
+        try:
+            response = await self.slack_service.post_message(
+                self.channel_id, message["text"], message["blocks"], self.thread_ts
+            )
+            self.message_ts = response.get("ts")
+        except SlackNotificationError as e:
+            # 進度訊息只是輔助，失敗不影響分析
+            logger.warning(f"[progress] failed to post progress message: {e}")
+            return
+        self._last_flush_at = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+
+    def set_stage(self, stage: str):
+        self.stage = stage
+        self._dirty = True
+
+    def add_step(self, summary: str):
+        """Record a tool-use summary from the Claude stream (sync, called once per event)"""
+        self.tool_use_count += 1
+        self.steps.append(summary.replace("\n", " ").replace("`", "'"))
+        self.last_step_at = time.monotonic()
+        self._dirty = True
+
+    async def _run(self):
+        heartbeat = self.interval_seconds * self.HEARTBEAT_INTERVALS
+        while self.active:
+            await asyncio.sleep(self.interval_seconds)
+            if self._dirty or time.monotonic() - self._last_flush_at >= heartbeat:
+                await self._flush()
+
+    async def _flush(self):
+        self._dirty = False
+        self._last_flush_at = time.monotonic()
+        now = time.monotonic()
+        message = render_progress_message(
+            self.stage, list(self.steps), self.tool_use_count, now - self.started_at, now - self.last_step_at
+        )
+        await self._update(message)
+
+    async def _update(self, message: dict):
+        try:
+            await self.slack_service.update_message(self.channel_id, self.message_ts, message["text"], message["blocks"])
+            self._failures = 0
+        except SlackNotificationError as e:
+            self._failures += 1
+            logger.warning(f"[progress] chat.update failed ({self._failures}/{self.MAX_CONSECUTIVE_FAILURES}): {e}")
+
+    async def finish(self, success: bool, detail: str = ""):
+        """Stop the updater and leave the message in its final state"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if not self.active:
+            return
+        message = render_progress_done_message(
+            success, self.tool_use_count, time.monotonic() - self.started_at, detail
+        )
+        await self._update(message)
+        self.message_ts = None
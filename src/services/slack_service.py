@@ -3,14 +3,25 @@ Slack Service
 """
 import os
 import asyncio
-import subprocess
 import logging
 import tempfile
-from typing import Optional
+import time
+from typing import Dict, Optional
 from dotenv import load_dotenv
 
+import httpx
+
 from src.core.config import Config
-from src.utils.cmd_utils import run_with_live_output
+from src.core.exceptions import SlackNotificationError
+from src.utils.cmd_utils import claude_runner
+from src.utils.claude_pool_utils import run_claude
+from src.utils.retry_utils import classify_claude_failure, claude_retry_policy
+from src.utils.slack_message_utils import (
+    parse_analysis_json,
+    parse_user_mapping,
+    render_analysis_message,
+    render_raw_message,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -18,26 +29,66 @@ logger = logging.getLogger(__name__)
 class SlackService:
     """Service for handling Slack operations"""
     
+    # Slack 限制每則訊息最多 50 個 blocks
+    MAX_BLOCKS = 50
+    USER_CACHE_TTL_SECONDS = 3600
+
     def __init__(self):
         self.config = Config()
-        self.check_mcp_server_status()
+        self.delivery_mode = self.config.SLACK_DELIVERY_MODE
+        self.api_base_url = self.config.SLACK_API_BASE_URL.rstrip('/')
+        self.user_mapping = parse_user_mapping(self.config.GITHUB_SLACK_USER_MAPPING)
+        self._client: Optional[httpx.AsyncClient] = None
+        # slack username / display name (lowercase) -> user id
+        self._slack_user_ids: Dict[str, str] = {}
+        self._slack_users_loaded_at = 0.0
+        self._mcp_check_task: Optional[asyncio.Task] = None
 
-    
-    def check_mcp_server_status(self):
+    def start_mcp_status_check(self):
+        """Probe the Slack MCP server in the background so startup does not wait for a claude process"""
+        if self._mcp_check_task is None:
+            self._mcp_check_task = asyncio.create_task(self.check_mcp_server_status())
+
+    async def check_mcp_server_status(self):
         """Setup Slack MCP server"""
         cmd = [
             'claude', 'mcp', 'get', 'slack'
         ]
-        result = run_with_live_output(cmd)
-        output = result[0] if isinstance(result, (list, tuple)) and len(result) > 0 else ""
-        if "Status: ✓ Connected" in output:
+        try:
+            result = await claude_runner.run(cmd, timeout=60)
+        except Exception as e:
+            logger.error(f"❌ 無法檢查 MCP Slack server 狀態: {e}")
+            return
+        if "Status: ✓ Connected" in result.stdout:
             logger.info("✅ MCP Slack server 已連線")
         else:
-            logger.error(f"❌ MCP Slack server 尚未連線，請檢查設定 ${result}")
+            logger.error(f"❌ MCP Slack server 尚未連線，請檢查設定 {result.stdout}{result.stderr}")
 
     
     async def send_analysis_result(self, analysis_id: str, analysis_result: str, slack_channel_id: str, slack_thread_id: Optional[str] = None):
         """Send analysis result to Slack"""
+        if self.delivery_mode == "mcp":
+            await self.send_analysis_result_via_mcp(analysis_id, analysis_result, slack_channel_id, slack_thread_id)
+            return
+
+        analysis = parse_analysis_json(analysis_result)
+        if analysis:
+            await self.refresh_slack_users()
+            message = render_analysis_message(
+                analysis,
+                self.resolve_mention,
+                f"https://github.com/{self.config.GITHUB_PROJECT}",
+                self.config.FEEDBACK_URL
+            )
+        else:
+            logger.warning(f"[{analysis_id}] analysis result is not valid JSON, posting raw text")
+            message = render_raw_message(analysis_result)
+
+        await self.post_message(slack_channel_id, message["text"], message["blocks"], slack_thread_id)
+        logger.info(f"[{analysis_id}] analysis result posted to {slack_channel_id} (thread: {slack_thread_id})")
+
+    async def send_analysis_result_via_mcp(self, analysis_id: str, analysis_result: str, slack_channel_id: str, slack_thread_id: Optional[str] = None):
+        """Send analysis result to Slack through a Claude session with the Slack MCP server"""
         try:
             slack_channel_id = slack_channel_id
             prompt_file = f"src/prompt/slack_mcp_prompt.md"
@@ -54,20 +105,24 @@ class SlackService:
             logger.info(f"======prompt start(Claude Code)=================")
             logger.info(f"{prompt}")
             logger.info(f"======prompt end(Claude Code)==================")
-            # Avoid :[Errno 7] Argument list too long: 'claude'
-            # os.makedirs("log", exist_ok=True)
-            # prompt_file = f"log/slack_prompt_{analysis_id}.txt"
-            # with open(prompt_file, 'w', encoding='utf-8') as f:
-            #     f.write(prompt)
-            # logger.info(f"save prompt to temp file: {prompt_file}")    
-
-            cmd = ['claude', '-p', prompt]
-            # Run analysis asynchronously
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True
-            )
+            # prompt 從 stdin 傳入，避免 [Errno 7] Argument list too long: 'claude'
+            trial_id = claude_retry_policy.check()
+            try:
+                # Run analysis asynchronously
+                # 一律透過 CLI 執行（需要 Slack MCP），與 ANALYSIS_ENGINE 無關
+                result = await run_claude(['-p'], prompt, timeout=self.config.CLAUDE_TIMEOUT_SECONDS)
+            except Exception as e:
+                claude_retry_policy.record_failure(classify_claude_failure(exception=e))
+                raise
+            finally:
+                # 逾時、被取消等沒有記錄結果的情況要釋放 half-open 的試探名額
+                claude_retry_policy.release(trial_id)
+            if result.returncode == 0:
+                claude_retry_policy.record_success()
+            else:
+                claude_retry_policy.record_failure(
+                    classify_claude_failure(result.returncode, output=f"{result.stdout}\n{result.stderr}")
+                )
             # 儲存 stdout 和 stderr 訊息
             stdout = result.stdout if result.stdout else ""
             stderr = result.stderr if result.stderr else ""
@@ -76,4 +131,112 @@ class SlackService:
             logger.info(f"--- STDERR ---")
             logger.error(f"{stderr}")
         except Exception as e:
-            logger.error(f"Slack notification failed: {e}")
\ No newline at end of file
+            logger.error(f"Slack notification failed: {e}")
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Shared HTTP client so connections to Slack are pooled across messages"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.api_base_url,
+                headers={"Authorization": f"Bearer {self.config.SLACK_BOT_TOKEN}"},
+                timeout=httpx.Timeout(self.config.SLACK_TIMEOUT_SECONDS),
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+            )
+        return self._client
+
+    async def close(self):
+        """Close pooled HTTP connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def call_api(self, method: str, payload: Optional[dict] = None, http_method: str = "POST") -> dict:
+        """
+        Call a Slack Web API method, retrying on rate limits (honouring Retry-After),
+        5xx responses and network errors
+        """
+        client = self._get_client()
+        max_retries = self.config.SLACK_MAX_RETRIES
+        for attempt in range(max_retries + 1):
+            try:
+                if http_method == "GET":
+                    response = await client.get(f"/{method}", params=payload)
+                else:
+                    response = await client.post(f"/{method}", json=payload)
+            except httpx.HTTPError as e:
+                if attempt >= max_retries:
+                    raise SlackNotificationError(f"Slack {method} request failed: {e}")
+                delay = 2 ** attempt
+                logger.warning(f"Slack {method} request error ({e}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+                continue
+
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt >= max_retries:
+                    raise SlackNotificationError(f"Slack {method} failed with HTTP {response.status_code}")
+                delay = float(response.headers.get("Retry-After", 2 ** attempt))
+                logger.warning(f"Slack {method} returned HTTP {response.status_code}, retrying in {delay}s")
+                await asyncio.sleep(delay)
+                continue
+
+            data = response.json()
+            if not data.get("ok"):
+                raise SlackNotificationError(f"Slack {method} error: {data.get('error')}")
+            return data
+
+        raise SlackNotificationError(f"Slack {method} failed after {max_retries + 1} attempts")
+
+    async def post_message(self, channel_id: str, text: str, blocks: Optional[list] = None, thread_ts: Optional[str] = None) -> dict:
+        """Post a message (optionally into a thread) with chat.postMessage"""
+        payload = {"channel": channel_id, "text": text[:39000], "unfurl_links": False}
+        if blocks:
+            payload["blocks"] = blocks[:self.MAX_BLOCKS]
+        if thread_ts:
+            payload["thread_ts"] = thread_ts
+        return await self.call_api("chat.postMessage", payload)
+
+    async def update_message(self, channel_id: str, ts: str, text: str, blocks: Optional[list] = None) -> dict:
+        """Edit a message previously posted by the bot with chat.update"""
+        payload = {"channel": channel_id, "ts": ts, "text": text[:39000]}
+        if blocks:
+            payload["blocks"] = blocks[:self.MAX_BLOCKS]
+        return await self.call_api("chat.update", payload)
+
+    async def refresh_slack_users(self):
+        """Load workspace users (name -> id) for mentions, at most once per USER_CACHE_TTL_SECONDS"""
+        if not self.user_mapping:
+            return
+        if self._slack_user_ids and time.time() - self._slack_users_loaded_at < self.USER_CACHE_TTL_SECONDS:
+            return
+        try:
+            user_ids = {}
+            cursor = None
+            while True:
+                params = {"limit": 200}
+                if cursor:
+                    params["cursor"] = cursor
+                data = await self.call_api("users.list", params, http_method="GET")
+                for member in data.get("members", []):
+                    if member.get("deleted"):
+                        continue
+                    profile = member.get("profile") or {}
+                    for name in (member.get("name"), profile.get("display_name"), profile.get("real_name")):
+                        if name:
+                            user_ids.setdefault(name.strip().lower(), member["id"])
+                cursor = (data.get("response_metadata") or {}).get("next_cursor")
+                if not cursor:
+                    break
+            self._slack_user_ids = user_ids
+            self._slack_users_loaded_at = time.time()
+            logger.info(f"Loaded {len(user_ids)} Slack user names for mentions")
+        except SlackNotificationError as e:
+            # 無法取得成員列表時仍以 @username 純文字標註
+            logger.warning(f"Failed to load Slack users, mentions fall back to plain names: {e}")
+
+    def resolve_mention(self, github_username: str) -> Optional[str]:
+        """Map a GitHub username to a Slack mention via GITHUB_SLACK_USER_MAPPING; None when unmapped"""
+        slack_name = self.user_mapping.get(github_username.strip().lstrip('@').lower())
+        if not slack_name:
+            return None
+        user_id = self._slack_user_ids.get(slack_name.lstrip('@').lower())
+        return f"<@{user_id}>" if user_id else f"@{slack_name.lstrip('@')}"
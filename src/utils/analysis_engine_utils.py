@@ -0,0 +1,332 @@
+"""
+Analysis Engine Utilities
+Backends that run the Claude prompts of a triage: the `claude` CLI (with tools and MCP), the Messages API
+over a pooled HTTP client with prompt caching, and a deterministic local fake for offline load tests.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+from src.core.exceptions import ConfigurationError
+from src.utils.claude_pool_utils import claude_session_pool, run_claude
+from src.utils.cmd_utils import claude_runner
+from src.utils.prompt_utils import estimate_tokens
+from src.utils.stream_json_utils import StreamJsonParser, parse_json_output
+
+logger = logging.getLogger(__name__)
+
+# 呼叫類型（也是 metrics 的 call label）
+ISSUE_SUMMARY = "issue_summary"
+ANALYSIS = "analysis"
+FORMAT_RESULT = "format_result"
+
+# 問題摘要與格式化：json 輸出帶有 token / 成本
+JSON_OUTPUT_ARGS = ['-p', '--output-format', 'json']
+
+# 每種呼叫對應的指示檔，API engine 會把它放在可快取的 system prompt 前綴
+PROMPT_FILES = {
+    ISSUE_SUMMARY: "src/prompt/issue_summary_generator_prompt.md",
+    ANALYSIS: "src/prompt/analysis_prompt.md",
+    FORMAT_RESULT: "src/prompt/analysis_prompt.md",
+}
+
+ANTHROPIC_VERSION = "2023-06-01"
+
+
+def analysis_args(codebase_dir: Optional[str]) -> list:
+    """claude arguments of the analysis session for a codebase directory"""
+    add_dir = ['--add-dir', codebase_dir] if codebase_dir else []
+    return [*add_dir, '-p', '--verbose', '--output-format', 'stream-json']
+
+
+class EngineResult:
+    """Outcome of one engine call, shaped like the result of a `claude` CLI run"""
+
+    def __init__(
+        self,
+        text: Optional[str],
+        result_event: Optional[dict] = None,
+        returncode: int = 0,
+        output: str = "",
+        tool_use_count: int = 0
+    ):
+        # text: 最終回覆（沒有收到 result 時為 None）；output: stderr 或輸出結尾，用於判斷失敗原因
+        self.text = text
+        self.result_event = result_event
+        self.returncode = returncode
+        self.output = output
+        self.tool_use_count = tool_use_count
+
+    @property
+    def is_error(self) -> bool:
+        return bool(self.result_event and self.result_event.get("is_error"))
+
+
+class AnalysisEngine:
+    """
+    Runs one Claude prompt (issue summary, analysis or format pass).
+    Upstream errors come back as an error result event; transport failures are raised.
+    """
+
+    name = "base"
+    # 是否能使用 Slack MCP 等 tool；問題摘要需要讀取 Slack thread
+    supports_mcp = False
+
+    async def run(
+        self,
+        call: str,
+        prompt: str,
+        timeout: float,
+        codebase_dir: Optional[str] = None,
+        on_line: Optional[Callable[[str], None]] = None,
+        on_tool_use: Optional[Callable[[str], None]] = None
+    ) -> EngineResult:
+        """on_line receives log lines while the call runs, on_tool_use a summary of every tool call"""
+        raise NotImplementedError
+
+    def prewarm(self, codebase_dir: Optional[str] = None):
+        """Get ready for the next call ahead of time (no-op by default)"""
+
+    def stats(self) -> dict:
+        return {"engine": self.name}
+
+    async def close(self):
+        pass
+
+
+class CliAnalysisEngine(AnalysisEngine):
+    """The `claude` CLI: Claude reads the codebase, runs git and uses MCP servers itself"""
+
+    name = "cli"
+    supports_mcp = True
+
+    async def run(self, call, prompt, timeout, codebase_dir=None, on_line=None, on_tool_use=None) -> EngineResult:
+        if call != ANALYSIS:
+            result = await run_claude(JSON_OUTPUT_ARGS, prompt, timeout=timeout)
+            stdout, result_event = parse_json_output(result.stdout)
+            return EngineResult(stdout, result_event, result.returncode, result.stderr or "")
+
+        # 逐行解析 stream-json 事件並即時顯示，不保留完整輸出
+        parser = StreamJsonParser(on_tool_use=on_tool_use)
+
+        def feed_line(line: str):
+            for output in parser.feed(line):
+                if on_line:
+                    on_line(output)
+
+        result = await run_claude(
+            analysis_args(codebase_dir),
+            prompt,                    # prompt 從 stdin 傳入，不受 argv 長度限制
+            timeout=timeout,
+            merge_stderr=True,         # 合併輸出，避免雙管道阻塞
+            on_line=feed_line,
+            capture_stdout=False
+        )
+        return EngineResult(parser.result, parser.result_event, result.returncode, parser.tail(), parser.tool_use_count)
+
+    def prewarm(self, codebase_dir: Optional[str] = None):
+        # 沒有指定 codebase 時預熱問題摘要 / 格式化的 session
+        claude_session_pool.prewarm(analysis_args(codebase_dir) if codebase_dir else JSON_OUTPUT_ARGS)
+
+    def stats(self) -> dict:
+        return {"engine": self.name, "pool": claude_session_pool.stats()}
+
+
+class ApiAnalysisEngine(AnalysisEngine):
+    """
+    Direct Messages API calls: no CLI boot and no tool turns, so it is faster and cheaper, but Claude only
+    sees the prompt (error, code snippets from the code index) and cannot read files, run git or use MCP.
+    The static instruction file goes first in the system prompt with cache_control so repeated calls
+    read it from the prompt cache.
+    """
+
+    name = "api"
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        base_url: str = "https://api.anthropic.com",
+        max_tokens: int = 4096,
+        max_connections: int = 4,
+        prompt_cache: bool = True
+    ):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url.rstrip('/')
+        self.max_tokens = max_tokens
+        self.max_connections = max(1, max_connections)
+        self.prompt_cache = prompt_cache
+        self._client: Optional[httpx.AsyncClient] = None
+        self._system_prompts: Dict[str, List[dict]] = {}
+        self.requests = 0
+        self.cache_read_tokens = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Shared HTTP client so connections to the API are pooled across calls"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"x-api-key": self.api_key, "anthropic-version": ANTHROPIC_VERSION},
+                limits=httpx.Limits(
+                    max_connections=self.max_connections, max_keepalive_connections=self.max_connections
+                ),
+            )
+        return self._client
+
+    def system_prompt(self, call: str) -> List[dict]:
+        """System blocks for a call: tool-less notice plus the instruction file, cached as one prefix"""
+        if call not in self._system_prompts:
+            prompt_file = PROMPT_FILES[call]
+            text = (
+                "你無法讀取檔案、執行指令或使用任何工具，請只根據使用者提供的錯誤訊息與程式碼片段回答；"
+                "需要查詢才能得知的欄位請回傳 None。\n\n"
+                f"以下是 {prompt_file} 的內容：\n\n{Path(prompt_file).read_text(encoding='utf-8')}"
+            )
+            block = {"type": "text", "text": text}
+            if self.prompt_cache:
+                block["cache_control"] = {"type": "ephemeral"}
+            self._system_prompts[call] = [block]
+        return self._system_prompts[call]
+
+    async def run(self, call, prompt, timeout, codebase_dir=None, on_line=None, on_tool_use=None) -> EngineResult:
+        body = {
+            "model": self.model,
+            "max_tokens": self.max_tokens,
+            "system": self.system_prompt(call),
+            "messages": [{"role": "user", "content": prompt}],
+        }
+        async with claude_runner.slot():
+            start = time.monotonic()
+            response = await self._get_client().post("/v1/messages", json=body, timeout=timeout)
+            duration_ms = int((time.monotonic() - start) * 1000)
+        self.requests += 1
+
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+        if response.status_code != 200:
+            error = data.get("error") or {}
+            # 與 CLI 的錯誤訊息一致，讓 classify_claude_failure 判斷 rate limit / overloaded / 認證錯誤
+            message = (
+                f"API Error: {response.status_code} {error.get('type', '')}: "
+                f"{error.get('message') or response.text[:500]}"
+            )
+            result_event = {"type": "result", "subtype": "error", "is_error": True, "result": message}
+            return EngineResult(None, result_event, 1, message)
+
+        text = "".join(block.get("text", "") for block in data.get("content") or [] if block.get("type") == "text")
+        usage = data.get("usage") or {}
+        self.cache_read_tokens += usage.get("cache_read_input_tokens") or 0
+        if on_line:
+            on_line(
+                f"[{self.name}] {call}: stop_reason={data.get('stop_reason')}, "
+                f"cache read/write tokens: {usage.get('cache_read_input_tokens') or 0}/"
+                f"{usage.get('cache_creation_input_tokens') or 0}"
+            )
+        result_event = {
+            "type": "result",
+            "subtype": "success",
+            "is_error": False,
+            "result": text,
+            "num_turns": 1,
+            "duration_api_ms": duration_ms,
+            "usage": usage,
+        }
+        return EngineResult(text, result_event)
+
+    def stats(self) -> dict:
+        return {
+            "engine": self.name,
+            "model": self.model,
+            "requests": self.requests,
+            "cache_read_tokens": self.cache_read_tokens,
+        }
+
+    async def close(self):
+        """Close pooled HTTP connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class FakeAnalysisEngine(AnalysisEngine):
+    """
+    Deterministic offline engine for load tests: a fixed latency, fake tool calls and an answer derived
+    from the prompt hash. Holds a Claude concurrency slot like a real call so throughput stays comparable.
+    """
+
+    name = "fake"
+    # 離線壓測時代替 CLI engine，包含問題摘要
+    supports_mcp = True
+
+    def __init__(self, latency_seconds: float = 0.5, tool_calls: int = 3):
+        self.latency_seconds = max(0.0, latency_seconds)
+        self.tool_calls = max(0, tool_calls)
+        self.calls = 0
+
+    async def run(self, call, prompt, timeout, codebase_dir=None, on_line=None, on_tool_use=None) -> EngineResult:
+        digest = hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:8]
+        steps = self.tool_calls if call == ANALYSIS else 0
+        async with claude_runner.slot():
+            for index in range(steps):
+                await asyncio.sleep(self.latency_seconds / (steps + 1))
+                if on_tool_use:
+                    on_tool_use(f"Grep(fake_symbol_{index} in src)")
+            await asyncio.sleep(self.latency_seconds / (steps + 1))
+        self.calls += 1
+
+        if call == ISSUE_SUMMARY:
+            text = f"問題摘要：fake issue_summary {digest}\nproblem_description: {prompt.strip()[:200]}"
+        else:
+            text = json.dumps({
+                "root_cause_analysis": f"fake analysis {digest}",
+                "root_cause_file_codebase": "None",
+                "database_status": "None",
+                "suspect_commit": "None",
+                "suspect_commit_author": "None",
+                "recommended_person": "None",
+                "recommended_reason": "None",
+                "suggestion": "None",
+            }, ensure_ascii=False)
+        result_event = {
+            "type": "result",
+            "subtype": "success",
+            "is_error": False,
+            "result": text,
+            "num_turns": steps + 1,
+            "duration_api_ms": int(self.latency_seconds * 1000),
+            "usage": {"input_tokens": estimate_tokens(prompt), "output_tokens": estimate_tokens(text)},
+        }
+        return EngineResult(text, result_event, tool_use_count=steps)
+
+    def stats(self) -> dict:
+        return {"engine": self.name, "calls": self.calls, "latency_seconds": self.latency_seconds}
+
+
+def create_analysis_engine(config) -> AnalysisEngine:
+    """Build the analysis engine selected by ANALYSIS_ENGINE"""
+    engine = config.ANALYSIS_ENGINE
+    if engine == "cli":
+        return CliAnalysisEngine()
+    if engine == "api":
+        if not config.ANTHROPIC_API_KEY:
+            raise ConfigurationError("ANTHROPIC_API_KEY is required when ANALYSIS_ENGINE=api")
+        return ApiAnalysisEngine(
+            config.ANTHROPIC_API_KEY,
+            config.ANTHROPIC_MODEL,
+            base_url=config.ANTHROPIC_BASE_URL,
+            max_tokens=config.ANTHROPIC_MAX_TOKENS,
+            max_connections=config.CLAUDE_MAX_CONCURRENCY,
+            prompt_cache=config.ANTHROPIC_PROMPT_CACHE,
+        )
+    if engine == "fake":
+        return FakeAnalysisEngine(config.FAKE_ENGINE_LATENCY_SECONDS, config.FAKE_ENGINE_TOOL_CALLS)
+    raise ConfigurationError(f"Unknown ANALYSIS_ENGINE: {engine}")
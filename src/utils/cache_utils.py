@@ -0,0 +1,114 @@
+"""
+Analysis Result Cache Utilities
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisCache:
+    """SQLite backed cache of analysis results keyed by error fingerprint + deployed commit"""
+
+    def __init__(self, db_path: str, ttl_seconds: int = 86400, max_entries: int = 500):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS analysis_cache (
+                cache_key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                commit_hash TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_lru ON analysis_cache (last_accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def build_key(fingerprint: str, commit_hash: str, custom_prompt: Optional[str] = None) -> str:
+        """Build cache key; custom prompts change the analysis so they are part of the key"""
+        raw = f"{fingerprint}|{commit_hash}|{custom_prompt or ''}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, fingerprint: str, commit_hash: str, custom_prompt: Optional[str] = None) -> Optional[str]:
+        """Get cached analysis result, or None on miss / expiry"""
+        key = self.build_key(fingerprint, commit_hash, custom_prompt)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, created_at FROM analysis_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row and now - row[1] <= self.ttl_seconds:
+                self._conn.execute("UPDATE analysis_cache SET last_accessed_at = ? WHERE cache_key = ?", (now, key))
+                self._conn.commit()
+                self.hits += 1
+                logger.info(f"[AnalysisCache] hit: fingerprint={fingerprint} commit={commit_hash}")
+                return row[0]
+
+            if row:
+                self._conn.execute("DELETE FROM analysis_cache WHERE cache_key = ?", (key,))
+                self._conn.commit()
+            self.misses += 1
+            logger.info(f"[AnalysisCache] miss: fingerprint={fingerprint} commit={commit_hash}")
+            return None
+
+    def set(self, fingerprint: str, commit_hash: str, result: str, custom_prompt: Optional[str] = None):
+        """Store analysis result and evict least recently used entries beyond max_entries"""
+        key = self.build_key(fingerprint, commit_hash, custom_prompt)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache "
+                "(cache_key, fingerprint, commit_hash, result, created_at, last_accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, fingerprint, commit_hash, result, now, now)
+            )
+            cursor = self._conn.execute(
+                "DELETE FROM analysis_cache WHERE cache_key IN ("
+                "SELECT cache_key FROM analysis_cache ORDER BY last_accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.evictions += cursor.rowcount
+            self._conn.commit()
+
+    def invalidate_except(self, commit_hash: str) -> int:
+        """Drop entries of older deployments once the refresher reports a new prod commit"""
+        # 只在 refresher 偵測到新的 prod tag 時呼叫；查詢舊版本的錯誤不應清掉目前版本的結果
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM analysis_cache WHERE commit_hash != ?", (commit_hash,))
+            self._conn.commit()
+            self.evictions += cursor.rowcount
+        logger.info(f"[AnalysisCache] new deployed commit {commit_hash}, invalidated {cursor.rowcount} entries")
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        """Cache hit/miss counters"""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+        }
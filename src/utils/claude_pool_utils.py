@@ -0,0 +1,390 @@
+"""
+Warm Claude Session Pool Utilities
+"""
+import asyncio
+import json
+import logging
+import subprocess
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from src.core.config import Config
+from src.utils.cmd_utils import AsyncProcessRunner, CommandResult, claude_runner
+
+logger = logging.getLogger(__name__)
+
+# (claude 參數, cwd)：相同參數的 session 才能互相替換
+SessionKey = Tuple[Tuple[str, ...], Optional[str]]
+
+
+def to_stream_args(args: List[str]) -> Tuple[List[str], str]:
+    """
+    Rewrite `claude` arguments for a long-lived stream-json session.
+    Returns the session arguments and the output format the caller asked for (text / json / stream-json).
+    """
+    session_args: List[str] = []
+    output_format = "text"
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        if arg in ("--output-format", "--input-format"):
+            if arg == "--output-format" and index + 1 < len(args):
+                output_format = args[index + 1]
+            index += 2
+            continue
+        if arg.startswith("--output-format="):
+            output_format = arg.split("=", 1)[1]
+        elif not arg.startswith("--input-format=") and arg != "--verbose":
+            session_args.append(arg)
+        index += 1
+    if "-p" not in session_args and "--print" not in session_args:
+        session_args.insert(0, "-p")
+    # stream-json 輸入必須搭配 stream-json 輸出（需要 --verbose）
+    return session_args + ["--verbose", "--input-format", "stream-json", "--output-format", "stream-json"], output_format
+
+
+class ClaudeSession:
+    """A `claude -p --input-format stream-json` process that has booted and waits for prompts on stdin"""
+
+    def __init__(self, key: SessionKey, process: asyncio.subprocess.Process):
+        self.key = key
+        self.process = process
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+        self.uses = 0
+        self.stderr_tail = deque(maxlen=50)
+        self._stderr_task = asyncio.create_task(self._drain_stderr())
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+    async def _drain_stderr(self):
+        # 持續讀取 stderr，避免 pipe 塞滿卡住 process
+        while True:
+            raw = await self.process.stderr.readline()
+            if not raw:
+                break
+            self.stderr_tail.append(raw.decode('utf-8', errors='replace').rstrip('\n'))
+
+    def kill(self):
+        if self.alive:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+
+    async def close(self, grace_seconds: float = 5):
+        """Close stdin so the CLI exits on its own, killing it after grace_seconds"""
+        if self.alive:
+            try:
+                if not self.process.stdin.is_closing():
+                    self.process.stdin.close()
+                await asyncio.wait_for(self.process.wait(), timeout=grace_seconds)
+            except (asyncio.TimeoutError, BrokenPipeError, ConnectionResetError):
+                self.kill()
+        await self.process.wait()
+        self._stderr_task.cancel()
+
+
+class ClaudeSessionPool:
+    """
+    Pool of pre-started Claude CLI sessions, keyed by their arguments.
+    Node 啟動與 MCP server 連線在 session 閒置等待時就完成，借用時只需寫入 prompt。
+    A borrowed session is replaced in the background, sessions are health checked (alive, age, idle time)
+    before being lent and retired after max_uses prompts. With max_uses > 1 the next prompt sees the
+    earlier turns of the same session, so the default of 1 keeps every call independent.
+    Only prompts hold a runner slot: idle sessions (and the ones being started in the background) are extra
+    processes on top of the runner's max_concurrency, at most size * max_keys plus their replacements.
+    """
+
+    def __init__(
+        self,
+        runner: AsyncProcessRunner,
+        enabled: bool,
+        size: int = 1,
+        max_uses: int = 1,
+        max_age_seconds: float = 900,
+        idle_seconds: float = 300,
+        max_keys: int = 4,
+        command: str = "claude"
+    ):
+        self.runner = runner
+        self.enabled = enabled
+        self.size = max(1, size)
+        self.max_uses = max(1, max_uses)
+        self.max_age_seconds = max_age_seconds
+        self.idle_seconds = idle_seconds
+        self.max_keys = max(1, max_keys)
+        self.command = command
+        self._idle: "OrderedDict[SessionKey, List[ClaudeSession]]" = OrderedDict()
+        self._spawning: Dict[SessionKey, int] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.warm_hits = 0
+        self.cold_starts = 0
+        self.retired: Dict[str, int] = {}
+
+    async def _spawn(self, key: SessionKey) -> ClaudeSession:
+        args, cwd = key
+        process = await asyncio.create_subprocess_exec(
+            self.command, *args,
+            cwd=cwd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=AsyncProcessRunner.STREAM_LIMIT,
+        )
+        return ClaudeSession(key, process)
+
+    def _background(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _retire(self, session: ClaudeSession, reason: str):
+        self.retired[reason] = self.retired.get(reason, 0) + 1
+        self._background(session.close())
+
+    def _health_problem(self, session: ClaudeSession) -> Optional[str]:
+        """Reason the session must not be lent, or None when it is healthy"""
+        now = time.monotonic()
+        if not session.alive:
+            return "exited"
+        if now - session.created_at > self.max_age_seconds:
+            return "max_age"
+        if now - session.last_used_at > self.idle_seconds:
+            return "idle"
+        return None
+
+    async def _borrow(self, key: SessionKey) -> Tuple[ClaudeSession, bool]:
+        """A healthy idle session for key (warm) or a newly started one (cold)"""
+        sessions = self._idle.get(key) or []
+        session = None
+        while sessions:
+            candidate = sessions.pop()
+            problem = self._health_problem(candidate)
+            if problem:
+                self._retire(candidate, problem)
+                continue
+            session = candidate
+            break
+        if key in self._idle:
+            self._idle.move_to_end(key)
+
+        warm = session is not None
+        if warm:
+            self.warm_hits += 1
+        else:
+            self.cold_starts += 1
+            session = await self._spawn(key)
+        return session, warm
+
+    def _refill(self, key: SessionKey):
+        """Start sessions in the background until key has `size` idle sessions"""
+        missing = self.size - len(self._idle.get(key) or []) - self._spawning.get(key, 0)
+        for _ in range(max(0, missing)):
+            self._spawning[key] = self._spawning.get(key, 0) + 1
+            self._background(self._refill_one(key))
+
+    async def _refill_one(self, key: SessionKey):
+        # 待命的 session 不佔用 runner 的 slot（不計入 CLAUDE_MAX_CONCURRENCY），只有處理 prompt 時才佔用
+        try:
+            session = await self._spawn(key)
+        except Exception as e:
+            logger.warning(f"[claude_pool] failed to start a warm session: {e}")
+            return
+        finally:
+            self._spawning[key] -= 1
+        self._idle.setdefault(key, []).append(session)
+        self._idle.move_to_end(key)
+        self._trim_keys()
+
+    def _trim_keys(self):
+        """Drop the least recently used argument sets (e.g. worktrees of old commits)"""
+        while len(self._idle) > self.max_keys:
+            _, sessions = self._idle.popitem(last=False)
+            for session in sessions:
+                self._retire(session, "evicted")
+
+    def prewarm(self, args: List[str], cwd: Optional[str] = None):
+        """Start idle sessions for these arguments ahead of the first call"""
+        if not self.enabled:
+            return
+        session_args, _ = to_stream_args(args)
+        self._refill((tuple(session_args), cwd))
+
+    async def _exchange(
+        self,
+        session: ClaudeSession,
+        prompt: str,
+        on_line: Optional[Callable[[str], None]],
+        capture_stream: bool,
+        close_stdin: bool
+    ) -> Tuple[Optional[dict], List[str]]:
+        """Send one prompt and read events until its result event (or until the process exits)"""
+        message = {"type": "user", "message": {"role": "user", "content": [{"type": "text", "text": prompt}]}}
+        session.process.stdin.write((json.dumps(message, ensure_ascii=False) + "\n").encode('utf-8'))
+        await session.process.stdin.drain()
+        if close_stdin:
+            session.process.stdin.close()
+
+        lines: List[str] = []
+        while True:
+            raw = await session.process.stdout.readline()
+            if not raw:
+                return None, lines
+            line = raw.decode('utf-8', errors='replace').rstrip('\n')
+            if on_line:
+                on_line(line)
+            if capture_stream:
+                lines.append(line)
+            if not line.startswith("{"):
+                continue
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(event, dict) and event.get("type") == "result":
+                return event, lines
+
+    async def run(
+        self,
+        args: List[str],
+        input_text: str,
+        cwd: Optional[str] = None,
+        timeout: Optional[float] = None,
+        on_line: Optional[Callable[[str], None]] = None,
+        capture_stdout: bool = True,
+        merge_stderr: bool = False
+    ) -> CommandResult:
+        """
+        Run one prompt on a pooled session, returning output in the format args asked for:
+        `--output-format json` gets the result event, stream-json the event lines, text the result text.
+        Raises subprocess.TimeoutExpired on timeout like AsyncProcessRunner.run.
+        """
+        session_args, output_format = to_stream_args(args)
+        key = (tuple(session_args), cwd)
+        cmd = [self.command, *session_args]
+        start = time.monotonic()
+        async with self.runner.slot():
+            session, warm = await self._borrow(key)
+            retire = session.uses + 1 >= self.max_uses
+            if retire:
+                # 這個 session 用完就結束：趁它處理 prompt 時啟動替補
+                self._refill(key)
+            try:
+                try:
+                    result_event, lines = await asyncio.wait_for(
+                        self._exchange(session, input_text, on_line, capture_stdout and output_format == "stream-json", retire),
+                        timeout=timeout
+                    )
+                except (BrokenPipeError, ConnectionResetError):
+                    if not warm:
+                        raise
+                    # 閒置的 session 在健康檢查後才結束：改用新的 process 重跑一次
+                    logger.warning("[claude_pool] warm session exited before the prompt was sent, starting a new one")
+                    self._retire(session, "exited")
+                    session = await self._spawn(key)
+                    result_event, lines = await asyncio.wait_for(
+                        self._exchange(session, input_text, on_line, capture_stdout and output_format == "stream-json", retire),
+                        timeout=timeout
+                    )
+            except asyncio.TimeoutError:
+                session.kill()
+                self._retire(session, "timeout")
+                if not retire:
+                    self._refill(key)
+                logger.error(f"[claude_pool] prompt timed out after {timeout}s")
+                raise subprocess.TimeoutExpired(cmd, timeout)
+            except BaseException:
+                session.kill()
+                self._retire(session, "error")
+                self._refill(key)
+                raise
+
+            session.uses += 1
+            session.last_used_at = time.monotonic()
+            if result_event is None:
+                # process 沒有送出 result 就結束（例如認證失敗），回傳它的 exit code
+                returncode = await session.process.wait()
+                if merge_stderr and on_line:
+                    for line in list(session.stderr_tail):
+                        on_line(line)
+                self._retire(session, "exited")
+                if not retire:
+                    self._refill(key)
+            else:
+                returncode = 1 if result_event.get("is_error") else 0
+                if retire:
+                    self._retire(session, "max_uses")
+                elif not session.alive:
+                    self._retire(session, "exited")
+                    self._refill(key)
+                else:
+                    self._idle.setdefault(key, []).append(session)
+
+        if output_format == "json":
+            stdout = json.dumps(result_event, ensure_ascii=False) if result_event else ""
+        elif output_format == "stream-json":
+            stdout = "\n".join(lines)
+        else:
+            stdout = str(result_event.get("result") or "") if result_event else ""
+        logger.info(f"[claude_pool] prompt finished in {time.monotonic() - start:.2f}s ({'warm' if warm else 'cold'} session)")
+        return CommandResult(cmd, returncode, stdout, "\n".join(session.stderr_tail), time.monotonic() - start)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "idle": sum(len(sessions) for sessions in self._idle.values()),
+            "starting": sum(self._spawning.values()),
+            "keys": len(self._idle),
+            "size": self.size,
+            "max_uses": self.max_uses,
+            "warm_hits": self.warm_hits,
+            "cold_starts": self.cold_starts,
+            "retired": dict(self.retired),
+        }
+
+    async def close(self):
+        """Stop every idle session"""
+        sessions = [session for pending in self._idle.values() for session in pending]
+        self._idle.clear()
+        await asyncio.gather(*(session.close() for session in sessions), return_exceptions=True)
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+claude_session_pool = ClaudeSessionPool(
+    claude_runner,
+    enabled=Config.CLAUDE_POOL_ENABLED,
+    size=Config.CLAUDE_POOL_SIZE,
+    max_uses=Config.CLAUDE_POOL_MAX_USES,
+    max_age_seconds=Config.CLAUDE_POOL_MAX_AGE_SECONDS,
+    idle_seconds=Config.CLAUDE_POOL_IDLE_SECONDS,
+    max_keys=Config.CLAUDE_POOL_MAX_KEYS,
+)
+
+
+async def run_claude(
+    args: List[str],
+    prompt: str,
+    timeout: Optional[float] = None,
+    on_line: Optional[Callable[[str], None]] = None,
+    capture_stdout: bool = True,
+    merge_stderr: bool = False
+) -> CommandResult:
+    """Run `claude <args>` with the prompt on stdin, on a warm pooled session when CLAUDE_POOL_ENABLED"""
+    if claude_session_pool.enabled:
+        return await claude_session_pool.run(
+            args, prompt, timeout=timeout, on_line=on_line, capture_stdout=capture_stdout, merge_stderr=merge_stderr
+        )
+    return await claude_runner.run(
+        ['claude', *args],
+        timeout=timeout,
+        input_text=prompt,
+        on_line=on_line,
+        capture_stdout=capture_stdout,
+        merge_stderr=merge_stderr
+    )
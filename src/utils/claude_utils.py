@@ -1,50 +1,47 @@
 """
 Claude Analysis Utilities
 """
-import re
-import subprocess
 import logging
-from typing import Optional
+from typing import Callable, Optional
 from pathlib import Path
+from src.core.config import Config
+from src.core.exceptions import CircuitOpenError
 from src.core.models import SlackPayload
+from src.utils.analysis_engine_utils import (
+    ANALYSIS,
+    FORMAT_RESULT,
+    ISSUE_SUMMARY,
+    AnalysisEngine,
+    CliAnalysisEngine,
+    create_analysis_engine,
+)
+from src.utils.json_repair_utils import repair_analysis_output
+from src.utils.metrics_utils import claude_calls_total, record_claude_usage, stage_timer
+from src.utils.prompt_utils import PromptBuilder, estimate_tokens
+from src.utils.retry_utils import INVALID_OUTPUT, classify_claude_failure, claude_retry_policy
 
 logger = logging.getLogger(__name__)
 
-jq_filter_for_analysis_result = '''
-if .type == "assistant" then
-  (.message.content[]? |
-    if .type == "text" then
-      .text
-    elif .type == "tool_use" then
-      if .name == "Grep" then
-        "Grep(\(.input.pattern) in \(.input.path // .input.file_path))"
-      elif .name == "Read" then
-        "Read(\(.input.path // .input.file_path))"
-      elif .name == "web_search" then
-        "Search(\(.input.query))"
-      elif .name == "Bash" then
-        "Bash(\(.input.command))"
-      elif .name == "TodoWrite" then
-        "TodoWrite: " + (.input.todos | map(.content) | join(" -> "))
-      else
-        "\(.name)(\(.input | tojson))"
-      end
-    else
-      empty
-    end
-  )
-elif .type == "result" then
-  "result:\(.result)"
-else
-  empty
-end
-'''
 
 class ClaudeUtils:
     """Utility class for Claude Code operations"""
     
-    def __init__(self, codebase_dir: str = None):
+    def __init__(self, codebase_dir: str = None, engine: Optional[AnalysisEngine] = None):
         self.codebase_dir = codebase_dir
+        self.timeout = Config.CLAUDE_TIMEOUT_SECONDS
+        # 實際執行 prompt 的 backend（ANALYSIS_ENGINE：cli / api / fake）
+        self.engine = engine or create_analysis_engine(Config)
+        # 問題摘要要透過 Slack MCP 讀取 thread，engine 沒有 MCP（api）時改用 CLI 執行
+        self.summary_engine = self.engine if self.engine.supports_mcp else CliAnalysisEngine()
+
+    def prewarm_sessions(self, codebase_dir: Optional[str] = None):
+        """
+        Get the engine ready ahead of use (pooled CLI sessions when CLAUDE_POOL_ENABLED): the summary /
+        format session, plus the analysis session of codebase_dir so it boots while the code context is built
+        """
+        self.engine.prewarm(codebase_dir)
+        if self.summary_engine is not self.engine and codebase_dir is None:
+            self.summary_engine.prewarm()
 
 
     def validate_analysis_output(self, output: str) -> bool:
@@ -91,212 +88,294 @@ class ClaudeUtils:
                 return True
         return False
 
-    def generate_issue_summary(self, error_message: str, slack_payload: SlackPayload) -> str:
+    async def generate_issue_summary(self, error_message: str, slack_payload: SlackPayload) -> str:
         """Generate issue summary with retry logic"""
         issue_summary_generator_prompt_file = f"src/prompt/issue_summary_generator_prompt.md"
-        prompt = (
-            f"對於 channel id: '{slack_payload.channel_id}' 和 thread id: '{slack_payload.thread_id}' 的 {error_message}' 這個錯誤訊息/問題回報 "
+        builder = PromptBuilder("issue_summary", Config.PROMPT_PAYLOAD_DIR)
+        builder.add(
+            f"對於 channel id: '{slack_payload.channel_id}' 和 thread id: '{slack_payload.thread_id}' 的錯誤訊息/問題回報，"
             f"根據 {issue_summary_generator_prompt_file} 的指示生成問題摘要"
         )
+        builder.add_section(
+            "error", error_message, Config.PROMPT_MAX_ERROR_TOKENS, header="錯誤訊息/問題回報：", keep_full_text=True
+        )
+        prompt = builder.build()
 
-        
-        max_retries = 2
-        attempt = 0
-        
-        while attempt <= max_retries:
+        try:
+            with stage_timer("issue_summary", prompt_tokens=estimate_tokens(prompt)) as stage:
+                issue_summary = await self._generate_issue_summary(prompt)
+                stage["outcome"] = "ok" if issue_summary else "failed"
+                return issue_summary
+        finally:
+            builder.cleanup()
+
+    async def _generate_issue_summary(self, prompt: str) -> Optional[str]:
+        """Run the issue summary prompt under the shared Claude retry policy"""
+        policy = claude_retry_policy
+        for attempt in range(1, policy.max_attempts + 1):
+            trial_id = policy.check()
             try:
-                logger.info(f"[generate_issue_summary] 嘗試第 {attempt + 1} 次生成問題摘要")
+                logger.info(f"[generate_issue_summary] 嘗試第 {attempt} 次生成問題摘要")
                 logger.info(f"[generate_issue_summary - prompt]: {prompt}")
-                cmd = ['claude', '-p', prompt]
-
-                result = subprocess.run(
-                    cmd,
-                    capture_output=True,
-                    text=True
-                )
-                # 儲存 stdout 和 stderr 訊息
-                stdout = result.stdout if result.stdout else ""
-                stderr = result.stderr if result.stderr else ""
-                logger.info(f"--- STDOUT: generate_issue_summary ---")
-                logger.info(f"{stdout}")
-                logger.info(f"--- STDERR: generate_issue_summary ---")
-                logger.info(f"{stderr}")
-            
-                # 驗證輸出格式
-                if self.validate_issue_summary_output(stdout):
-                    logger.info(f"[generate_issue_summary] 第 {attempt + 1} 次嘗試成功")
-                    return stdout
+                try:
+                    result = await self.summary_engine.run(ISSUE_SUMMARY, prompt, timeout=self.timeout)
+                except Exception as e:
+                    failure = classify_claude_failure(exception=e)
+                    logger.error(f"[generate_issue_summary] 第 {attempt} 次嘗試失敗（{failure}）: {e}")
                 else:
-                    logger.warning(f"[generate_issue_summary] 第 {attempt + 1} 次嘗試驗證失敗")
-                    if attempt < max_retries:
-                        logger.info(f"[generate_issue_summary] 準備重試第 {attempt + 2} 次...")
-                    
-            except Exception as e:
-                logger.error(f"[generate_issue_summary] 第 {attempt + 1} 次嘗試失敗: {e}")
-                if attempt < max_retries:
-                    logger.info(f"[generate_issue_summary] 準備重試第 {attempt + 2} 次...")
-            
-            attempt += 1
-        
-        logger.error(f"[generate_issue_summary] 所有 {max_retries + 1} 次嘗試都失敗")
+                    # 儲存 stdout 和 stderr 訊息
+                    stdout, result_event = result.text or "", result.result_event
+                    stderr = result.output
+                    record_claude_usage("issue_summary", result_event)
+                    logger.info(f"--- STDOUT: generate_issue_summary ---")
+                    logger.info(f"{stdout}")
+                    logger.info(f"--- STDERR: generate_issue_summary ---")
+                    logger.info(f"{stderr}")
+
+                    # 驗證輸出格式
+                    if result.returncode == 0 and not result.is_error and self.validate_issue_summary_output(stdout):
+                        logger.info(f"[generate_issue_summary] 第 {attempt} 次嘗試成功")
+                        claude_calls_total.inc(call="issue_summary", outcome="ok")
+                        policy.record_success()
+                        return stdout
+                    failure = classify_claude_failure(result.returncode, result_event, f"{stdout}\n{stderr}")
+                    logger.warning(f"[generate_issue_summary] 第 {attempt} 次嘗試驗證失敗（{failure}）")
+
+                claude_calls_total.inc(call="issue_summary", outcome=failure)
+                policy.record_failure(failure)
+                if not policy.should_retry(failure, attempt):
+                    break
+                await policy.backoff(attempt)
+            finally:
+                policy.release(trial_id)
+
+        logger.error(f"[generate_issue_summary] 生成問題摘要失敗，共嘗試 {attempt} 次")
         return None
-            
-    def analyze_error(self, error_detail: str, custom_prompt: Optional[str] = None) -> str:
-        """Analyze error with smart retry logic"""
+
+    async def analyze_error(
+        self,
+        error_detail: str,
+        custom_prompt: Optional[str] = None,
+        codebase_dir: Optional[str] = None,
+        error_context: Optional[str] = None,
+        code_context: Optional[str] = None,
+        on_progress: Optional[Callable[[str], None]] = None,
+        raw_error: Optional[str] = None
+    ) -> str:
+        """
+        Analyze error with smart retry logic.
+        on_progress receives a one-line summary of every tool call Claude makes.
+        raw_error is the original error message when error_detail is a compacted form of it (parsed stack trace).
+        """
         prompt_file = f"src/prompt/analysis_prompt.md"
+        codebase_dir = codebase_dir or self.codebase_dir
         
-        base_prompt = (
-            f"對於『{error_detail}』這個錯誤訊息／問題回報，"
-            f"請根據 {prompt_file} 的指示分析，"
+        builder = PromptBuilder("analyze_error", Config.PROMPT_PAYLOAD_DIR)
+        builder.add(
+            f"請針對程式碼目錄 {codebase_dir}，"
+            f"根據 {prompt_file} 的指示分析以下錯誤訊息／問題回報，"
             f"並嚴格確保輸出結果符合指定的 JSON 格式。"
         )
-        
+        # 過長的錯誤訊息會合併重複行並省略中間段落；精簡過的 stack trace 也一樣，
+        # 原始完整內容另存檔案供 Claude 需要時讀取
+        builder.add_section(
+            "error", error_detail, Config.PROMPT_MAX_ERROR_TOKENS, header="錯誤訊息／問題回報：",
+            keep_full_text=True, full_text=raw_error
+        )
+
+        # 錯誤發生概況（事件數量、影響服務等）
+        builder.add_section("error_context", error_context, Config.PROMPT_MAX_CONTEXT_TOKENS, header="錯誤發生概況：")
+
+        # 預先從程式碼索引找到的 stack frame 程式碼片段，減少 Claude 搜尋檔案的次數
+        builder.add_section(
+            "code_context",
+            code_context,
+            Config.PROMPT_MAX_CONTEXT_TOKENS,
+            header=(
+                "以下是根據 stack trace 預先從程式碼目錄找到的相關程式碼片段"
+                "（路徑相對於程式碼目錄，> 標示發生錯誤的行），請先參考這些片段，必要時再查看其他檔案："
+            )
+        )
+
         # 如果有自訂 prompt，附加到基礎 prompt 後面
-        if custom_prompt:
-            prompt = f"{base_prompt}\n\n此外，請特別注意以下自訂指示：\n{custom_prompt}"
-        else:
-            prompt = base_prompt
+        builder.add_section(
+            "custom_prompt", custom_prompt, Config.PROMPT_MAX_CONTEXT_TOKENS, header="此外，請特別注意以下自訂指示："
+        )
+        prompt = builder.build()
 
-        max_retries = 3
-        attempt = 1
+        try:
+            with stage_timer("analysis", prompt_tokens=estimate_tokens(prompt)) as stage:
+                analysis_result = await self._analyze_error(prompt, codebase_dir, on_progress)
+                stage["outcome"] = "ok" if analysis_result else "failed"
+                return analysis_result
+        finally:
+            builder.cleanup()
 
-        while attempt <= max_retries:
+    async def _analyze_error(
+        self, prompt: str, codebase_dir: str, on_progress: Optional[Callable[[str], None]] = None
+    ) -> Optional[str]:
+        """
+        Run the analysis prompt under the shared Claude retry policy.
+        Every attempt counts toward max_attempts whatever the failure; output that has content but
+        the wrong format gets one format_analysis_result pass per analysis.
+        """
+        policy = claude_retry_policy
+        formatted = False
+        for attempt in range(1, policy.max_attempts + 1):
+            trial_id = policy.check()
             try:
                 logger.info(f"[analyze_error] 嘗試第 {attempt} 次進行問題分析")
                 logger.info(f"[analyze_error] prompt: {prompt}")
-                
-                cmd = f"claude --add-dir {self.codebase_dir} -p --verbose --output-format stream-json '{prompt}' | jq -r '{jq_filter_for_analysis_result}'"
-                logger.info(f"[analyze_error] 開始執行 Claude 命令...")
-                logger.info(f"[analyze_error] Claude 正在分析，根據問題複雜度可能需要幾十秒~幾分鐘...")
 
-                proc = subprocess.Popen(
-                    cmd,
-                    shell=True,
-                    executable="/bin/bash",
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,  # 合併輸出，避免雙管道阻塞
-                    text=True,
-                    bufsize=1,                 # 行緩衝
-                )
-
-                lines = []
-                for line in proc.stdout:
-                    line = line.rstrip("\n")
-                    logger.info(line)          # 即時顯示
-                    lines.append(line)         # 同步累積
-
-                rc = proc.wait()
-                full_stdout = "\n".join(lines)
-                # 解析 full_stdout 當中的 "result:" 後之內容
-                match = re.search(r"result:(.*)", full_stdout, re.DOTALL)
-                stdout = match.group(1).strip() if match else ""
+                logger.info(f"[analyze_error] 開始執行 Claude 分析（engine: {self.engine.name}）...")
+                logger.info(f"[analyze_error] Claude 正在分析，根據問題複雜度可能需要幾十秒~幾分鐘...")
 
-                logger.info(f"--- STDOUT: analyze_error ---")
-                logger.info(f"{stdout}")
-                if stdout and self.validate_analysis_output(stdout):
-                    return stdout
-                
-                # 檢查是否為連接錯誤
-                if self.is_connection_error(stdout):
-                    logger.warning(f"[analyze_error] 第 {attempt} 次嘗試遇到連接錯誤，需要重試")
-                    if attempt < max_retries:
-                        logger.info(f"[analyze_error] 準備重試第 {attempt + 1} 次...")
-                        attempt += 1
-                        continue
-                    else:
-                        logger.error(f"[analyze_error] 連接錯誤，所有重試都失敗")
-                        return None
-
-                # 檢查是否有內容但格式不正確
-                # case1: 有內容，但沒格式化
-                if len(stdout) > 30:
-                    logger.warning(f"[analyze_error] 第 {attempt} 次嘗試有內容但格式不正確，嘗試格式化修正")
-                    formatted_result = self.format_analysis_result(stdout)
-                    if formatted_result and self.validate_analysis_output(formatted_result):
-                        logger.info(f"[analyze_error] 格式化修正成功")
-                        return formatted_result
+                try:
+                    result = await self.engine.run(
+                        ANALYSIS,
+                        prompt,
+                        timeout=self.timeout,
+                        codebase_dir=codebase_dir,
+                        on_line=logger.info,       # 即時顯示 Claude 的每個步驟
+                        on_tool_use=on_progress
+                    )
+                except Exception as e:
+                    failure = classify_claude_failure(exception=e)
+                    logger.error(f"[analyze_error] 第 {attempt} 次嘗試失敗（{failure}）: {e}")
                 else:
-                    logger.warning(f"[analyze_error] 第 {attempt} 次嘗試沒內容，需要重試")
-                    if attempt < max_retries:
-                        logger.info(f"[analyze_error] 準備重試第 {attempt + 1} 次...")
-                        attempt += 1
+                    usage = record_claude_usage("analysis", result.result_event)
+                    if usage:
+                        logger.info(
+                            f"[analyze_error] tokens in/out: {usage['input_tokens']}/{usage['output_tokens']}, "
+                            f"cost: ${usage['cost_usd']}, turns: {usage['num_turns']}, tool uses: {result.tool_use_count}",
+                            extra={"metrics": {"call": "analysis", "tool_uses": result.tool_use_count, **usage}}
+                        )
+                    stdout = (result.text or "").strip()
+                    if result.text is None:
+                        logger.warning(f"[analyze_error] 沒有收到 result event，最後輸出：\n{result.output}")
+
+                    logger.info(f"--- STDOUT: analyze_error ---")
+                    logger.info(f"{stdout}")
+                    if not result.is_error:
+                        # 先在本地擷取 / 修正 JSON（code fence、多餘逗號、前後說明文字、被截斷的物件），
+                        # 只有修不回來時才另外呼叫 Claude 格式化
+                        analysis_json = repair_analysis_output(stdout or result.output)
+                        if analysis_json:
+                            claude_calls_total.inc(call="analysis", outcome="ok")
+                            policy.record_success()
+                            return analysis_json
+                        if stdout and self.validate_analysis_output(stdout):
+                            claude_calls_total.inc(call="analysis", outcome="ok")
+                            policy.record_success()
+                            return stdout
+
+                    failure = classify_claude_failure(result.returncode, result.result_event, result.output)
+                    logger.warning(f"[analyze_error] 第 {attempt} 次嘗試失敗（{failure}），exit code: {result.returncode}")
+
+                    # 有內容但格式不正確：每次分析只做一次格式化修正
+                    if failure == INVALID_OUTPUT and len(stdout) > 30 and not formatted:
+                        formatted = True
+                        claude_calls_total.inc(call="analysis", outcome=failure)
+                        policy.record_failure(failure)
+                        logger.warning(f"[analyze_error] 第 {attempt} 次嘗試有內容但格式不正確，嘗試格式化修正")
+                        formatted_result = repair_analysis_output(await self.format_analysis_result(stdout))
+                        if formatted_result:
+                            logger.info(f"[analyze_error] 格式化修正成功")
+                            return formatted_result
+                        if not policy.should_retry(failure, attempt):
+                            break
+                        await policy.backoff(attempt)
                         continue
-                    else:
-                        logger.error(f"[analyze_error] 沒內容，所有重試都失敗")
-                        return None
-   
-            except Exception as e:
-                logger.error(f"[analyze_error] 第 {attempt} 次嘗試失敗: {e}")
-                if attempt < max_retries:
-                    logger.info(f"[analyze_error] 準備重試第 {attempt + 1} 次...")
-                    attempt += 1
-        
-        logger.error(f"[analyze_error] 所有 {max_retries} 次嘗試都失敗")
-        return None
 
-    def is_connection_error(self, output: str) -> bool:
-        """檢查是否為連接錯誤"""
-        if not output:
-            return True
-        
-        connection_error_keywords = [
-            "Connection error",
-            "Connection timeout", 
-            "Network error",
-            "Failed to connect",
-            "Connection refused",
-            "API Error"
-        ]
-        
-        for keyword in connection_error_keywords:
-            if keyword in output:
-                return True
-        
-        return False
+                claude_calls_total.inc(call="analysis", outcome=failure)
+                policy.record_failure(failure)
+                if not policy.should_retry(failure, attempt):
+                    break
+                await policy.backoff(attempt)
+            finally:
+                policy.release(trial_id)
+
+        logger.error(f"[analyze_error] 問題分析失敗，共嘗試 {attempt} 次")
+        return None
 
-    def format_analysis_result(self, result: str) -> str:
+    async def format_analysis_result(self, result: str) -> str:
         """Format analysis result (single attempt)"""
         prompt_file = f"src/prompt/analysis_prompt.md"
-        prompt = f"針對`{result}` 請確保分析結果符合 {prompt_file} 的格式，並輸出符合要求的 JSON 格式"
-        
-        
-        try:
-            cmd = ['claude', '-p', prompt]
-            logger.info(f"[format_analysis_result] prompt: {prompt}")
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True
-            )
-            # 儲存 stdout 和 stderr 訊息
-            stdout = result.stdout if result.stdout else ""
-            stderr = result.stderr if result.stderr else ""
-            logger.info(f"--- STDOUT: analyze_error ---")
-            logger.info(f"{stdout}")
-            logger.info(f"--- STDERR: analyze_error ---")
-            logger.info(f"{stderr}")
-
-            return stdout
-            
-        except Exception as e:
-            logger.error(f"[format_analysis_result] format analysis result failed: {e}")
-            return None
+        builder = PromptBuilder("format_analysis_result")
+        builder.add_section("result", result, Config.PROMPT_MAX_ERROR_TOKENS, header="分析結果：")
+        builder.add(f"請確保以上分析結果符合 {prompt_file} 的格式，並輸出符合要求的 JSON 格式")
+        prompt = builder.build()
+
+        trial_id = claude_retry_policy.check()
+        with stage_timer("format_result") as stage:
+            try:
+                logger.info(f"[format_analysis_result] prompt: {prompt}")
+                result = await self.engine.run(FORMAT_RESULT, prompt, timeout=self.timeout)
+                # 儲存 stdout 和 stderr 訊息
+                stdout, result_event = result.text or "", result.result_event
+                stderr = result.output
+                record_claude_usage("format_result", result_event)
+                logger.info(f"--- STDOUT: analyze_error ---")
+                logger.info(f"{stdout}")
+                logger.info(f"--- STDERR: analyze_error ---")
+                logger.info(f"{stderr}")
 
-    def analyze_bug(self, error_message: str, slack_payload: SlackPayload, custom_prompt: Optional[str] = None) -> Optional[str]:
-        """Analyze bug using Claude Code with individual method retry logic"""
+                if result.returncode == 0 and not result.is_error:
+                    claude_calls_total.inc(call="format_result", outcome="ok")
+                    claude_retry_policy.record_success()
+                else:
+                    failure = classify_claude_failure(result.returncode, result_event, f"{stdout}\n{stderr}")
+                    stage["outcome"] = failure
+                    claude_calls_total.inc(call="format_result", outcome=failure)
+                    claude_retry_policy.record_failure(failure)
+                return stdout
+
+            except Exception as e:
+                logger.error(f"[format_analysis_result] format analysis result failed: {e}")
+                failure = classify_claude_failure(exception=e)
+                stage["outcome"] = failure
+                claude_calls_total.inc(call="format_result", outcome=failure)
+                claude_retry_policy.record_failure(failure)
+                return None
+            finally:
+                claude_retry_policy.release(trial_id)
+
+    async def analyze_bug(
+        self,
+        error_message: str,
+        slack_payload: SlackPayload,
+        custom_prompt: Optional[str] = None,
+        codebase_dir: Optional[str] = None,
+        error_context: Optional[str] = None,
+        code_context: Optional[str] = None,
+        on_progress: Optional[Callable[[str], None]] = None,
+        issue_summary: Optional[str] = None,
+        raw_error: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        Analyze bug using Claude Code with individual method retry logic.
+        A precomputed issue_summary (e.g. from a checkpoint) skips the summary stage.
+        raw_error is the original error message when error_message is its compact stack trace.
+        """
         try:
             logger.info(f"[analyze_bug] Start to analyze bug")
             
             # 階段 1: 問題摘要（如果需要）
-            if slack_payload.read_slack_thread_details and slack_payload.channel_id and slack_payload.thread_id:                
-                issue_summary = self.generate_issue_summary(error_message, slack_payload)
+            if issue_summary:
+                error_message = issue_summary
+            elif slack_payload.read_slack_thread_details and slack_payload.channel_id and slack_payload.thread_id:                
+                issue_summary = await self.generate_issue_summary(error_message, slack_payload)
                 if not issue_summary:
                     logger.error(f"[analyze_bug] generate_issue_summary 生成失敗")
                     return None
                 error_message = issue_summary
 
             # 階段 2: 問題分析
-            analysis_result = self.analyze_error(error_message, custom_prompt)
+            # 問題摘要取代錯誤訊息時，原始錯誤訊息已經是摘要的輸入
+            analysis_result = await self.analyze_error(
+                error_message, custom_prompt, codebase_dir, error_context, code_context, on_progress,
+                raw_error=None if issue_summary else raw_error
+            )
             if not analysis_result:
                 logger.error(f"[analyze_bug] analyze_error 失敗")
                 return None
@@ -304,6 +383,9 @@ class ClaudeUtils:
             logger.info(f"[analyze_bug] analysis_result: {analysis_result}")
             return analysis_result
                 
+        except CircuitOpenError:
+            # 讓呼叫端知道是 Claude 暫時無法使用，而不是分析本身失敗
+            raise
         except Exception as e:
             logger.error(f"[analyze_bug] Claude analysis failed: {e}")
             return None
\ No newline at end of file
@@ -1,6 +1,12 @@
+import asyncio
 import subprocess
 import sys
 import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional
+
+from src.core.config import Config
 
 logger = logging.getLogger(__name__)
 
@@ -31,4 +37,143 @@ def run_with_live_output(cmd):
     if stderr:
         stderr_lines.append(stderr)
     
-    return ''.join(stdout_lines), ''.join(stderr_lines)
\ No newline at end of file
+    return ''.join(stdout_lines), ''.join(stderr_lines)
+
+class CommandResult:
+    """Result of a command run by AsyncProcessRunner"""
+
+    def __init__(self, cmd: List[str], returncode: int, stdout: str, stderr: str, duration: float):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+
+
+class AsyncProcessRunner:
+    """
+    Non-blocking subprocess runner built on asyncio.create_subprocess_exec
+    限制同時執行的 process 數量，逾時或被取消時會 kill 子程序
+    """
+
+    # stream-json 的單行可能包含整個檔案內容，放寬 StreamReader 的單行上限
+    STREAM_LIMIT = 32 * 1024 * 1024
+
+    def __init__(self, name: str, max_concurrency: int):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.active = 0
+        self.peak_active = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one of the max_concurrency slots (also held by pooled sessions while they process a prompt)"""
+        async with self._semaphore:
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            try:
+                yield
+            finally:
+                self.active -= 1
+
+    async def run(
+        self,
+        cmd: List[str],
+        cwd: Optional[str] = None,
+        timeout: Optional[float] = None,
+        input_text: Optional[str] = None,
+        on_line: Optional[Callable[[str], None]] = None,
+        capture_stdout: bool = True,
+        merge_stderr: bool = False,
+        check: bool = False,
+        env: Optional[Dict[str, str]] = None,
+    ) -> CommandResult:
+        """
+        Run a command without blocking the event loop.
+        on_line is called for every stdout line as it arrives; capture_stdout=False keeps memory flat
+        for long streams. Raises subprocess.TimeoutExpired on timeout and subprocess.CalledProcessError
+        when check is set and the command fails.
+        """
+        async with self.slot():
+            start = time.monotonic()
+            process = None
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    cwd=cwd,
+                    env=env,
+                    stdin=asyncio.subprocess.PIPE if input_text is not None else asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.STDOUT if merge_stderr else asyncio.subprocess.PIPE,
+                    limit=self.STREAM_LIMIT,
+                )
+                stdout_lines: List[str] = []
+                stderr_chunks: List[bytes] = []
+
+                async def pump_stdout():
+                    while True:
+                        raw = await process.stdout.readline()
+                        if not raw:
+                            break
+                        line = raw.decode('utf-8', errors='replace')
+                        if on_line:
+                            on_line(line.rstrip('\n'))
+                        if capture_stdout:
+                            stdout_lines.append(line)
+
+                async def pump_stderr():
+                    if process.stderr is not None:
+                        stderr_chunks.append(await process.stderr.read())
+
+                async def feed_stdin():
+                    if input_text is None:
+                        return
+                    try:
+                        process.stdin.write(input_text.encode('utf-8'))
+                        await process.stdin.drain()
+                    except (BrokenPipeError, ConnectionResetError):
+                        logger.warning(f"[{self.name}] process closed stdin early: {cmd[0]}")
+                    finally:
+                        process.stdin.close()
+
+                async def communicate():
+                    await asyncio.gather(feed_stdin(), pump_stdout(), pump_stderr())
+                    return await process.wait()
+
+                try:
+                    returncode = await asyncio.wait_for(communicate(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    logger.error(f"[{self.name}] command timed out after {timeout}s: {cmd[0]}")
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+
+                result = CommandResult(
+                    cmd,
+                    returncode,
+                    ''.join(stdout_lines),
+                    b''.join(stderr_chunks).decode('utf-8', errors='replace'),
+                    time.monotonic() - start,
+                )
+                if check and returncode != 0:
+                    raise subprocess.CalledProcessError(returncode, cmd, result.stdout, result.stderr)
+                return result
+            finally:
+                # 逾時、取消或例外時確保子程序不會殘留
+                if process is not None and process.returncode is None:
+                    try:
+                        process.kill()
+                    except ProcessLookupError:
+                        pass
+                    await process.wait()
+
+    def stats(self) -> dict:
+        """Current and peak number of running processes"""
+        return {
+            "active": self.active,
+            "peak_active": self.peak_active,
+            "max_concurrency": self.max_concurrency,
+        }
+
+
+claude_runner = AsyncProcessRunner("claude", Config.CLAUDE_MAX_CONCURRENCY)
+git_runner = AsyncProcessRunner("git", Config.GIT_MAX_CONCURRENCY)
@@ -0,0 +1,291 @@
+"""
+Code Index Utilities
+"""
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from src.utils.stack_trace_utils import StackFrame
+from src.utils.git_utils import GitUtils
+
+logger = logging.getLogger(__name__)
+
+# 只建立原始碼檔案的索引
+SOURCE_EXTENSIONS = {
+    '.py', '.js', '.jsx', '.ts', '.tsx', '.mjs', '.cjs', '.go', '.java', '.kt', '.scala', '.rb', '.php'
+}
+
+SYMBOL_PATTERNS = {
+    '.py': [
+        re.compile(r'^\s*(?:async\s+)?def\s+(?P<name>\w+)'),
+        re.compile(r'^\s*class\s+(?P<name>\w+)'),
+    ],
+    '.js': [
+        re.compile(r'^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\*?\s+(?P<name>[\w$]+)'),
+        re.compile(r'^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+(?P<name>[\w$]+)'),
+        re.compile(r'^\s*(?:export\s+)?(?:const|let|var)\s+(?P<name>[\w$]+)\s*=\s*(?:async\s+)?(?:function|\([^)]*\)\s*=>|[\w$]+\s*=>)'),
+        re.compile(r'^\s+(?:static\s+)?(?:async\s+)?(?P<name>[\w$]+)\s*\([^)]*\)\s*\{'),
+    ],
+    '.go': [
+        re.compile(r'^func\s+(?:\([^)]*\)\s*)?(?P<name>\w+)'),
+        re.compile(r'^type\s+(?P<name>\w+)\s+(?:struct|interface)'),
+    ],
+    '.java': [
+        re.compile(r'^\s*(?:(?:public|private|protected|abstract|final|static)\s+)*(?:class|interface|enum|record)\s+(?P<name>\w+)'),
+        re.compile(r'^\s*(?:(?:public|private|protected|abstract|final|static|synchronized)\s+)+[\w<>\[\],\s]+\s+(?P<name>\w+)\s*\('),
+    ],
+    '.rb': [
+        re.compile(r'^\s*def\s+(?:self\.)?(?P<name>\w+[?!]?)'),
+        re.compile(r'^\s*(?:class|module)\s+(?P<name>\w+)'),
+    ],
+    '.php': [
+        re.compile(r'^\s*(?:(?:public|private|protected|static|abstract|final)\s+)*function\s+(?P<name>\w+)'),
+        re.compile(r'^\s*(?:abstract\s+|final\s+)?class\s+(?P<name>\w+)'),
+    ],
+}
+for _ext in ('.jsx', '.ts', '.tsx', '.mjs', '.cjs'):
+    SYMBOL_PATTERNS[_ext] = SYMBOL_PATTERNS['.js']
+for _ext in ('.kt', '.scala'):
+    SYMBOL_PATTERNS[_ext] = SYMBOL_PATTERNS['.java']
+
+# 關鍵字不是 symbol（避免 JS method pattern 誤判 if / for ...）
+NON_SYMBOL_NAMES = {'if', 'for', 'while', 'switch', 'catch', 'function', 'return', 'with', 'elif', 'else'}
+
+
+def extract_symbols(path: str, content: str) -> List[Tuple[str, int]]:
+    """Extract (symbol name, line number) definitions from source text"""
+    patterns = SYMBOL_PATTERNS.get(os.path.splitext(path)[1].lower())
+    if not patterns:
+        return []
+    symbols = []
+    for line_no, line in enumerate(content.splitlines(), start=1):
+        for pattern in patterns:
+            match = pattern.match(line)
+            if match and match.group('name') not in NON_SYMBOL_NAMES:
+                symbols.append((match.group('name'), line_no))
+                break
+    return symbols
+
+
+class CodeIndex:
+    """
+    SQLite index of source files and symbol definitions per deployed commit.
+    Symbols are stored per git blob, so a new commit only parses the files whose content changed
+    since the previously indexed commits.
+    """
+
+    def __init__(self, git_utils: GitUtils, db_path: str, max_commits: int = 5, max_file_bytes: int = 512 * 1024):
+        self.git_utils = git_utils
+        self.db_path = db_path
+        self.max_commits = max_commits
+        self.max_file_bytes = max_file_bytes
+        self._lock = threading.Lock()
+        self._commit_locks: Dict[str, asyncio.Lock] = {}
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS indexed_commits (
+                commit_hash TEXT PRIMARY KEY,
+                indexed_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                commit_hash TEXT NOT NULL,
+                path TEXT NOT NULL,
+                basename TEXT NOT NULL,
+                blob TEXT NOT NULL,
+                PRIMARY KEY (commit_hash, path)
+            );
+            CREATE INDEX IF NOT EXISTS idx_files_basename ON files (commit_hash, basename);
+            CREATE INDEX IF NOT EXISTS idx_files_blob ON files (blob);
+            CREATE TABLE IF NOT EXISTS indexed_blobs (
+                blob TEXT PRIMARY KEY
+            );
+            CREATE TABLE IF NOT EXISTS symbols (
+                blob TEXT NOT NULL,
+                name TEXT NOT NULL,
+                line INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_symbols_blob ON symbols (blob);
+            CREATE INDEX IF NOT EXISTS idx_symbols_name ON symbols (name);
+            """
+        )
+        self._conn.commit()
+
+    def is_indexed(self, commit_hash: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM indexed_commits WHERE commit_hash = ?", (commit_hash,)
+            ).fetchone()
+        return row is not None
+
+    async def ensure_indexed(self, commit_hash: str, codebase_dir: str):
+        """Index a commit (files from `git ls-tree`, symbols of new blobs read from its worktree)"""
+        if await asyncio.to_thread(self.is_indexed, commit_hash):
+            return
+        commit_lock = self._commit_locks.setdefault(commit_hash, asyncio.Lock())
+        async with commit_lock:
+            if await asyncio.to_thread(self.is_indexed, commit_hash):
+                return
+            start = time.time()
+            result = await self.git_utils.run_git(['ls-tree', '-r', '-l', commit_hash])
+            files = []
+            for line in result.stdout.splitlines():
+                # <mode> blob <sha> <size>\t<path>
+                meta, _, path = line.partition('\t')
+                parts = meta.split()
+                if len(parts) != 4 or parts[1] != 'blob':
+                    continue
+                if os.path.splitext(path)[1].lower() not in SOURCE_EXTENSIONS:
+                    continue
+                if parts[3].isdigit() and int(parts[3]) > self.max_file_bytes:
+                    continue
+                files.append((path, parts[2]))
+
+            parsed = await asyncio.to_thread(self._index_files, commit_hash, codebase_dir, files)
+            logger.info(
+                f"[CodeIndex] indexed {commit_hash[:12]}: {len(files)} files, "
+                f"{parsed} changed files parsed in {time.time() - start:.2f}s"
+            )
+            self._commit_locks.pop(commit_hash, None)
+
+    def _index_files(self, commit_hash: str, codebase_dir: str, files: List[Tuple[str, str]]) -> int:
+        """Store the file list and parse symbols of blobs not indexed yet; returns parsed file count"""
+        with self._lock:
+            known_blobs = {row[0] for row in self._conn.execute("SELECT blob FROM indexed_blobs")}
+
+        new_symbols = []
+        new_blobs = set()
+        for path, blob in files:
+            if blob in known_blobs or blob in new_blobs:
+                continue
+            try:
+                with open(os.path.join(codebase_dir, path), 'r', encoding='utf-8', errors='replace') as f:
+                    content = f.read()
+            except OSError:
+                continue
+            new_blobs.add(blob)
+            new_symbols.extend((blob, name, line) for name, line in extract_symbols(path, content))
+
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO indexed_blobs (blob) VALUES (?)", [(b,) for b in new_blobs])
+            self._conn.executemany("INSERT INTO symbols (blob, name, line) VALUES (?, ?, ?)", new_symbols)
+            self._conn.execute("DELETE FROM files WHERE commit_hash = ?", (commit_hash,))
+            self._conn.executemany(
+                "INSERT INTO files (commit_hash, path, basename, blob) VALUES (?, ?, ?, ?)",
+                [(commit_hash, path, os.path.basename(path), blob) for path, blob in files]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO indexed_commits (commit_hash, indexed_at) VALUES (?, ?)",
+                (commit_hash, time.time())
+            )
+            self._prune()
+            self._conn.commit()
+        return len(new_blobs)
+
+    def _prune(self):
+        """Keep only the latest max_commits commits and the blobs they reference"""
+        stale = [row[0] for row in self._conn.execute(
+            "SELECT commit_hash FROM indexed_commits ORDER BY indexed_at DESC LIMIT -1 OFFSET ?",
+            (self.max_commits,)
+        )]
+        if not stale:
+            return
+        for commit_hash in stale:
+            self._conn.execute("DELETE FROM files WHERE commit_hash = ?", (commit_hash,))
+            self._conn.execute("DELETE FROM indexed_commits WHERE commit_hash = ?", (commit_hash,))
+        self._conn.execute("DELETE FROM symbols WHERE blob NOT IN (SELECT blob FROM files)")
+        self._conn.execute("DELETE FROM indexed_blobs WHERE blob NOT IN (SELECT blob FROM files)")
+        logger.info(f"[CodeIndex] pruned {len(stale)} old commits")
+
+    def resolve_path(self, commit_hash: str, frame_path: str) -> Optional[str]:
+        """Map a stack frame path (e.g. /app/src/foo.py) to the repository path with the longest common suffix"""
+        parts = [part for part in frame_path.replace('\\', '/').split('/') if part]
+        if not parts:
+            return None
+        with self._lock:
+            candidates = [row[0] for row in self._conn.execute(
+                "SELECT path FROM files WHERE commit_hash = ? AND basename = ?", (commit_hash, parts[-1])
+            )]
+        best, best_score = None, 0
+        for candidate in candidates:
+            candidate_parts = candidate.split('/')
+            score = 0
+            while score < min(len(parts), len(candidate_parts)) and parts[-1 - score] == candidate_parts[-1 - score]:
+                score += 1
+            if score > best_score or (score == best_score and best and len(candidate) < len(best)):
+                best, best_score = candidate, score
+        return best
+
+    def find_symbol(self, commit_hash: str, name: str, limit: int = 5) -> List[Tuple[str, int]]:
+        """Find (path, line) definitions of a symbol in a commit"""
+        with self._lock:
+            return [(row[0], row[1]) for row in self._conn.execute(
+                "SELECT f.path, s.line FROM symbols s JOIN files f ON f.blob = s.blob "
+                "WHERE f.commit_hash = ? AND s.name = ? ORDER BY f.path LIMIT ?",
+                (commit_hash, name, limit)
+            )]
+
+    def map_frames(self, commit_hash: str, frames: List[StackFrame]) -> List[StackFrame]:
+        """
+        Fill repo_path / repo_line of project frames; frames that cannot be mapped keep them None.
+        Runs sqlite queries, call it through asyncio.to_thread from async code.
+        """
+        for frame in frames:
+            if not frame.in_app:
+                continue
+            path = self.resolve_path(commit_hash, frame.file)
+            if path:
+                frame.repo_path, frame.repo_line = path, frame.line
+                continue
+            # 路徑對不上時（例如 bundle 過的 JS），改用 function 名稱找定義
+            symbol = frame.function.rsplit('.', 1)[-1] if frame.function else ''
+            matches = self.find_symbol(commit_hash, symbol, limit=1) if symbol else []
+            if matches:
+                frame.repo_path, frame.repo_line = matches[0]
+        return frames
+
+    def build_code_context(
+        self,
+        codebase_dir: str,
+        frames: List[StackFrame],
+        max_snippets: int = 5,
+        context_lines: int = 15
+    ) -> Optional[str]:
+        """Render snippets around mapped frames (innermost first) for the analysis prompt"""
+        snippets = []
+        seen = set()
+        for frame in frames:
+            if len(snippets) >= max_snippets:
+                break
+            if not frame.repo_path or (frame.repo_path, frame.repo_line) in seen:
+                continue
+            seen.add((frame.repo_path, frame.repo_line))
+            path, line = frame.repo_path, frame.repo_line
+            try:
+                with open(os.path.join(codebase_dir, path), 'r', encoding='utf-8', errors='replace') as f:
+                    lines = f.read().splitlines()
+            except OSError:
+                continue
+            start = max(1, line - context_lines)
+            end = min(len(lines), line + context_lines)
+            body = "\n".join(
+                f"{'>' if number == line else ' '}{number:5d} | {lines[number - 1]}" for number in range(start, end + 1)
+            )
+            title = f"{path}:{line}" + (f" ({frame.function})" if frame.function else "")
+            snippets.append(f"{title}\n```\n{body}\n```")
+        return "\n\n".join(snippets) if snippets else None
+
+    def stats(self) -> dict:
+        """Index size counters"""
+        with self._lock:
+            commits = self._conn.execute("SELECT COUNT(*) FROM indexed_commits").fetchone()[0]
+            blobs = self._conn.execute("SELECT COUNT(*) FROM indexed_blobs").fetchone()[0]
+            symbols = self._conn.execute("SELECT COUNT(*) FROM symbols").fetchone()[0]
+        return {"commits": commits, "blobs": blobs, "symbols": symbols}
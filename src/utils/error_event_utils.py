@@ -0,0 +1,73 @@
+"""
+GCP Error Reporting Event Utilities
+"""
+import re
+from datetime import datetime
+from typing import List, Optional
+
+from src.utils.fingerprint_utils import compute_error_fingerprint, extract_frames
+
+
+def parse_event_time(event_time: Optional[str]) -> Optional[datetime]:
+    """Parse an Error Reporting RFC3339 timestamp (e.g. 2024-01-01T00:00:00.123456789Z)"""
+    if not event_time:
+        return None
+    try:
+        # fromisoformat 不支援 Z 與超過 6 位的小數秒
+        normalized = re.sub(r'(\.\d{6})\d+', r'\1', event_time.replace('Z', '+00:00'))
+        return datetime.fromisoformat(normalized)
+    except ValueError:
+        return None
+
+
+def trace_richness(message: Optional[str]) -> tuple:
+    """Sort key for picking the most informative trace: more stack frames first, then longer text"""
+    if not message:
+        return (0, 0)
+    return (len(extract_frames(message)), len(message))
+
+
+def aggregate_error_events(group_id: str, events: List[dict], truncated: bool = False) -> Optional[dict]:
+    """
+    Summarize the events of one error group: counts, first/last seen, distinct traces, affected services,
+    and the richest trace as the representative event to analyze.
+    truncated: whether more events exist than were fetched
+    """
+    if not events:
+        return None
+
+    event_times = [t for t in (parse_event_time(event.get('eventTime')) for event in events) if t]
+    services = sorted({
+        (event.get('serviceContext') or {}).get('service')
+        for event in events
+        if (event.get('serviceContext') or {}).get('service')
+    })
+    fingerprints = {compute_error_fingerprint(event.get('message')) for event in events if event.get('message')}
+    representative = max(events, key=lambda event: trace_richness(event.get('message')))
+
+    return {
+        "group_id": group_id,
+        "event_count": len(events),
+        "truncated": truncated,
+        "first_seen": min(event_times) if event_times else None,
+        "last_seen": max(event_times) if event_times else None,
+        "distinct_traces": len(fingerprints),
+        "services": services,
+        "representative_event": representative,
+        "representative_message": representative.get('message', ''),
+        "representative_time": parse_event_time(representative.get('eventTime')),
+    }
+
+
+def format_digest_context(digest: dict) -> str:
+    """Render a group digest as extra context for the analysis prompt"""
+    count = f"{digest['event_count']}+" if digest.get('truncated') else str(digest['event_count'])
+    lines = [
+        f"Error Reporting group: {digest['group_id']}",
+        f"事件數量: {count}（不同 stack trace: {digest['distinct_traces']} 種）",
+    ]
+    if digest.get('first_seen') and digest.get('last_seen'):
+        lines.append(f"首次 / 最後發生時間: {digest['first_seen'].isoformat()} / {digest['last_seen'].isoformat()}")
+    if digest.get('services'):
+        lines.append(f"影響的服務: {', '.join(digest['services'])}")
+    return "\n".join(lines)
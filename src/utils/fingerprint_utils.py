@@ -0,0 +1,54 @@
+"""
+Error Fingerprint Utilities
+"""
+import hashlib
+import re
+from typing import List, Optional
+
+from src.utils.stack_trace_utils import parse_stack_trace
+
+# 會隨每次發生而改變的 token，計算 fingerprint 前需移除
+VOLATILE_PATTERNS = [
+    (re.compile(r'\b\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?\b'), '<ts>'),
+    (re.compile(r'\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b', re.I), '<uuid>'),
+    (re.compile(r'\b0x[0-9a-f]+\b', re.I), '<hex>'),
+    (re.compile(r'\b[0-9a-f]{12,}\b', re.I), '<hex>'),
+    (re.compile(r'[\w.+-]+@[\w-]+\.[\w.-]+'), '<email>'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '<num>'),
+    (re.compile(r'\s+'), ' '),
+]
+
+MAX_FINGERPRINT_FRAMES = 10
+
+
+def extract_frames(error_message: str) -> List[str]:
+    """Extract normalized "file:function" frames from a stack trace, innermost first"""
+    parsed_trace = parse_stack_trace(error_message)
+    return [frame.key for frame in parsed_trace.frames] if parsed_trace else []
+
+
+def normalize_error_text(text: str) -> str:
+    """Strip ids, timestamps and other volatile tokens from error text"""
+    normalized = text.strip().lower()
+    for pattern, replacement in VOLATILE_PATTERNS:
+        normalized = pattern.sub(replacement, normalized)
+    return normalized.strip()
+
+
+def compute_error_fingerprint(error_message: Optional[str]) -> Optional[str]:
+    """
+    計算錯誤訊息的 fingerprint：
+    有 stack trace 時以 frame 為主（忽略行號），否則使用去除 volatile token 後的訊息內容
+    """
+    if not error_message or not error_message.strip():
+        return None
+
+    parsed_trace = parse_stack_trace(error_message)
+    if parsed_trace:
+        # 只用專案程式碼的 frame，第三方套件版本更新不會改變 fingerprint
+        frames = [frame.key for frame in parsed_trace.app_frames[:MAX_FINGERPRINT_FRAMES]]
+        basis = normalize_error_text(parsed_trace.exception_type) + "|" + "|".join(frames)
+    else:
+        basis = normalize_error_text(error_message)
+
+    return hashlib.sha1(basis.encode('utf-8')).hexdigest()[:16]
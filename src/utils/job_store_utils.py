@@ -0,0 +1,706 @@
+"""
+Durable Job Store Utilities
+"""
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from src.core.exceptions import ConfigurationError
+from src.core.models import SlackPayload, TriageJob
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("queued", "running")
+FINISHED_STATUSES = ("completed", "failed")
+
+
+def merge_slack_payloads(target: List[SlackPayload], source: List[SlackPayload]) -> int:
+    """Append payloads of source missing from target (same channel / thread); returns how many were added"""
+    known = {(payload.channel_id, payload.thread_id) for payload in target}
+    added = 0
+    for payload in source:
+        key = (payload.channel_id, payload.thread_id)
+        if key not in known:
+            known.add(key)
+            target.append(payload)
+            added += 1
+    return added
+
+
+class JobStore(ABC):
+    """
+    Durable record of triage jobs (request, stage, attempts, result) keyed by analysis_id.
+    Workers claim queued jobs with a lease and renew it while running; a job whose lease expires
+    (instance crashed or was scaled down) is queued again until max_attempts, so several
+    instances can share one queue without processing a job twice.
+    """
+
+    backend = "base"
+
+    @abstractmethod
+    async def add(self, job: TriageJob, rank: int):
+        """Queue a new job (registered under job.flight_key if set); lower rank is claimed first, FIFO within a rank"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get(self, analysis_id: str) -> Optional[TriageJob]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def claim(self, owner: str, lease_seconds: float) -> Optional[TriageJob]:
+        """Take the next queued job for owner, or None when the queue is empty"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def renew(self, job: TriageJob, owner: str, lease_seconds: float) -> Optional[TriageJob]:
+        """
+        Extend the lease and persist job.stage; returns the stored job (with duplicates attached
+        by other instances) or None when owner no longer holds the lease
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def finish(self, job: TriageJob, owner: str) -> bool:
+        """Store the final status / result and drop the lease; False when the lease was lost"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def release(self, job: TriageJob, owner: str) -> bool:
+        """Put a running job back in the queue without counting the attempt (graceful shutdown)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def requeue_expired(self, max_attempts: int) -> List[TriageJob]:
+        """Queue jobs whose lease expired again, failing those that used up max_attempts"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def find_inflight(self, flight_key: str) -> Optional[TriageJob]:
+        """Queued / running job registered under a single-flight key"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def attach(self, primary_id: str, job: TriageJob) -> Optional[TriageJob]:
+        """
+        Record job as a duplicate of the primary job and add its Slack thread to the primary;
+        None when the primary finished in the meantime
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def queue_position(self, analysis_id: str) -> Optional[int]:
+        """1-based position of a queued job, or None if it is not waiting"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def counts(self) -> Dict[str, int]:
+        """Number of queued and running jobs across all instances"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def prune(self, history_size: int) -> int:
+        """Drop the oldest finished jobs (and their checkpoints) beyond history_size"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def save_checkpoint(self, analysis_id: str, stage: str, value: str):
+        """Store the output of a completed stage"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_checkpoints(self, analysis_id: str) -> Dict[str, str]:
+        """Outputs of the completed stages of a job (stage -> value)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def requeue_failed(self, analysis_id: str, rank: int) -> Optional[TriageJob]:
+        """Queue a failed job again (its checkpoints are kept); None when the job is not failed"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    @staticmethod
+    def _expired_update(job: TriageJob, max_attempts: int):
+        """Job state after its lease expired"""
+        job.lease_owner = None
+        if job.attempts >= max_attempts:
+            job.status = "failed"
+            job.finished_at = job.finished_at or datetime.now()
+            job.error = f"Lease expired after {job.attempts} attempts (stage: {job.stage})"
+        else:
+            job.status = "queued"
+
+    @staticmethod
+    def _resume_update(job: TriageJob) -> bool:
+        if job.status != "failed" or job.coalesced_into:
+            return False
+        job.status = "queued"
+        job.lease_owner = None
+        job.error = None
+        job.finished_at = None
+        return True
+
+    @staticmethod
+    def _attach_update(primary: TriageJob, job: TriageJob):
+        if job.slack_payload.channel_id:
+            merge_slack_payloads(primary.additional_slack_payloads, [job.slack_payload])
+        primary.attached_job_ids.append(job.analysis_id)
+        job.coalesced_into = primary.analysis_id
+        job.status = primary.status
+        job.started_at = primary.started_at
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Job store in a local SQLite file. Several processes on the same host can share the file;
+    claims run in BEGIN IMMEDIATE transactions so a job is handed to one worker only.
+    sqlite3 calls block (lock waits, busy timeout), so they run in a worker thread off the event loop.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        # isolation_level=None：自行控制交易（BEGIN IMMEDIATE）
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS triage_jobs (
+                analysis_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                rank INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                flight_key TEXT,
+                lease_owner TEXT,
+                lease_expires_at REAL,
+                finished_at REAL,
+                data TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_triage_jobs_queue ON triage_jobs (status, rank, seq)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_triage_jobs_lease ON triage_jobs (status, lease_expires_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_triage_jobs_flight ON triage_jobs (flight_key)")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS triage_checkpoints (
+                analysis_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (analysis_id, stage)
+            )
+            """
+        )
+
+    def _run_transaction(self, work: Callable[[sqlite3.Connection], object]):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _run_read(self, work: Callable[[sqlite3.Connection], object]):
+        with self._lock:
+            return work(self._conn)
+
+    async def _transaction(self, work: Callable[[sqlite3.Connection], object]):
+        """Run work in a write transaction on a worker thread"""
+        return await asyncio.to_thread(self._run_transaction, work)
+
+    async def _read(self, work: Callable[[sqlite3.Connection], object]):
+        """Run read-only work on a worker thread"""
+        return await asyncio.to_thread(self._run_read, work)
+
+    @staticmethod
+    def _load(conn: sqlite3.Connection, analysis_id: str) -> Optional[TriageJob]:
+        row = conn.execute("SELECT data FROM triage_jobs WHERE analysis_id = ?", (analysis_id,)).fetchone()
+        return TriageJob.model_validate_json(row[0]) if row else None
+
+    @staticmethod
+    def _save(conn: sqlite3.Connection, job: TriageJob, lease_expires_at: Optional[float] = None):
+        conn.execute(
+            "UPDATE triage_jobs SET status = ?, lease_owner = ?, lease_expires_at = ?, finished_at = ?, data = ? "
+            "WHERE analysis_id = ?",
+            (
+                job.status,
+                job.lease_owner,
+                lease_expires_at if job.status == "running" else None,
+                time.time() if job.status in FINISHED_STATUSES else None,
+                job.model_dump_json(),
+                job.analysis_id,
+            )
+        )
+
+    async def add(self, job: TriageJob, rank: int):
+        def work(conn):
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM triage_jobs").fetchone()[0]
+            conn.execute(
+                "INSERT INTO triage_jobs (analysis_id, status, rank, seq, flight_key, data) VALUES (?, ?, ?, ?, ?, ?)",
+                (job.analysis_id, job.status, rank, seq, job.flight_key, job.model_dump_json())
+            )
+        await self._transaction(work)
+
+    async def get(self, analysis_id: str) -> Optional[TriageJob]:
+        return await self._read(lambda conn: self._load(conn, analysis_id))
+
+    async def claim(self, owner: str, lease_seconds: float) -> Optional[TriageJob]:
+        def work(conn):
+            row = conn.execute(
+                "SELECT analysis_id FROM triage_jobs WHERE status = 'queued' ORDER BY rank, seq LIMIT 1"
+            ).fetchone()
+            if not row:
+                return None
+            job = self._load(conn, row[0])
+            job.status = "running"
+            job.lease_owner = owner
+            job.attempts += 1
+            job.started_at = datetime.now()
+            self._save(conn, job, time.time() + lease_seconds)
+            return job
+        return await self._transaction(work)
+
+    async def renew(self, job: TriageJob, owner: str, lease_seconds: float) -> Optional[TriageJob]:
+        def work(conn):
+            stored = self._load(conn, job.analysis_id)
+            if not stored or stored.status != "running" or stored.lease_owner != owner:
+                return None
+            stored.stage = job.stage
+            self._save(conn, stored, time.time() + lease_seconds)
+            return stored
+        return await self._transaction(work)
+
+    async def finish(self, job: TriageJob, owner: str) -> bool:
+        def work(conn):
+            stored = self._load(conn, job.analysis_id)
+            if not stored or stored.lease_owner != owner:
+                return False
+            # 保留執行期間其他請求併入的 Slack thread
+            merge_slack_payloads(job.additional_slack_payloads, stored.additional_slack_payloads)
+            job.attached_job_ids = list(dict.fromkeys(job.attached_job_ids + stored.attached_job_ids))
+            job.lease_owner = None
+            self._save(conn, job)
+            return True
+        return await self._transaction(work)
+
+    async def release(self, job: TriageJob, owner: str) -> bool:
+        def work(conn):
+            stored = self._load(conn, job.analysis_id)
+            if not stored or stored.status != "running" or stored.lease_owner != owner:
+                return False
+            stored.status = "queued"
+            stored.lease_owner = None
+            stored.attempts = max(0, stored.attempts - 1)
+            self._save(conn, stored)
+            return True
+        return await self._transaction(work)
+
+    async def requeue_expired(self, max_attempts: int) -> List[TriageJob]:
+        def work(conn):
+            rows = conn.execute(
+                "SELECT analysis_id FROM triage_jobs WHERE status = 'running' AND lease_expires_at < ?", (time.time(),)
+            ).fetchall()
+            jobs = []
+            for (analysis_id,) in rows:
+                job = self._load(conn, analysis_id)
+                self._expired_update(job, max_attempts)
+                self._save(conn, job)
+                jobs.append(job)
+            return jobs
+        return await self._transaction(work)
+
+    async def find_inflight(self, flight_key: str) -> Optional[TriageJob]:
+        row = await self._read(lambda conn: conn.execute(
+            "SELECT data FROM triage_jobs WHERE flight_key = ? AND status IN ('queued', 'running') "
+            "ORDER BY seq LIMIT 1",
+            (flight_key,)
+        ).fetchone())
+        return TriageJob.model_validate_json(row[0]) if row else None
+
+    async def attach(self, primary_id: str, job: TriageJob) -> Optional[TriageJob]:
+        def work(conn):
+            primary = self._load(conn, primary_id)
+            if not primary or primary.status not in ACTIVE_STATUSES:
+                return None
+            self._attach_update(primary, job)
+            conn.execute(
+                "UPDATE triage_jobs SET data = ? WHERE analysis_id = ?", (primary.model_dump_json(), primary_id)
+            )
+            # 重複的請求只作為查詢紀錄（status 欄位為 attached），不會被 claim
+            conn.execute(
+                "INSERT INTO triage_jobs (analysis_id, status, rank, seq, finished_at, data) VALUES (?, ?, ?, ?, ?, ?)",
+                (job.analysis_id, "attached", 0, 0, time.time(), job.model_dump_json())
+            )
+            return job
+        return await self._transaction(work)
+
+    async def queue_position(self, analysis_id: str) -> Optional[int]:
+        def work(conn):
+            row = conn.execute(
+                "SELECT rank, seq FROM triage_jobs WHERE analysis_id = ? AND status = 'queued'", (analysis_id,)
+            ).fetchone()
+            if not row:
+                return None
+            ahead = conn.execute(
+                "SELECT COUNT(*) FROM triage_jobs WHERE status = 'queued' AND (rank < ? OR (rank = ? AND seq < ?))",
+                (row[0], row[0], row[1])
+            ).fetchone()[0]
+            return ahead + 1
+        return await self._read(work)
+
+    async def counts(self) -> Dict[str, int]:
+        rows = await self._read(lambda conn: conn.execute(
+            "SELECT status, COUNT(*) FROM triage_jobs WHERE status IN ('queued', 'running') GROUP BY status"
+        ).fetchall())
+        counts = {"queued": 0, "running": 0}
+        counts.update(dict(rows))
+        return counts
+
+    async def prune(self, history_size: int) -> int:
+        def work(conn):
+            cursor = conn.execute(
+                "DELETE FROM triage_jobs WHERE analysis_id IN ("
+                "SELECT analysis_id FROM triage_jobs WHERE finished_at IS NOT NULL "
+                "ORDER BY finished_at DESC LIMIT -1 OFFSET ?)",
+                (history_size,)
+            )
+            conn.execute(
+                "DELETE FROM triage_checkpoints WHERE analysis_id NOT IN (SELECT analysis_id FROM triage_jobs)"
+            )
+            return cursor.rowcount
+        return await self._transaction(work)
+
+    async def save_checkpoint(self, analysis_id: str, stage: str, value: str):
+        def work(conn):
+            conn.execute(
+                "INSERT OR REPLACE INTO triage_checkpoints (analysis_id, stage, value, created_at) VALUES (?, ?, ?, ?)",
+                (analysis_id, stage, value, time.time())
+            )
+        await self._transaction(work)
+
+    async def get_checkpoints(self, analysis_id: str) -> Dict[str, str]:
+        rows = await self._read(lambda conn: conn.execute(
+            "SELECT stage, value FROM triage_checkpoints WHERE analysis_id = ?", (analysis_id,)
+        ).fetchall())
+        return dict(rows)
+
+    async def requeue_failed(self, analysis_id: str, rank: int) -> Optional[TriageJob]:
+        def work(conn):
+            job = self._load(conn, analysis_id)
+            if not job or not self._resume_update(job):
+                return None
+            # 重新排到同優先順序的最後面
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM triage_jobs").fetchone()[0]
+            conn.execute("UPDATE triage_jobs SET rank = ?, seq = ? WHERE analysis_id = ?", (rank, seq, analysis_id))
+            self._save(conn, job)
+            return job
+        return await self._transaction(work)
+
+    async def close(self):
+        await self._read(lambda conn: conn.close())
+
+
+class RedisJobStore(JobStore):
+    """
+    Job store on a Redis-compatible server (Redis, Valkey, Memorystore) shared by every instance.
+    Job JSON lives in <prefix>:job:<id>; queued ids in a sorted set ordered by priority and arrival,
+    running ids in a sorted set scored by lease expiry. ZPOPMIN hands each job to a single claimer.
+    """
+
+    backend = "redis"
+    # 排序分數：rank * RANK_SCALE + 序號
+    RANK_SCALE = 10 ** 12
+    MAX_WATCH_RETRIES = 5
+
+    # 原子地從佇列取出一個 job 並登記 lease，避免兩個 instance 拿到同一個 job
+    CLAIM_SCRIPT = """
+    local popped = redis.call('ZPOPMIN', KEYS[1])
+    if #popped == 0 then return false end
+    redis.call('ZADD', KEYS[2], ARGV[1], popped[1])
+    return popped[1]
+    """
+
+    # single-flight key 只在仍指向這個 job 時移除（新的 job 可能已經用同一個 key 登記）
+    FORGET_FLIGHT_SCRIPT = """
+    if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+        return redis.call('HDEL', KEYS[1], ARGV[1])
+    end
+    return 0
+    """
+
+    def __init__(self, client, prefix: str = "bug-triage"):
+        self.client = client
+        self.prefix = prefix
+        self.queue_key = f"{prefix}:queue"
+        self.lease_key = f"{prefix}:leases"
+        self.score_key = f"{prefix}:scores"
+        self.flight_key = f"{prefix}:flight"
+        self.history_key = f"{prefix}:history"
+        self.seq_key = f"{prefix}:seq"
+        self._claim = client.register_script(self.CLAIM_SCRIPT)
+        self._forget_flight = client.register_script(self.FORGET_FLIGHT_SCRIPT)
+        from redis.exceptions import WatchError
+        self._watch_error = WatchError
+
+    @classmethod
+    def from_url(cls, url: str, prefix: str = "bug-triage") -> "RedisJobStore":
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError:
+            raise ConfigurationError("JOB_STORE_BACKEND=redis requires the redis package (pip install redis)")
+        return cls(redis_asyncio.from_url(url, decode_responses=True), prefix)
+
+    def _job_key(self, analysis_id: str) -> str:
+        return f"{self.prefix}:job:{analysis_id}"
+
+    def _checkpoint_key(self, analysis_id: str) -> str:
+        return f"{self.prefix}:checkpoints:{analysis_id}"
+
+    async def _update(self, analysis_id: str, mutate: Callable[[TriageJob], object]) -> Optional[TriageJob]:
+        """
+        Read-modify-write a job under WATCH. mutate edits the stored job in place, returns a
+        replacement job to write instead, or False to leave it untouched.
+        Returns the written job, or None when it does not exist or mutate declined.
+        """
+        key = self._job_key(analysis_id)
+        for _ in range(self.MAX_WATCH_RETRIES):
+            async with self.client.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch(key)
+                    raw = await pipe.get(key)
+                    if raw is None:
+                        return None
+                    job = TriageJob.model_validate_json(raw)
+                    replacement = mutate(job)
+                    if replacement is False:
+                        return None
+                    if isinstance(replacement, TriageJob):
+                        job = replacement
+                    pipe.multi()
+                    pipe.set(key, job.model_dump_json())
+                    await pipe.execute()
+                    return job
+                except self._watch_error:
+                    continue
+        raise RuntimeError(f"Job {analysis_id} kept changing while being updated")
+
+    async def _next_score(self, rank: int) -> int:
+        return rank * self.RANK_SCALE + await self.client.incr(self.seq_key)
+
+    async def add(self, job: TriageJob, rank: int):
+        score = await self._next_score(rank)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.set(self._job_key(job.analysis_id), job.model_dump_json())
+            pipe.hset(self.score_key, job.analysis_id, score)
+            if job.flight_key:
+                pipe.hset(self.flight_key, job.flight_key, job.analysis_id)
+            pipe.zadd(self.queue_key, {job.analysis_id: score})
+            await pipe.execute()
+
+    async def get(self, analysis_id: str) -> Optional[TriageJob]:
+        raw = await self.client.get(self._job_key(analysis_id))
+        return TriageJob.model_validate_json(raw) if raw else None
+
+    async def claim(self, owner: str, lease_seconds: float) -> Optional[TriageJob]:
+        analysis_id = await self._claim(keys=[self.queue_key, self.lease_key], args=[time.time() + lease_seconds])
+        if not analysis_id:
+            return None
+
+        def mutate(job: TriageJob):
+            job.status = "running"
+            job.lease_owner = owner
+            job.attempts += 1
+            job.started_at = datetime.now()
+
+        job = await self._update(analysis_id, mutate)
+        if job is None:
+            # 資料已被清除（例如 prune），丟棄這個 id
+            await self.client.zrem(self.lease_key, analysis_id)
+        return job
+
+    async def renew(self, job: TriageJob, owner: str, lease_seconds: float) -> Optional[TriageJob]:
+        def mutate(stored: TriageJob):
+            if stored.status != "running" or stored.lease_owner != owner:
+                return False
+            stored.stage = job.stage
+
+        stored = await self._update(job.analysis_id, mutate)
+        if stored:
+            # XX：lease 已被其他 instance 收回時不要重新加入
+            await self.client.zadd(self.lease_key, {job.analysis_id: time.time() + lease_seconds}, xx=True)
+        return stored
+
+    async def finish(self, job: TriageJob, owner: str) -> bool:
+        def mutate(stored: TriageJob):
+            if stored.lease_owner != owner:
+                return False
+            merge_slack_payloads(job.additional_slack_payloads, stored.additional_slack_payloads)
+            job.attached_job_ids = list(dict.fromkeys(job.attached_job_ids + stored.attached_job_ids))
+            job.lease_owner = None
+            return job
+
+        if await self._update(job.analysis_id, mutate) is None:
+            return False
+        await self._forget_active(job)
+        await self.client.zadd(self.history_key, {job.analysis_id: time.time()})
+        return True
+
+    async def _forget_active(self, job: TriageJob):
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.lease_key, job.analysis_id)
+            pipe.zrem(self.queue_key, job.analysis_id)
+            pipe.hdel(self.score_key, job.analysis_id)
+            await pipe.execute()
+        if job.flight_key:
+            await self._forget_flight(keys=[self.flight_key], args=[job.flight_key, job.analysis_id])
+
+    async def _requeue(self, analysis_id: str):
+        score = await self.client.hget(self.score_key, analysis_id)
+        await self.client.zadd(self.queue_key, {analysis_id: float(score or 0)})
+
+    async def release(self, job: TriageJob, owner: str) -> bool:
+        def mutate(stored: TriageJob):
+            if stored.status != "running" or stored.lease_owner != owner:
+                return False
+            stored.status = "queued"
+            stored.lease_owner = None
+            stored.attempts = max(0, stored.attempts - 1)
+
+        if await self._update(job.analysis_id, mutate) is None:
+            return False
+        await self.client.zrem(self.lease_key, job.analysis_id)
+        await self._requeue(job.analysis_id)
+        return True
+
+    async def requeue_expired(self, max_attempts: int) -> List[TriageJob]:
+        jobs = []
+        for analysis_id in await self.client.zrangebyscore(self.lease_key, "-inf", time.time()):
+            # ZREM 成功的 instance 負責處理這個過期的 lease
+            if not await self.client.zrem(self.lease_key, analysis_id):
+                continue
+
+            def mutate(stored: TriageJob):
+                if stored.status != "running":
+                    return False
+                self._expired_update(stored, max_attempts)
+
+            job = await self._update(analysis_id, mutate)
+            if job is None:
+                continue
+            if job.status == "queued":
+                await self._requeue(analysis_id)
+            else:
+                await self._forget_active(job)
+                await self.client.zadd(self.history_key, {analysis_id: time.time()})
+            jobs.append(job)
+        return jobs
+
+    async def find_inflight(self, flight_key: str) -> Optional[TriageJob]:
+        analysis_id = await self.client.hget(self.flight_key, flight_key)
+        if not analysis_id:
+            return None
+        job = await self.get(analysis_id)
+        return job if job and job.status in ACTIVE_STATUSES else None
+
+    async def attach(self, primary_id: str, job: TriageJob) -> Optional[TriageJob]:
+        def mutate(primary: TriageJob):
+            if primary.status not in ACTIVE_STATUSES:
+                return False
+            self._attach_update(primary, job)
+
+        if await self._update(primary_id, mutate) is None:
+            return None
+        await self.client.set(self._job_key(job.analysis_id), job.model_dump_json())
+        await self.client.zadd(self.history_key, {job.analysis_id: time.time()})
+        return job
+
+    async def queue_position(self, analysis_id: str) -> Optional[int]:
+        rank = await self.client.zrank(self.queue_key, analysis_id)
+        return rank + 1 if rank is not None else None
+
+    async def counts(self) -> Dict[str, int]:
+        return {"queued": await self.client.zcard(self.queue_key), "running": await self.client.zcard(self.lease_key)}
+
+    async def prune(self, history_size: int) -> int:
+        overflow = await self.client.zcard(self.history_key) - history_size
+        if overflow <= 0:
+            return 0
+        analysis_ids = [analysis_id for analysis_id, _ in await self.client.zpopmin(self.history_key, overflow)]
+        if analysis_ids:
+            await self.client.delete(
+                *(self._job_key(analysis_id) for analysis_id in analysis_ids),
+                *(self._checkpoint_key(analysis_id) for analysis_id in analysis_ids)
+            )
+        return len(analysis_ids)
+
+    async def save_checkpoint(self, analysis_id: str, stage: str, value: str):
+        await self.client.hset(self._checkpoint_key(analysis_id), stage, value)
+
+    async def get_checkpoints(self, analysis_id: str) -> Dict[str, str]:
+        return await self.client.hgetall(self._checkpoint_key(analysis_id))
+
+    async def requeue_failed(self, analysis_id: str, rank: int) -> Optional[TriageJob]:
+        job = await self._update(analysis_id, lambda stored: self._resume_update(stored))
+        if job is None:
+            return None
+        score = await self._next_score(rank)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.history_key, analysis_id)
+            pipe.hset(self.score_key, analysis_id, score)
+            pipe.zadd(self.queue_key, {analysis_id: score})
+            await pipe.execute()
+        return job
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class JobCheckpoints:
+    """
+    Stage outputs saved for one analysis_id. A job that is run again (expired lease or
+    POST /bug-triage/jobs/{analysis_id}/resume) skips the stages it already completed.
+    """
+
+    def __init__(self, store: Optional[JobStore], analysis_id: str, values: Optional[Dict[str, str]] = None):
+        self.store = store
+        self.analysis_id = analysis_id
+        self.values: Dict[str, str] = dict(values or {})
+
+    def get(self, stage: str) -> Optional[str]:
+        return self.values.get(stage)
+
+    async def save(self, stage: str, value: str):
+        self.values[stage] = value
+        if self.store is None:
+            return
+        try:
+            await self.store.save_checkpoint(self.analysis_id, stage, value)
+        except Exception as e:
+            # checkpoint 寫入失敗只影響重試時能否略過這個階段
+            logger.warning(f"Failed to save checkpoint {stage} of {self.analysis_id}: {e}")
+
+
+def create_job_store(config) -> JobStore:
+    """Build the job store selected by JOB_STORE_BACKEND"""
+    backend = config.JOB_STORE_BACKEND
+    if backend == "sqlite":
+        return SQLiteJobStore(config.JOB_STORE_PATH or os.path.join(config.DATA_DIR, "job_store.sqlite3"))
+    if backend == "redis":
+        if not config.JOB_STORE_REDIS_URL:
+            raise ConfigurationError("JOB_STORE_REDIS_URL is required when JOB_STORE_BACKEND=redis")
+        return RedisJobStore.from_url(config.JOB_STORE_REDIS_URL, config.JOB_STORE_REDIS_PREFIX)
+    raise ConfigurationError(f"Unknown JOB_STORE_BACKEND: {backend}")
@@ -0,0 +1,173 @@
+"""
+JSON Extraction / Repair Utilities
+"""
+import json
+import logging
+import re
+from typing import List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from src.core.models import AnalysisResult
+
+logger = logging.getLogger(__name__)
+
+CODE_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*\n?(.*?)(?:```|$)", re.S)
+# JSON 以外的字面值（Python 風格），只在字串外替換
+BARE_LITERALS = {"None": "null", "True": "true", "False": "false"}
+BARE_WORD_PATTERN = re.compile(r"[A-Za-z_]+")
+# 每段文字最多嘗試幾個 '{' 作為物件起點（前面的說明文字可能也有大括號）
+MAX_OBJECT_STARTS = 20
+
+
+def _candidates(text: str) -> List[str]:
+    """Text blocks that may hold the JSON object: fenced blocks first, then the whole text"""
+    candidates = [block for block in CODE_FENCE_PATTERN.findall(text) if "{" in block]
+    candidates.append(text)
+    return candidates
+
+
+def _scan_object(text: str, start: int) -> str:
+    """
+    Cut the JSON object starting at text[start] ('{'), repairing on the way:
+    trailing commas are dropped, bare None/True/False become JSON literals, raw newlines inside strings
+    are kept (parsed with strict=False). An unterminated object is closed after its last complete member.
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+    # 最後一個完整成員結束的位置與當時的括號堆疊，截斷時從這裡補上結尾
+    last_safe: Optional[Tuple[int, List[str]]] = None
+    index = start
+    length = len(text)
+
+    while index < length:
+        char = text[index]
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            index += 1
+            continue
+
+        if char == '"':
+            in_string = True
+            out.append(char)
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            out.append(char)
+        elif char in "}]":
+            # 移除結尾多餘的逗號
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if stack:
+                stack.pop()
+            out.append(char)
+            if not stack:
+                return "".join(out)
+            last_safe = (len(out), list(stack))
+        elif char == ",":
+            last_safe = (len(out), list(stack))
+            out.append(char)
+        elif char.isascii() and (char.isalpha() or char == "_"):
+            # 只處理 ASCII 的裸字；中文等非 ASCII 文字當作一般字元
+            word = BARE_WORD_PATTERN.match(text, index).group(0)
+            out.append(BARE_LITERALS.get(word, word))
+            index += len(word)
+            continue
+        else:
+            out.append(char)
+        index += 1
+
+    # 物件沒有結束（輸出被截斷）：先嘗試補上字串與括號，不行就退回最後一個完整成員
+    closing = ('"' if in_string else "") + "".join(reversed(stack))
+    attempt = "".join(out) + closing
+    try:
+        json.loads(attempt, strict=False)
+        return attempt
+    except json.JSONDecodeError:
+        pass
+    if last_safe:
+        position, safe_stack = last_safe
+        return "".join(out[:position]) + "".join(reversed(safe_stack))
+    return attempt
+
+
+def extract_json_objects(text: Optional[str]) -> List[dict]:
+    """
+    Find and parse every JSON object in model output, in order: code fences, surrounding prose,
+    trailing commas, Python literals and truncated objects are tolerated
+    """
+    if not text:
+        return []
+    decoder = json.JSONDecoder(strict=False)
+    objects: List[dict] = []
+    seen = set()
+
+    def add(data):
+        # 程式碼區塊的物件在整段文字中會再出現一次
+        key = json.dumps(data, sort_keys=True, ensure_ascii=False)
+        if key not in seen:
+            seen.add(key)
+            objects.append(data)
+
+    for candidate in _candidates(text):
+        start = candidate.find("{")
+        tries = 0
+        while start != -1 and tries < MAX_OBJECT_STARTS:
+            tries += 1
+            try:
+                # raw_decode 容許物件後面還有其他文字
+                data, end = decoder.raw_decode(candidate, start)
+                if isinstance(data, dict):
+                    add(data)
+                    # 跳過這個物件內層的大括號
+                    start = candidate.find("{", end)
+                    continue
+            except json.JSONDecodeError:
+                pass
+            try:
+                data = json.loads(_scan_object(candidate, start), strict=False)
+                if isinstance(data, dict) and data:
+                    add(data)
+            except json.JSONDecodeError:
+                pass
+            start = candidate.find("{", start + 1)
+    return objects
+
+
+def extract_json_object(text: Optional[str]) -> Optional[dict]:
+    """First JSON object in model output (see extract_json_objects)"""
+    objects = extract_json_objects(text)
+    return objects[0] if objects else None
+
+
+def repair_analysis_output(text: Optional[str]) -> Optional[str]:
+    """
+    Extract the analysis JSON from Claude output: every JSON object found is validated against
+    AnalysisResult in order (prose before the result may quote other JSON); returns the first valid one
+    as normalized JSON text, or None when the required fields cannot be recovered
+    """
+    objects = extract_json_objects(text)
+    if not objects:
+        return None
+    missing: List[str] = []
+    for data in objects:
+        try:
+            analysis = AnalysisResult.model_validate(data)
+        except ValidationError as e:
+            missing = missing or [".".join(str(loc) for loc in error["loc"]) for error in e.errors()]
+            continue
+        return json.dumps(analysis.model_dump(), ensure_ascii=False, indent=2)
+    logger.info(
+        f"[repair_analysis_output] {len(objects)} JSON objects found but none is a valid analysis "
+        f"(first one is missing or has invalid fields: {missing})"
+    )
+    return None
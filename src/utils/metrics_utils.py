@@ -0,0 +1,224 @@
+"""
+Metrics / Stage Timing Utilities
+"""
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 目前處理中的 analysis_id / stage，GKEFormatter 會附加到每一筆 log
+current_analysis_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("analysis_id", default=None)
+current_stage: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("stage", default=None)
+
+# stage_timer 開始新 stage 時通知 (analysis_id, stage)，例如記錄到 job store
+_stage_listeners: List[Callable[[str, str], None]] = []
+
+# 分析流程的秒數分布：git 準備幾秒，Claude 分析數分鐘
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 900, 1800)
+
+LabelValues = Tuple[str, ...]
+# collector 回傳 (metric name, type, help, [(sample name, labels, value)])
+Sample = Tuple[str, Dict[str, str], float]
+Family = Tuple[str, str, str, List[Sample]]
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> List[Family]:
+        with self._lock:
+            samples = [(self.name, dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+        return [(self.name, "counter", self.help_text, samples)]
+
+
+class Histogram:
+    """Histogram with fixed buckets and labels"""
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DURATION_BUCKETS
+    ):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (bucket counts, sum, count)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def collect(self) -> List[Family]:
+        samples: List[Sample] = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                labels = dict(zip(self.labelnames, key))
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, bucket_count))
+                samples.append((f"{self.name}_bucket", {**labels, "le": "+Inf"}, count))
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, count))
+        return [(self.name, "histogram", self.help_text, samples)]
+
+
+class MetricsRegistry:
+    """Process-wide metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], List[Family]]] = []
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets=DURATION_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[Family]]):
+        """Register a callback producing gauges / counters from other components' state at scrape time"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        families: List[Family] = []
+        for metric in self._metrics:
+            families.extend(metric.collect())
+        for collector in self._collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                logger.warning(f"[metrics] collector {getattr(collector, '__name__', collector)} failed: {e}")
+
+        lines = []
+        for name, metric_type, help_text, samples in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+stage_duration = metrics_registry.histogram(
+    "bug_triage_stage_duration_seconds", "Duration of each bug triage stage", ("stage", "outcome")
+)
+job_queue_wait = metrics_registry.histogram(
+    "bug_triage_job_queue_wait_seconds", "Time jobs spent waiting in the queue"
+)
+jobs_total = metrics_registry.counter("bug_triage_jobs_total", "Finished analysis jobs", ("status",))
+claude_calls_total = metrics_registry.counter("bug_triage_claude_calls_total", "Claude CLI calls", ("call", "outcome"))
+claude_tokens_total = metrics_registry.counter(
+    "bug_triage_claude_tokens_total", "Tokens reported by Claude result events", ("call", "type")
+)
+claude_cost_usd_total = metrics_registry.counter(
+    "bug_triage_claude_cost_usd_total", "Cost reported by Claude result events", ("call",)
+)
+claude_turns_total = metrics_registry.counter("bug_triage_claude_turns_total", "Agent turns reported by Claude", ("call",))
+
+
+def add_stage_listener(listener: Callable[[str, str], None]):
+    """Call listener(analysis_id, stage) whenever a stage starts inside a job"""
+    _stage_listeners.append(listener)
+
+
+@contextmanager
+def stage_timer(stage: str, **log_fields) -> Iterator[dict]:
+    """
+    Time a pipeline stage: observes bug_triage_stage_duration_seconds and logs the duration with
+    structured fields. Callers may add fields to the yielded dict (e.g. cache hit, sizes).
+    """
+    fields = dict(log_fields)
+    token = current_stage.set(stage)
+    analysis_id = current_analysis_id.get()
+    if analysis_id:
+        for listener in _stage_listeners:
+            try:
+                listener(analysis_id, stage)
+            except Exception as e:
+                logger.warning(f"[metrics] stage listener failed: {e}")
+    start = time.monotonic()
+    outcome = "ok"
+    try:
+        yield fields
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        duration = time.monotonic() - start
+        current_stage.reset(token)
+        outcome = fields.pop("outcome", outcome)
+        stage_duration.observe(duration, stage=stage, outcome=outcome)
+        logger.info(
+            f"[stage] {stage} {outcome} in {duration:.2f}s",
+            extra={"metrics": {"stage": stage, "outcome": outcome, "duration_seconds": round(duration, 3), **fields}}
+        )
+
+
+def record_claude_usage(call: str, result_event: Optional[dict]) -> dict:
+    """Count tokens / cost / turns from a Claude `result` event; returns the numbers for logging"""
+    if not result_event:
+        return {}
+    usage = result_event.get("usage") or {}
+    numbers = {
+        "input_tokens": usage.get("input_tokens") or 0,
+        "output_tokens": usage.get("output_tokens") or 0,
+        "cache_read_input_tokens": usage.get("cache_read_input_tokens") or 0,
+        "cache_creation_input_tokens": usage.get("cache_creation_input_tokens") or 0,
+    }
+    for token_type, value in numbers.items():
+        if value:
+            claude_tokens_total.inc(value, call=call, type=token_type.replace("_tokens", ""))
+    cost = result_event.get("total_cost_usd") or result_event.get("cost_usd") or 0
+    if cost:
+        claude_cost_usd_total.inc(cost, call=call)
+    turns = result_event.get("num_turns") or 0
+    if turns:
+        claude_turns_total.inc(turns, call=call)
+    return {**numbers, "cost_usd": cost, "num_turns": turns, "duration_api_ms": result_event.get("duration_api_ms")}
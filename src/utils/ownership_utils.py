@@ -0,0 +1,294 @@
+"""
+Git Blame / Ownership Cache Utilities
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from src.utils.git_utils import GitUtils
+
+logger = logging.getLogger(__name__)
+
+
+def parse_blame_porcelain(output: str) -> Tuple[List[Tuple[int, int, str]], Dict[str, dict]]:
+    """
+    Parse `git blame --porcelain` output into hunks (start line, line count, commit)
+    and commit metadata (author, author_mail, author_time, summary)
+    """
+    hunks = []
+    commits: Dict[str, dict] = {}
+    current = None
+    for line in output.splitlines():
+        if line.startswith('\t'):
+            continue
+        parts = line.split(' ')
+        if len(parts) >= 3 and len(parts[0]) == 40 and parts[1].isdigit() and parts[2].isdigit():
+            current = parts[0]
+            commits.setdefault(current, {})
+            # 只有 hunk 的第一行帶有行數
+            if len(parts) == 4 and parts[3].isdigit():
+                hunks.append((int(parts[2]), int(parts[3]), current))
+            continue
+        if current is None:
+            continue
+        key, _, value = line.partition(' ')
+        if key == 'author':
+            commits[current]['author'] = value
+        elif key == 'author-mail':
+            commits[current]['author_mail'] = value.strip('<>')
+        elif key == 'author-time' and value.isdigit():
+            commits[current]['author_time'] = int(value)
+        elif key == 'summary':
+            commits[current]['summary'] = value
+    return hunks, commits
+
+
+class OwnershipCache:
+    """
+    SQLite cache of git blame per file per deployed commit.
+    When the deployed commit moves to a new prod tag, blame of files untouched between the two tags is
+    carried over and only the changed files are blamed again.
+    """
+
+    def __init__(self, git_utils: GitUtils, db_path: str, max_commits: int = 5):
+        self.git_utils = git_utils
+        self.db_path = db_path
+        self.max_commits = max_commits
+        self._lock = threading.Lock()
+        self._blame_locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS blame_files (
+                commit_hash TEXT NOT NULL,
+                path TEXT NOT NULL,
+                blamed_at REAL NOT NULL,
+                PRIMARY KEY (commit_hash, path)
+            );
+            CREATE TABLE IF NOT EXISTS blame_hunks (
+                commit_hash TEXT NOT NULL,
+                path TEXT NOT NULL,
+                start_line INTEGER NOT NULL,
+                line_count INTEGER NOT NULL,
+                blame_commit TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_blame_hunks_file ON blame_hunks (commit_hash, path, start_line);
+            CREATE TABLE IF NOT EXISTS blame_commits (
+                blame_commit TEXT PRIMARY KEY,
+                author TEXT,
+                author_mail TEXT,
+                author_time INTEGER,
+                summary TEXT
+            );
+            """
+        )
+        self._conn.commit()
+
+    def _is_cached(self, commit_hash: str, path: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM blame_files WHERE commit_hash = ? AND path = ?", (commit_hash, path)
+            ).fetchone()
+        return row is not None
+
+    async def ensure_blamed(self, commit_hash: str, path: str) -> bool:
+        """Blame a file at a commit unless cached; returns False when git blame failed"""
+        if await asyncio.to_thread(self._is_cached, commit_hash, path):
+            return True
+        blame_lock = self._blame_locks.setdefault((commit_hash, path), asyncio.Lock())
+        async with blame_lock:
+            if await asyncio.to_thread(self._is_cached, commit_hash, path):
+                return True
+            try:
+                result = await self.git_utils.run_git(['blame', '--porcelain', '-w', commit_hash, '--', path])
+                hunks, commits = parse_blame_porcelain(result.stdout)
+                await asyncio.to_thread(self._store, commit_hash, path, hunks, commits)
+                return True
+            except subprocess.CalledProcessError as e:
+                logger.warning(f"[OwnershipCache] git blame failed for {path}@{commit_hash[:12]}: {e.stderr}")
+                return False
+            finally:
+                self._blame_locks.pop((commit_hash, path), None)
+
+    def _store(self, commit_hash: str, path: str, hunks: List[Tuple[int, int, str]], commits: Dict[str, dict]):
+        with self._lock:
+            self._conn.execute("DELETE FROM blame_hunks WHERE commit_hash = ? AND path = ?", (commit_hash, path))
+            self._conn.executemany(
+                "INSERT INTO blame_hunks (commit_hash, path, start_line, line_count, blame_commit) VALUES (?, ?, ?, ?, ?)",
+                [(commit_hash, path, start, count, blame_commit) for start, count, blame_commit in hunks]
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO blame_commits (blame_commit, author, author_mail, author_time, summary) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (sha, meta.get('author'), meta.get('author_mail'), meta.get('author_time'), meta.get('summary'))
+                    for sha, meta in commits.items() if meta
+                ]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO blame_files (commit_hash, path, blamed_at) VALUES (?, ?, ?)",
+                (commit_hash, path, time.time())
+            )
+            self._conn.commit()
+
+    async def advance(self, previous_commit: str, commit_hash: str, max_reblame: int = 50) -> int:
+        """
+        Carry blame over from the previous deployed commit: files unchanged between the two commits are
+        copied, changed files that were cached are blamed again (up to max_reblame). Returns files copied.
+        """
+        if not previous_commit or previous_commit == commit_hash:
+            return 0
+        cached_paths = await asyncio.to_thread(self._cached_paths, previous_commit)
+        if not cached_paths:
+            return 0
+
+        result = await self.git_utils.run_git(['diff', '--name-only', previous_commit, commit_hash])
+        changed = set(result.stdout.splitlines())
+        unchanged = [path for path in cached_paths if path not in changed]
+        await asyncio.to_thread(self._copy_blame, previous_commit, commit_hash, unchanged)
+
+        # 常被查詢的檔案有變動時先重新 blame，分析時就不用等待
+        reblame = [path for path in cached_paths if path in changed][:max_reblame]
+        for path in reblame:
+            await self.ensure_blamed(commit_hash, path)
+        logger.info(
+            f"[OwnershipCache] {previous_commit[:12]} -> {commit_hash[:12]}: "
+            f"{len(unchanged)} files carried over, {len(reblame)} re-blamed"
+        )
+        return len(unchanged)
+
+    def _cached_paths(self, commit_hash: str) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT path FROM blame_files WHERE commit_hash = ?", (commit_hash,)
+            )]
+
+    def _copy_blame(self, previous_commit: str, commit_hash: str, paths: List[str]):
+        """Copy the blame of files unchanged since previous_commit to commit_hash"""
+        now = time.time()
+        with self._lock:
+            for path in paths:
+                self._conn.execute("DELETE FROM blame_hunks WHERE commit_hash = ? AND path = ?", (commit_hash, path))
+                self._conn.execute(
+                    "INSERT INTO blame_hunks (commit_hash, path, start_line, line_count, blame_commit) "
+                    "SELECT ?, path, start_line, line_count, blame_commit FROM blame_hunks "
+                    "WHERE commit_hash = ? AND path = ?",
+                    (commit_hash, previous_commit, path)
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO blame_files (commit_hash, path, blamed_at) VALUES (?, ?, ?)",
+                    (commit_hash, path, now)
+                )
+            self._prune()
+            self._conn.commit()
+
+    def _prune(self):
+        """Keep blame of the latest max_commits commits only"""
+        stale = [row[0] for row in self._conn.execute(
+            "SELECT commit_hash FROM blame_files GROUP BY commit_hash ORDER BY MAX(blamed_at) DESC LIMIT -1 OFFSET ?",
+            (self.max_commits,)
+        )]
+        for commit_hash in stale:
+            self._conn.execute("DELETE FROM blame_hunks WHERE commit_hash = ?", (commit_hash,))
+            self._conn.execute("DELETE FROM blame_files WHERE commit_hash = ?", (commit_hash,))
+        if stale:
+            self._conn.execute(
+                "DELETE FROM blame_commits WHERE blame_commit NOT IN (SELECT DISTINCT blame_commit FROM blame_hunks)"
+            )
+
+    async def lookup(
+        self,
+        commit_hash: str,
+        frames: List[Tuple[str, int]],
+        window: int = 5,
+        recent_days: int = 30,
+        max_owners: int = 3
+    ) -> dict:
+        """
+        Candidate suspect commits (recent changes within `window` lines of each frame) and
+        owners (authors of the most lines) of the files in the stack trace
+        """
+        paths = list(dict.fromkeys(path for path, _ in frames))
+        await asyncio.gather(*(self.ensure_blamed(commit_hash, path) for path in paths))
+        return await asyncio.to_thread(
+            self._query_ownership, commit_hash, frames, paths, window, recent_days, max_owners
+        )
+
+    def _query_ownership(
+        self,
+        commit_hash: str,
+        frames: List[Tuple[str, int]],
+        paths: List[str],
+        window: int,
+        recent_days: int,
+        max_owners: int
+    ) -> dict:
+        since = time.time() - recent_days * 86400
+
+        suspects: Dict[str, dict] = {}
+        owner_lines: Counter = Counter()
+        owner_mails: Dict[str, str] = {}
+        with self._lock:
+            for path, line in frames:
+                rows = self._conn.execute(
+                    "SELECT h.blame_commit, c.author, c.author_mail, c.author_time, c.summary FROM blame_hunks h "
+                    "JOIN blame_commits c ON c.blame_commit = h.blame_commit "
+                    "WHERE h.commit_hash = ? AND h.path = ? AND h.start_line <= ? AND h.start_line + h.line_count > ?",
+                    (commit_hash, path, line + window, line - window)
+                ).fetchall()
+                for blame_commit, author, author_mail, author_time, summary in rows:
+                    if not author_time or author_time < since or blame_commit.startswith('0000000'):
+                        continue
+                    suspect = suspects.setdefault(blame_commit, {
+                        "commit": blame_commit,
+                        "author": author,
+                        "author_mail": author_mail,
+                        "author_time": author_time,
+                        "summary": summary,
+                        "locations": [],
+                    })
+                    suspect["locations"].append(f"{path}:{line}")
+
+            for path in paths:
+                for author, author_mail, lines in self._conn.execute(
+                    "SELECT c.author, c.author_mail, SUM(h.line_count) FROM blame_hunks h "
+                    "JOIN blame_commits c ON c.blame_commit = h.blame_commit "
+                    "WHERE h.commit_hash = ? AND h.path = ? GROUP BY c.author, c.author_mail",
+                    (commit_hash, path)
+                ):
+                    owner_lines[author] += lines
+                    owner_mails.setdefault(author, author_mail)
+
+        return {
+            "suspect_commits": sorted(suspects.values(), key=lambda item: item["author_time"], reverse=True),
+            "owners": [
+                {"author": author, "author_mail": owner_mails.get(author), "lines": lines}
+                for author, lines in owner_lines.most_common(max_owners)
+            ],
+        }
+
+
+def format_ownership_context(ownership: dict, max_suspects: int = 5) -> Optional[str]:
+    """Render an ownership lookup as prompt context"""
+    lines = []
+    if ownership.get("suspect_commits"):
+        lines.append("近期修改過 stack trace 附近程式碼的 commit（可作為 suspect_commit 候選）：")
+        for suspect in ownership["suspect_commits"][:max_suspects]:
+            changed_at = time.strftime('%Y-%m-%d', time.localtime(suspect["author_time"]))
+            lines.append(
+                f"- {suspect['commit']} {suspect['author']} <{suspect['author_mail']}> {changed_at} "
+                f"\"{suspect['summary']}\"（{', '.join(suspect['locations'])}）"
+            )
+    if ownership.get("owners"):
+        lines.append("相關檔案目前程式碼行數最多的作者（可作為 recommended_person 候選）：")
+        for owner in ownership["owners"]:
+            lines.append(f"- {owner['author']} <{owner['author_mail']}>：{owner['lines']} 行")
+    return "\n".join(lines) if lines else None
@@ -0,0 +1,231 @@
+"""
+Prompt Building Utilities
+"""
+import logging
+import os
+import re
+import threading
+import uuid
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 中日韓文字大約一個字一個 token，其他文字大約 4 個字元一個 token
+CJK_PATTERN = re.compile(r'[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+# 連續重複區塊最多偵測到幾行為一組（例如遞迴的 Python frame 一組是兩行）
+MAX_REPEAT_BLOCK_LINES = 4
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Rough token count without a tokenizer"""
+    if not text:
+        return 0
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def dedupe_lines(text: str) -> str:
+    """Collapse consecutive repeated lines or blocks of up to MAX_REPEAT_BLOCK_LINES lines"""
+    lines = text.splitlines()
+    result: List[str] = []
+    index = 0
+    while index < len(lines):
+        collapsed = False
+        for size in range(1, MAX_REPEAT_BLOCK_LINES + 1):
+            block = lines[index:index + size]
+            if len(block) < size:
+                break
+            repeats = 0
+            cursor = index + size
+            while lines[cursor:cursor + size] == block:
+                repeats += 1
+                cursor += size
+            if repeats:
+                result.extend(block)
+                result.append(f"... (以上 {size} 行重複 {repeats} 次)")
+                index = cursor
+                collapsed = True
+                break
+        if not collapsed:
+            result.append(lines[index])
+            index += 1
+    return "\n".join(result)
+
+
+def truncate_middle(text: str, max_tokens: int, head_ratio: float = 0.3) -> str:
+    """
+    Keep the head and tail of a long text and drop the middle.
+    The tail gets the larger share because logs usually end with the exception.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    lines = text.splitlines()
+    head_budget = int(max_tokens * head_ratio)
+    tail_budget = max_tokens - head_budget
+
+    head: List[str] = []
+    used = 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > head_budget:
+            break
+        head.append(line)
+        used += cost
+
+    tail: List[str] = []
+    used = 0
+    for line in reversed(lines[len(head):]):
+        cost = estimate_tokens(line) + 1
+        if used + cost > tail_budget:
+            break
+        tail.append(line)
+        used += cost
+    tail.reverse()
+
+    omitted = len(lines) - len(head) - len(tail)
+    if not head and not tail:
+        # 單行超長（例如壓縮過的 JSON），改以字元切
+        chars = max_tokens * 4
+        head_chars = int(chars * head_ratio)
+        return f"{text[:head_chars]}\n... (中間省略 {len(text) - chars} 字元) ...\n{text[-(chars - head_chars):]}"
+    return "\n".join(head + [f"... (中間省略 {omitted} 行) ..."] + tail)
+
+
+def compact_text(text: Optional[str], max_tokens: int) -> str:
+    """Deduplicate repeated lines, then truncate the middle to fit max_tokens"""
+    if not text:
+        return ""
+    return truncate_middle(dedupe_lines(text), max_tokens)
+
+
+class PromptMetrics:
+    """Process-wide counters of prompt sizes before and after compaction"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.prompts = 0
+        self.compacted_prompts = 0
+        self.raw_bytes = 0
+        self.final_bytes = 0
+        self.estimated_tokens = 0
+        self.payload_files = 0
+
+    def record(self, raw_bytes: int, final_bytes: int, tokens: int, payload_file: bool):
+        with self._lock:
+            self.prompts += 1
+            self.compacted_prompts += 1 if final_bytes < raw_bytes else 0
+            self.raw_bytes += raw_bytes
+            self.final_bytes += final_bytes
+            self.estimated_tokens += tokens
+            self.payload_files += 1 if payload_file else 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "prompts": self.prompts,
+                "compacted_prompts": self.compacted_prompts,
+                "raw_bytes": self.raw_bytes,
+                "final_bytes": self.final_bytes,
+                "bytes_saved": self.raw_bytes - self.final_bytes,
+                "estimated_tokens": self.estimated_tokens,
+                "payload_files": self.payload_files,
+            }
+
+
+prompt_metrics = PromptMetrics()
+
+
+class PromptBuilder:
+    """
+    Assemble a prompt from fixed instructions and size-budgeted payload sections.
+    Payload sections are deduplicated and middle-truncated to their token budget; when a section
+    had to be truncated, the full text can be written to a payload file that the prompt points to.
+    The finished prompt is meant to be passed to claude through stdin rather than argv.
+    """
+
+    def __init__(self, name: str, payload_dir: Optional[str] = None):
+        self.name = name
+        self.payload_dir = payload_dir
+        self.parts: List[str] = []
+        self.raw_bytes = 0
+        self.payload_files: List[str] = []
+        # (section, raw tokens, final tokens)
+        self.sections: List[Tuple[str, int, int]] = []
+
+    def add(self, text: Optional[str]) -> 'PromptBuilder':
+        """Append instruction text as is"""
+        if text:
+            self.parts.append(text)
+            self.raw_bytes += len(text.encode('utf-8'))
+        return self
+
+    def add_section(
+        self,
+        section: str,
+        text: Optional[str],
+        max_tokens: int,
+        header: Optional[str] = None,
+        keep_full_text: bool = False,
+        full_text: Optional[str] = None
+    ) -> str:
+        """
+        Append a compacted payload under an optional header; returns the compacted text.
+        keep_full_text writes the original to a payload file when it had to be truncated.
+        full_text is the original the text was derived from (e.g. the raw error behind a compact stack trace);
+        with keep_full_text it is written to the payload file whenever it differs from what the prompt shows.
+        """
+        if not text:
+            return ""
+        compacted = compact_text(text, max_tokens)
+        raw_tokens = estimate_tokens(text)
+        self.sections.append((section, raw_tokens, estimate_tokens(compacted)))
+        self.raw_bytes += len(text.encode('utf-8')) + (len(header.encode('utf-8')) + 1 if header else 0)
+
+        body = compacted
+        full_text = full_text or text
+        if keep_full_text and compacted != full_text and self.payload_dir:
+            payload_path = self._write_payload(section, full_text)
+            if payload_path:
+                body = (
+                    f"{compacted}\n（原始完整內容共 {estimate_tokens(full_text)} tokens，已存放在 {payload_path}，"
+                    f"包含上面省略的訊息行、library frame 與 ID 等細節，必要時請讀取）"
+                )
+        self.parts.append(f"{header}\n{body}" if header else body)
+        return compacted
+
+    def _write_payload(self, section: str, text: str) -> Optional[str]:
+        try:
+            os.makedirs(self.payload_dir, exist_ok=True)
+            payload_path = os.path.abspath(os.path.join(self.payload_dir, f"{self.name}_{section}_{uuid.uuid4().hex[:12]}.txt"))
+            with open(payload_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            self.payload_files.append(payload_path)
+            return payload_path
+        except OSError as e:
+            logger.warning(f"[PromptBuilder] failed to write payload file for {section}: {e}")
+            return None
+
+    def build(self) -> str:
+        """Join the parts and record size metrics"""
+        prompt = "\n\n".join(self.parts)
+        final_bytes = len(prompt.encode('utf-8'))
+        tokens = estimate_tokens(prompt)
+        prompt_metrics.record(self.raw_bytes, final_bytes, tokens, bool(self.payload_files))
+        saved = self.raw_bytes - final_bytes
+        if saved > 0:
+            details = ", ".join(f"{section} {raw}->{final} tokens" for section, raw, final in self.sections if raw != final)
+            logger.info(
+                f"[PromptBuilder] {self.name}: {self.raw_bytes} -> {final_bytes} bytes "
+                f"(saved {saved}, ~{tokens} tokens){': ' + details if details else ''}"
+            )
+        return prompt
+
+    def cleanup(self):
+        """Remove payload files written for this prompt"""
+        for payload_path in self.payload_files:
+            try:
+                os.remove(payload_path)
+            except OSError:
+                pass
+        self.payload_files = []
@@ -0,0 +1,318 @@
+"""
+Retry Policy Utilities
+"""
+import asyncio
+import logging
+import random
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import httpx
+
+from src.core.config import Config
+from src.core.exceptions import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# 失敗分類
+TRANSIENT = "transient"            # 網路中斷、5xx、API overloaded、逾時，可重試且計入 circuit breaker
+RATE_LIMITED = "rate_limited"      # 429 / rate limit，可重試（優先採用 Retry-After）且計入 circuit breaker
+INVALID_OUTPUT = "invalid_output"  # 呼叫成功但輸出格式不符，可重試但不代表 API 異常
+FATAL = "fatal"                    # 認證失敗、參數錯誤、prompt 過長等，重試也不會成功
+
+RETRYABLE = (TRANSIENT, RATE_LIMITED, INVALID_OUTPUT)
+
+CLAUDE_RATE_LIMIT_PATTERN = re.compile(r'rate[ _]limit|\b429\b|too many requests', re.I)
+CLAUDE_FATAL_PATTERN = re.compile(
+    r'invalid api key|authentication[ _]error|\b401\b|\b403\b|permission[ _]denied|prompt is too long|'
+    r'credit balance is too low|invalid_request_error|command not found',
+    re.I
+)
+CLAUDE_TRANSIENT_PATTERN = re.compile(
+    r'overloaded|api error|connection (?:error|refused|reset|timeout)|network error|failed to connect|'
+    r'request timed out|econnreset|etimedout|socket hang up|internal server error',
+    re.I
+)
+
+
+def classify_claude_failure(
+    returncode: Optional[int] = None,
+    result_event: Optional[dict] = None,
+    output: Optional[str] = None,
+    exception: Optional[BaseException] = None
+) -> str:
+    """
+    Classify a failed Claude CLI run from the raised exception, the exit code, the stream-json
+    result event (`is_error` / `subtype`) and the tail of the output
+    """
+    if isinstance(exception, subprocess.TimeoutExpired):
+        return TRANSIENT
+    if isinstance(exception, (FileNotFoundError, PermissionError)):
+        return FATAL
+    if exception is not None and not isinstance(exception, (OSError, subprocess.SubprocessError)):
+        return TRANSIENT
+
+    result_is_error = bool(
+        result_event and (result_event.get("is_error") or str(result_event.get("subtype", "")).startswith("error"))
+    )
+    if result_event and not result_is_error:
+        # session 正常結束，只是輸出不符合格式；此時輸出內容是分析本身，不做關鍵字比對
+        return INVALID_OUTPUT
+
+    texts = [output or ""]
+    if result_event:
+        texts.append(str(result_event.get("result") or ""))
+        texts.append(str(result_event.get("error") or ""))
+    text = "\n".join(texts)
+
+    if CLAUDE_FATAL_PATTERN.search(text):
+        return FATAL
+    if CLAUDE_RATE_LIMIT_PATTERN.search(text):
+        return RATE_LIMITED
+    if CLAUDE_TRANSIENT_PATTERN.search(text):
+        return TRANSIENT
+    if result_event:
+        # error_max_turns / error_during_execution：換一次 session 可能就會成功，但不代表 API 異常
+        return INVALID_OUTPUT
+    # 沒有 result event：process 中途結束（非 0 exit code）視為暫時性錯誤
+    if returncode not in (None, 0) or not (output or "").strip():
+        return TRANSIENT
+    return INVALID_OUTPUT
+
+
+def classify_http_failure(status_code: Optional[int] = None, exception: Optional[BaseException] = None) -> str:
+    """Classify a failed HTTP call by status code or transport exception"""
+    if exception is not None:
+        return TRANSIENT if isinstance(exception, httpx.TransportError) else FATAL
+    if status_code == 429:
+        return RATE_LIMITED
+    if status_code is not None and (status_code >= 500 or status_code == 408):
+        return TRANSIENT
+    return FATAL
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive API failures and rejects calls for `reset_seconds`;
+    then lets one trial call through (half-open) and closes again when it succeeds.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.open_count = 0
+        self._trial_in_flight = False
+        # 每次放行試探呼叫時遞增，release_trial 只釋放仍屬於同一個試探呼叫的名額
+        self._trial_id = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may proceed now"""
+        return self.acquire() is not None
+
+    def acquire(self) -> Optional[int]:
+        """
+        Let a call proceed: None when it is rejected, otherwise a trial id for release_trial
+        (0 when the circuit is closed, so the call holds no trial slot)
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                self._trial_id += 1
+                return self._trial_id
+            return None
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"[CircuitBreaker:{self.name}] closed after a successful trial call")
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.open_count += 1
+                    logger.warning(
+                        f"[CircuitBreaker:{self.name}] open for {self.reset_seconds}s "
+                        f"after {self.consecutive_failures} consecutive failures"
+                    )
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def release_trial(self, trial_id: int):
+        """Free the half-open trial slot if trial `trial_id` is still in flight (it ended without an outcome)"""
+        with self._lock:
+            if trial_id and self.state == self.HALF_OPEN and self._trial_in_flight and trial_id == self._trial_id:
+                self._trial_in_flight = False
+
+    def retry_in(self) -> float:
+        """Seconds until the next trial call is allowed"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+
+class RetryPolicy:
+    """
+    Shared retry policy for one upstream (Claude CLI, GCP API):
+    failure classification decides whether to retry, delays use exponential backoff with full jitter
+    (Retry-After wins when given), retries are capped per hour across all callers, and a circuit
+    breaker rejects calls while the upstream keeps failing.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_retries: int,
+        base_delay: float,
+        max_delay: float,
+        budget_per_hour: int,
+        breaker: CircuitBreaker
+    ):
+        self.name = name
+        self.max_retries = max(0, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_per_hour = budget_per_hour
+        self.breaker = breaker
+        self._retried_at = deque()
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.budget_exhausted = 0
+        self.failures = {TRANSIENT: 0, RATE_LIMITED: 0, INVALID_OUTPUT: 0, FATAL: 0}
+
+    @property
+    def max_attempts(self) -> int:
+        return self.max_retries + 1
+
+    def check(self) -> int:
+        """
+        Raise CircuitOpenError while the circuit breaker rejects calls; returns the trial id to pass to
+        release() once the call is over
+        """
+        trial_id = self.breaker.acquire()
+        if trial_id is None:
+            raise CircuitOpenError(
+                f"{self.name} is unavailable after repeated failures, retry in {self.breaker.retry_in():.0f}s"
+            )
+        return trial_id
+
+    def record_success(self):
+        self.breaker.record_success()
+
+    def record_failure(self, failure: str):
+        """Count a failed call; only upstream failures move the circuit breaker"""
+        with self._lock:
+            self.failures[failure] = self.failures.get(failure, 0) + 1
+        if failure in (TRANSIENT, RATE_LIMITED):
+            self.breaker.record_failure()
+        else:
+            # 有回應（只是輸出不符或請求本身有誤）代表上游仍可用
+            self.breaker.record_success()
+
+    def release(self, trial_id: int):
+        """
+        Call when the call allowed by check() is over (in a finally block): a half-open trial that ended
+        without record_success / record_failure (exception, cancellation) no longer blocks later calls
+        """
+        self.breaker.release_trial(trial_id)
+
+    def should_retry(self, failure: str, attempt: int) -> bool:
+        """
+        Whether attempt number `attempt` (1-based) that failed with `failure` should be retried;
+        consumes one unit of the hourly retry budget when it should
+        """
+        if failure not in RETRYABLE or attempt >= self.max_attempts:
+            return False
+        if self.breaker.state == CircuitBreaker.OPEN:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            while self._retried_at and now - self._retried_at[0] > 3600:
+                self._retried_at.popleft()
+            if len(self._retried_at) >= self.budget_per_hour:
+                self.budget_exhausted += 1
+                logger.warning(f"[RetryPolicy:{self.name}] hourly retry budget ({self.budget_per_hour}) exhausted")
+                return False
+            self._retried_at.append(now)
+            self.retries += 1
+        return True
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Full-jitter exponential backoff for the retry after attempt `attempt` (1-based)"""
+        if retry_after is not None:
+            return min(self.max_delay, max(0.0, retry_after))
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    async def backoff(self, attempt: int, retry_after: Optional[float] = None):
+        delay = self.delay(attempt, retry_after)
+        logger.info(f"[RetryPolicy:{self.name}] retrying attempt {attempt + 1}/{self.max_attempts} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            retries_last_hour = len([t for t in self._retried_at if now - t <= 3600])
+            failures = dict(self.failures)
+        return {
+            "max_retries": self.max_retries,
+            "retries": self.retries,
+            "retries_last_hour": retries_last_hour,
+            "budget_per_hour": self.budget_per_hour,
+            "budget_exhausted": self.budget_exhausted,
+            "failures": failures,
+            "circuit": {
+                "state": self.breaker.state,
+                "consecutive_failures": self.breaker.consecutive_failures,
+                "open_count": self.breaker.open_count,
+                "retry_in_seconds": round(self.breaker.retry_in(), 1),
+            },
+        }
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After header in seconds (HTTP-date values are ignored)"""
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+claude_retry_policy = RetryPolicy(
+    "claude",
+    max_retries=Config.CLAUDE_MAX_RETRIES,
+    base_delay=Config.RETRY_BASE_DELAY_SECONDS,
+    max_delay=Config.RETRY_MAX_DELAY_SECONDS,
+    budget_per_hour=Config.CLAUDE_RETRY_BUDGET_PER_HOUR,
+    breaker=CircuitBreaker("claude", Config.CIRCUIT_BREAKER_FAILURE_THRESHOLD, Config.CIRCUIT_BREAKER_RESET_SECONDS),
+)
+gcp_retry_policy = RetryPolicy(
+    "gcp",
+    max_retries=Config.GCP_MAX_RETRIES,
+    base_delay=Config.RETRY_BASE_DELAY_SECONDS,
+    max_delay=Config.RETRY_MAX_DELAY_SECONDS,
+    budget_per_hour=Config.GCP_RETRY_BUDGET_PER_HOUR,
+    breaker=CircuitBreaker("gcp", Config.CIRCUIT_BREAKER_FAILURE_THRESHOLD, Config.CIRCUIT_BREAKER_RESET_SECONDS),
+)
@@ -0,0 +1,163 @@
+"""
+Slack Message Rendering Utilities
+"""
+import json
+import logging
+from typing import Callable, Dict, List, Optional
+
+from src.utils.json_repair_utils import extract_json_object
+
+logger = logging.getLogger(__name__)
+
+# Slack section block 的 text 上限為 3000 字元
+SECTION_TEXT_LIMIT = 3000
+
+ANALYSIS_SECTIONS = [
+    ("root_cause_analysis", "▌問題分析"),
+    ("root_cause_file_codebase", "▌codebase"),
+    ("database_status", "▌database"),
+    ("suggestion", "▌處理建議"),
+]
+
+
+def parse_analysis_json(analysis_result: str) -> Optional[dict]:
+    """Parse the analysis JSON object from Claude output (code fences / surrounding prose allowed)"""
+    return extract_json_object(analysis_result)
+
+
+def parse_user_mapping(raw_mapping: str) -> Dict[str, str]:
+    """Parse GITHUB_SLACK_USER_MAPPING ({"github_username": "slack_username"})"""
+    if not raw_mapping:
+        return {}
+    try:
+        mapping = json.loads(raw_mapping)
+    except json.JSONDecodeError as e:
+        logger.error(f"GITHUB_SLACK_USER_MAPPING is not valid JSON: {e}")
+        return {}
+    return {str(k).strip().lower(): str(v).strip() for k, v in mapping.items()} if isinstance(mapping, dict) else {}
+
+
+def is_empty_value(value) -> bool:
+    """Whether an analysis field is missing or an explicit 'None'"""
+    return value is None or str(value).strip() in ("", "None", "none", "null", "N/A")
+
+
+def _split_text(text: str, limit: int = SECTION_TEXT_LIMIT) -> List[str]:
+    """Split long text into chunks on line boundaries"""
+    chunks, current = [], ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            chunks.append(current)
+            current = ""
+        current += line
+    if current:
+        chunks.append(current)
+    return chunks or [""]
+
+
+def _section(text: str) -> List[dict]:
+    return [{"type": "section", "text": {"type": "mrkdwn", "text": chunk}} for chunk in _split_text(text)]
+
+
+def render_analysis_message(
+    analysis: dict,
+    mention_for: Callable[[str], Optional[str]],
+    github_repo_url: str,
+    feedback_url: str = ""
+) -> dict:
+    """
+    Render analysis JSON into Slack Block Kit blocks and a plain text fallback,
+    following the layout of src/prompt/slack_mcp_prompt.md.
+    mention_for maps a GitHub username to a Slack mention, or None when it cannot be mapped.
+    """
+    lines = [
+        "[目前實驗中，僅供參考]",
+        "（以下是來自 Claude Code 的 bug 分析和 Triage 參考建議）",
+    ]
+    blocks = _section("\n".join(lines))
+
+    for field, title in ANALYSIS_SECTIONS:
+        value = analysis.get(field)
+        if field == "database_status" and is_empty_value(value):
+            continue
+        content = f"*{title}*\n{'None' if is_empty_value(value) else value}"
+        lines.append(content)
+        blocks.append({"type": "divider"})
+        blocks.extend(_section(content))
+
+    triage_lines = ["*▌建議排查順序*"]
+    rank = 1
+    suspect_author = analysis.get("suspect_commit_author")
+    suspect_commit = analysis.get("suspect_commit")
+    if not is_empty_value(suspect_author):
+        mention = mention_for(str(suspect_author))
+        if mention:
+            commit_text = f"{github_repo_url}/commit/{suspect_commit}" if not is_empty_value(suspect_commit) else "（無）"
+            triage_lines.append(f"順位{rank}. {mention}")
+            triage_lines.append(f"（建議原因：系統判斷可能為 suspect commit {commit_text} 的作者）")
+            rank += 1
+
+    recommended_person = analysis.get("recommended_person")
+    if not is_empty_value(recommended_person):
+        mention = mention_for(str(recommended_person)) or str(recommended_person)
+        triage_lines.append(f"順位{rank}. {mention}")
+        triage_lines.append(f"（建議原因：系統判斷對該 module 熟悉的人，{analysis.get('recommended_reason') or ''}）")
+
+    if len(triage_lines) > 1:
+        triage_text = "\n".join(triage_lines)
+        lines.append(triage_text)
+        blocks.append({"type": "divider"})
+        blocks.extend(_section(triage_text))
+
+    if feedback_url:
+        feedback_text = f"=> 歡迎填寫 <{feedback_url}|回饋表單> 回饋此次 AI 分析結果"
+        lines.append(feedback_text)
+        blocks.append({"type": "context", "elements": [{"type": "mrkdwn", "text": feedback_text}]})
+
+    return {"text": "\n\n".join(lines), "blocks": blocks}
+
+
+def render_raw_message(analysis_result: str) -> dict:
+    """Fallback rendering when the analysis is not valid JSON"""
+    text = f"[目前實驗中，僅供參考]\n（以下是來自 Claude Code 的 bug 分析和 Triage 參考建議）\n\n{analysis_result}"
+    return {"text": text, "blocks": _section(text)}
+
+
+def _format_elapsed(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 60} 分 {seconds % 60} 秒" if seconds >= 60 else f"{seconds} 秒"
+
+
+def render_progress_message(
+    stage: str,
+    steps: List[str],
+    tool_use_count: int,
+    elapsed_seconds: float,
+    idle_seconds: float,
+    step_limit: int = 200
+) -> dict:
+    """Render the in-progress status message that is edited with chat.update while the analysis runs"""
+    header = f"⏳ *{stage}*（已執行 {_format_elapsed(elapsed_seconds)}，工具呼叫 {tool_use_count} 次）"
+    lines = [header]
+    if steps:
+        lines.append("\n".join(f"• `{step[:step_limit]}`" for step in steps))
+    if idle_seconds >= 60:
+        # 長時間沒有新的工具呼叫，可能卡住
+        lines.append(f"_最後一次工具呼叫在 {_format_elapsed(idle_seconds)}前_")
+    text = "\n".join(lines)
+    return {"text": text, "blocks": _section(text)}
+
+
+def render_progress_done_message(success: bool, tool_use_count: int, elapsed_seconds: float, detail: str = "") -> dict:
+    """Render the final state of the progress message"""
+    status = "✅ 分析完成，結果如下" if success else "❌ 分析失敗"
+    text = f"{status}（耗時 {_format_elapsed(elapsed_seconds)}，工具呼叫 {tool_use_count} 次）"
+    if detail:
+        text += f"\n{detail}"
+    return {"text": text, "blocks": _section(text)}
@@ -0,0 +1,209 @@
+"""
+Stack Trace Parsing Utilities
+"""
+import re
+from typing import List, Optional
+
+# 常見語言的 stack frame 格式
+FRAME_PATTERNS = [
+    # Python: File "/app/foo.py", line 12, in handler
+    ("python", re.compile(r'File "(?P<file>[^"]+)", line (?P<line>\d+), in (?P<func>[\w<>.]+)')),
+    # Java: at com.foo.Bar.method(Bar.java:42)
+    ("java", re.compile(
+        r'at (?P<func>[\w$.<>]+)\((?P<file>[\w$.-]+\.(?:java|kt|scala)):(?P<line>\d+)\)'
+    )),
+    # JavaScript: at handler (/app/foo.js:12:5) / at /app/foo.js:12:5
+    ("javascript", re.compile(
+        r'at (?:(?P<func>[\w$.<>\[\] ]+?) \()?(?P<file>[^\s()]+\.(?:js|jsx|ts|tsx|mjs|cjs)):(?P<line>\d+)(?::\d+)?\)?'
+    )),
+    # Go: /app/foo.go:12 +0x1d（function 在前一行）
+    ("go", re.compile(r'(?P<file>[\w./-]+\.go):(?P<line>\d+)')),
+]
+
+# 可能是 frame 的行才逐一比對 FRAME_PATTERNS，一般 log 行只需跑這一個 regex
+FRAME_HINT_PATTERN = re.compile(r'File "|at |\.go:')
+
+# Go 的 function 行：main.(*Server).handle(0xc000010000, ...)
+GO_FUNC_PATTERN = re.compile(r'^\s*(?P<func>[\w./*()\[\]-]+)\(.*\)\s*$')
+
+# 第三方套件 / 標準函式庫的 frame，不對應到專案程式碼
+LIBRARY_MARKERS = (
+    'site-packages/', 'dist-packages/', 'node_modules/', '/usr/lib/', '/usr/local/lib/', '/usr/local/go/src/',
+    '<frozen', 'node:', '/go/pkg/mod/', 'webpack/bootstrap',
+)
+# 舊版 Node.js 的內部模組沒有 node: 前綴（at internal/main/run_main_module.js:17:47），只比對開頭，
+# 避免把專案內的 internal/ 目錄（Go 的 /app/internal/...）當成 library
+LIBRARY_PATH_PREFIXES = ('internal/',)
+LIBRARY_JAVA_PACKAGES = ('java.', 'javax.', 'jdk.', 'sun.', 'kotlin.', 'scala.', 'org.springframework.', 'org.apache.')
+
+# Exception 標題：ValueError: msg / java.lang.NullPointerException / TypeError: x / panic: y
+HEADLINE_PATTERN = re.compile(r'^\s*(?:Caused by: |Uncaught )?(?P<type>(?:[A-Za-z_$][\w$.]*)?(?:Error|Exception|Exit|Interrupt|Warning|Failure|Fault)|panic|fatal error)(?::\s*(?P<message>.*))?$')
+
+
+class StackFrame:
+    """One frame of a stack trace"""
+
+    def __init__(self, file: str, line: int, function: str, language: str):
+        self.file = file
+        self.line = line
+        self.function = function
+        self.language = language
+        # 對應到部署 commit 的 repository 路徑 / 行號（由 code index 填入）
+        self.repo_path: Optional[str] = None
+        self.repo_line: Optional[int] = None
+
+    @property
+    def in_app(self) -> bool:
+        """Whether the frame points at project code rather than a library / runtime"""
+        if any(marker in self.file for marker in LIBRARY_MARKERS) or self.file.startswith(LIBRARY_PATH_PREFIXES):
+            return False
+        if self.language == "java" and self.function.startswith(LIBRARY_JAVA_PACKAGES):
+            return False
+        return True
+
+    @property
+    def key(self) -> str:
+        """Line-independent identity used for fingerprints and de-duplication"""
+        return f"{self.file.split('/')[-1]}:{self.function}"
+
+    def location(self) -> str:
+        path = self.repo_path or self.file
+        line = self.repo_line or self.line
+        return f"{path}:{line}" + (f" in {self.function}" if self.function else "")
+
+
+class ParsedTrace:
+    """Structured form of an error message containing a stack trace"""
+
+    def __init__(
+        self,
+        language: str,
+        exception_type: str,
+        exception_message: str,
+        frames: List[StackFrame],
+        context_lines: List[str],
+        caused_by: List[str],
+        raw_length: int
+    ):
+        self.language = language
+        self.exception_type = exception_type
+        self.exception_message = exception_message
+        # 最內層（拋出例外的位置）在最前面
+        self.frames = frames
+        # trace 以外的訊息（例如 log 前綴）
+        self.context_lines = context_lines
+        self.caused_by = caused_by
+        self.raw_length = raw_length
+
+    @property
+    def app_frames(self) -> List[StackFrame]:
+        """Project frames, or every frame when none is recognized as project code"""
+        app_frames = [frame for frame in self.frames if frame.in_app]
+        return app_frames or self.frames
+
+    @property
+    def headline(self) -> str:
+        return f"{self.exception_type}: {self.exception_message}" if self.exception_message else self.exception_type
+
+    def to_compact(self, max_frames: int = 20, max_context_lines: int = 10) -> str:
+        """Compact text for prompts: headline, project frames (innermost first) with repeats collapsed"""
+        lines = [line for line in self.context_lines[:max_context_lines]]
+        lines.append(self.headline)
+        lines.extend(f"Caused by: {cause}" for cause in self.caused_by)
+
+        app_frames = self.app_frames
+        omitted = len(self.frames) - len(app_frames)
+        header = f"Stack ({self.language}, innermost first"
+        if omitted:
+            header += f", {omitted} library frames omitted"
+        lines.append(header + "):")
+
+        previous, repeats, shown = None, 0, 0
+        for frame in app_frames:
+            location = frame.location()
+            if location == previous:
+                repeats += 1
+                continue
+            if repeats:
+                lines.append(f"  ... repeated {repeats} more times")
+                repeats = 0
+            if shown >= max_frames:
+                lines.append(f"  ... {len(app_frames) - shown} more frames")
+                break
+            lines.append(f"  {location}")
+            previous = location
+            shown += 1
+        if repeats:
+            lines.append(f"  ... repeated {repeats} more times")
+        return "\n".join(lines)
+
+
+def parse_stack_trace(error_message: Optional[str]) -> Optional[ParsedTrace]:
+    """Recognize a Python / Java / JavaScript / Go stack trace; None when the text has no frames"""
+    if not error_message:
+        return None
+
+    lines = error_message.splitlines()
+    frames: List[StackFrame] = []
+    headlines: List[tuple] = []
+    context_lines: List[str] = []
+    language_counts = {}
+    first_frame_index = None
+    previous_line = ""
+
+    for index, line in enumerate(lines):
+        for language, pattern in (FRAME_PATTERNS if FRAME_HINT_PATTERN.search(line) else ()):
+            match = pattern.search(line)
+            if not match:
+                continue
+            file_path = match.group('file')
+            func = (match.groupdict().get('func') or '').strip()
+            if language == "go" and not func:
+                func_match = GO_FUNC_PATTERN.match(previous_line)
+                func = func_match.group('func') if func_match else ''
+                if func_match and context_lines and context_lines[-1] == previous_line.strip():
+                    context_lines.pop()
+            # Java frame 只有檔名，從 package 推回路徑：com.foo.Bar.method -> com/foo/Bar.java
+            if language == "java" and '/' not in file_path and func.count('.') >= 2:
+                file_path = f"{func.rsplit('.', 2)[0].replace('.', '/')}/{file_path}"
+            frames.append(StackFrame(file_path, int(match.group('line')), func, language))
+            language_counts[language] = language_counts.get(language, 0) + 1
+            if first_frame_index is None:
+                first_frame_index = index
+            break
+        else:
+            headline = HEADLINE_PATTERN.match(line)
+            if headline:
+                headlines.append((index, headline.group('type'), (headline.group('message') or '').strip()))
+            elif first_frame_index is None and line.strip() and not line.lstrip().startswith("Traceback"):
+                context_lines.append(line.strip())
+        previous_line = line
+
+    if not frames:
+        return None
+
+    language = max(language_counts, key=language_counts.get)
+    if language == "python":
+        # Python 的最內層 frame 在最後，exception 在 trace 之後
+        frames.reverse()
+        main = headlines[-1] if headlines else None
+        causes = headlines[:-1]
+    else:
+        main = headlines[0] if headlines else None
+        causes = headlines[1:]
+
+    if main:
+        _, exception_type, exception_message = main
+    else:
+        # 找不到標題時用 trace 前的第一行
+        exception_type, exception_message = (context_lines.pop(0) if context_lines else "Error"), ""
+
+    return ParsedTrace(
+        language=language,
+        exception_type=exception_type,
+        exception_message=exception_message,
+        frames=frames,
+        context_lines=context_lines,
+        caused_by=[f"{cause_type}: {cause_message}" if cause_message else cause_type for _, cause_type, cause_message in causes],
+        raw_length=len(error_message)
+    )
@@ -0,0 +1,106 @@
+"""
+Claude stream-json Output Utilities
+"""
+import json
+import logging
+from collections import deque
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def summarize_tool_use(block: dict) -> str:
+    """Translate a tool_use content block into a one-line summary"""
+    name = block.get("name", "")
+    tool_input = block.get("input") or {}
+    if name == "Grep":
+        return f"Grep({tool_input.get('pattern')} in {tool_input.get('path') or tool_input.get('file_path')})"
+    if name == "Read":
+        return f"Read({tool_input.get('path') or tool_input.get('file_path')})"
+    if name == "web_search":
+        return f"Search({tool_input.get('query')})"
+    if name == "Bash":
+        return f"Bash({tool_input.get('command')})"
+    if name == "TodoWrite":
+        todos = tool_input.get("todos") or []
+        return "TodoWrite: " + " -> ".join(str(todo.get("content", "")) for todo in todos)
+    return f"{name}({json.dumps(tool_input, ensure_ascii=False, separators=(',', ':'))})"
+
+
+def parse_json_output(stdout: Optional[str]) -> Tuple[str, Optional[dict]]:
+    """
+    Split `claude --output-format json` output into the result text and the result event
+    (usage / cost); output that is not a result event is returned as is
+    """
+    stdout = stdout or ""
+    try:
+        event = json.loads(stdout)
+    except json.JSONDecodeError:
+        return stdout, None
+    if not isinstance(event, dict) or event.get("type") != "result":
+        return stdout, None
+    return str(event.get("result") or ""), event
+
+
+class StreamJsonParser:
+    """
+    Incremental parser for `claude --output-format stream-json` output.
+    只保留最近的摘要與最後的 result event，長時間的 session 也不會累積整段輸出
+    """
+
+    def __init__(self, max_history: int = 200, on_tool_use: Optional[Callable[[str], None]] = None):
+        self.result: Optional[str] = None
+        self.result_event: Optional[dict] = None
+        self.history = deque(maxlen=max_history)
+        self.event_count = 0
+        self.tool_use_count = 0
+        # 每次 tool_use 以摘要呼叫（例如更新 Slack 進度訊息）
+        self.on_tool_use = on_tool_use
+
+    def feed(self, line: str) -> List[str]:
+        """Parse one output line; returns the human readable lines it produced"""
+        line = line.strip()
+        if not line:
+            return []
+
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            # stderr 合併進來的非 JSON 輸出（例如 CLI 錯誤訊息）原樣保留
+            self.history.append(line)
+            return [line]
+        if not isinstance(event, dict):
+            return []
+
+        self.event_count += 1
+        outputs = []
+        event_type = event.get("type")
+        if event_type == "assistant":
+            for block in (event.get("message") or {}).get("content") or []:
+                if block.get("type") == "text":
+                    outputs.append(block.get("text", ""))
+                elif block.get("type") == "tool_use":
+                    self.tool_use_count += 1
+                    summary = summarize_tool_use(block)
+                    outputs.append(summary)
+                    if self.on_tool_use:
+                        try:
+                            self.on_tool_use(summary)
+                        except Exception as e:
+                            logger.warning(f"on_tool_use callback failed: {e}")
+        elif event_type == "result":
+            self.result_event = event
+            self.result = event.get("result") if event.get("result") is not None else ""
+            outputs.append(f"result:{self.result}")
+
+        self.history.extend(outputs)
+        return outputs
+
+    @property
+    def is_error(self) -> bool:
+        """Whether the final result event reported an error"""
+        return bool(self.result_event and self.result_event.get("is_error"))
+
+    def tail(self, lines: int = 20) -> str:
+        """Last produced lines, for diagnostics when no result event arrived"""
+        return "\n".join(list(self.history)[-lines:])
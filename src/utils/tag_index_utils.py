@@ -0,0 +1,100 @@
+"""
+Production Tag Index Utilities
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from src.utils.git_utils import GitUtils
+
+logger = logging.getLogger(__name__)
+
+
+class ProdTagIndex:
+    """In-memory (and persisted) index of prod-* tags -> commit and creation time"""
+
+    def __init__(self, git_utils: GitUtils, index_path: str, tag_pattern: str = "prod-*"):
+        self.git_utils = git_utils
+        self.index_path = index_path
+        self.tag_pattern = tag_pattern
+        # tag -> {"commit": str, "created_at": int}
+        self.tags: Dict[str, dict] = {}
+        # (created_at, tag) 依時間排序，供 latest / live_at 查詢
+        self._timeline: List[tuple] = []
+        self._timestamps: List[int] = []
+        self._lock = threading.Lock()
+        self._load()
+
+    async def update(self) -> int:
+        """Sync the index with the repository refs; returns the number of added or changed tags"""
+        refs = await self.git_utils.list_tags(self.tag_pattern)
+        changed = 0
+        with self._lock:
+            current = {}
+            for tag, commit_hash, created_at in refs:
+                previous = self.tags.get(tag)
+                if not previous or previous["commit"] != commit_hash:
+                    changed += 1
+                current[tag] = {"commit": commit_hash, "created_at": created_at}
+            removed = len(set(self.tags) - set(current))
+            if not changed and not removed:
+                return 0
+            self.tags = current
+            self._rebuild_timeline()
+
+        logger.info(f"[ProdTagIndex] {changed} tags added/changed, {removed} removed ({len(current)} total)")
+        self._save()
+        return changed
+
+    def latest(self) -> Optional[dict]:
+        """Most recently created prod tag"""
+        with self._lock:
+            if not self._timeline:
+                return None
+            created_at, tag = self._timeline[-1]
+            return {"tag": tag, **self.tags[tag]}
+
+    def live_at(self, moment: datetime) -> Optional[dict]:
+        """Prod tag that was live at the given time (the latest one created at or before it)"""
+        timestamp = int(moment.timestamp())
+        with self._lock:
+            position = bisect.bisect_right(self._timestamps, timestamp)
+            if position == 0:
+                return None
+            created_at, tag = self._timeline[position - 1]
+            return {"tag": tag, **self.tags[tag]}
+
+    def _rebuild_timeline(self):
+        self._timeline = sorted((info["created_at"], tag) for tag, info in self.tags.items())
+        self._timestamps = [created_at for created_at, _ in self._timeline]
+
+    def _load(self):
+        """Load the persisted index so lookups work before the first fetch"""
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            with self._lock:
+                self.tags = data.get("tags", {})
+                self._rebuild_timeline()
+            logger.info(f"[ProdTagIndex] loaded {len(self.tags)} tags from {self.index_path}")
+        except Exception as e:
+            logger.warning(f"[ProdTagIndex] failed to load {self.index_path}: {e}")
+
+    def _save(self):
+        """Persist the index atomically"""
+        try:
+            os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+            tmp_path = f"{self.index_path}.tmp"
+            with self._lock:
+                payload = {"tags": self.tags}
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            logger.warning(f"[ProdTagIndex] failed to save {self.index_path}: {e}")
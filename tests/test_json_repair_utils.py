@@ -0,0 +1,38 @@
+import json
+
+from src.utils.json_repair_utils import extract_json_objects, repair_analysis_output
+
+ANALYSIS = {
+    "root_cause_analysis": "config.debug 沒有預設值",
+    "root_cause_file_codebase": "src/config.py:12",
+    "suspect_commit": "abc1234",
+    "suspect_commit_author": "alice",
+    "recommended_person": "alice",
+    "recommended_reason": "最近修改過 config.py",
+    "suggestion": "補上預設值",
+}
+
+
+def test_result_after_other_json_in_prose():
+    text = f'Note: config was {{"debug": true}}. Result: {json.dumps(ANALYSIS, ensure_ascii=False)}'
+    assert extract_json_objects(text)[0] == {"debug": True}
+    repaired = repair_analysis_output(text)
+    assert repaired is not None
+    assert json.loads(repaired)["root_cause_file_codebase"] == "src/config.py:12"
+
+
+def test_nested_objects_are_not_separate_candidates():
+    text = "```json\n" + json.dumps({**ANALYSIS, "extra": {"debug": True}}) + "\n```"
+    assert len(extract_json_objects(text)) == 1
+    assert repair_analysis_output(text) is not None
+
+
+def test_no_valid_analysis():
+    assert repair_analysis_output('{"debug": true} and {"root_cause_analysis": "x"}') is None
+
+
+def test_non_ascii_prose_does_not_crash():
+    assert repair_analysis_output("根據 {錯誤訊息} 分析") is None
+    assert repair_analysis_output('{"root_cause_analysis": "x", 說明') is None
+    text = f"分析結果如下 {{錯誤}}：{json.dumps(ANALYSIS, ensure_ascii=False)} 以上，é"
+    assert json.loads(repair_analysis_output(text))["suggestion"] == "補上預設值"
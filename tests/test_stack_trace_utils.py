@@ -0,0 +1,29 @@
+from src.utils.stack_trace_utils import StackFrame, parse_stack_trace
+
+
+def test_app_internal_directory_is_in_app():
+    trace = "\n".join([
+        "panic: runtime error: invalid memory address or nil pointer dereference",
+        "",
+        "goroutine 1 [running]:",
+        "main.(*Server).handle(0xc000010000)",
+        "\t/app/internal/handler/server.go:42 +0x1d",
+        "runtime.gopanic(0x4b2f20)",
+        "\t/usr/local/go/src/runtime/panic.go:884 +0x212",
+    ])
+    parsed = parse_stack_trace(trace)
+    frames = {frame.file: frame for frame in parsed.frames}
+    assert frames["/app/internal/handler/server.go"].in_app
+    assert not frames["/usr/local/go/src/runtime/panic.go"].in_app
+    assert [frame.file for frame in parsed.app_frames] == ["/app/internal/handler/server.go"]
+    assert "/app/internal/handler/server.go" in parsed.to_compact()
+
+
+def test_python_internal_package_is_in_app():
+    frame = StackFrame("/app/api/internal/helpers.py", 10, "load", "python")
+    assert frame.in_app
+
+
+def test_node_runtime_frames_are_library():
+    assert not StackFrame("node:internal/process/task_queues", 95, "process", "javascript").in_app
+    assert not StackFrame("internal/main/run_main_module.js", 17, "", "javascript").in_app